@@ -1,18 +1,43 @@
+import bz2
+import codecs
+import gzip
 import json
 import locale
 import logging
+import mmap
 import os
 import re
+import shutil
 import sre_constants
 import string
-
-from zipfile import ZipFile, ZipInfo
+import struct
+import tempfile
+import threading
+import zlib
+try:
+    import lzma
+except ImportError:
+    lzma = None
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+import io
+
+from zipfile import ZipFile, ZipInfo, ZIP_STORED, ZIP_DEFLATED
 from tarfile import TarFile, TarInfo
 
+from pyp2rpm import settings
 from pyp2rpm import utils
 
 logger = logging.getLogger(__name__)
 
+_missing = object()
+
 
 def generator_to_list(fn):
     """This decorator is for flat_list function.
@@ -40,13 +65,20 @@ def flat_list(lst):
 
 
 class ZipWrapper(object):
-    """wrapps ZipFile to behave like TarFile"""
+    """wrapps ZipFile to behave like TarFile
 
-    def __init__(self, obj):
+    If memory mapping of the archive is passed as mapped, members
+    are read directly from the mapping.
+    """
+    local_header = struct.Struct('<4s22xHH')
+    local_header_signature = b'PK\x03\x04'
+
+    def __init__(self, obj, mapped=None):
         if not isinstance(obj, ZipFile):
             raise TypeError("Object must be ZipFile, type of {} is {}".format(
                 obj, type(obj)))
         self._wrapped_obj = obj
+        self._mapped = mapped
 
     def __getattr__(self, attr):
         if attr in self.__dict__:
@@ -62,6 +94,335 @@ class ZipWrapper(object):
     def open(self, *args, **kwargs):
         return self._wrapped_obj(*args, **kwargs)
 
+    def read(self, member, pwd=None):
+        """Returns content of member. Stored members of memory mapped archive
+        are returned as memoryview slices of the mapping without copying,
+        deflated ones are decompressed straight from the mapping.
+        """
+        if not isinstance(member, ZipInfo):
+            member = self._wrapped_obj.getinfo(member)
+        encrypted = member.flag_bits & 0x1
+        if (self._mapped is None or encrypted or
+                member.compress_type not in (ZIP_STORED, ZIP_DEFLATED)):
+            return self._wrapped_obj.read(member, pwd)
+
+        start = member.header_offset
+        signature, name_length, extra_length = self.local_header.unpack(
+            self._mapped[start:start + self.local_header.size])
+        if signature != self.local_header_signature:
+            return self._wrapped_obj.read(member, pwd)
+        start += self.local_header.size + name_length + extra_length
+        data = memoryview(self._mapped)[start:start + member.compress_size]
+        if member.compress_type == ZIP_DEFLATED:
+            data = zlib.decompress(data, -zlib.MAX_WBITS)
+        if zlib.crc32(data) & 0xffffffff != member.CRC:
+            raise IOError('Bad CRC-32 for file {0}.'.format(member.filename))
+        return data
+
+    def close(self):
+        self._wrapped_obj.close()
+        if self._mapped is not None:
+            try:
+                self._mapped.close()
+            except BufferError:
+                # some memoryview is still alive, mapping is unmapped when collected
+                pass
+            self._mapped = None
+
+
+class SeekableTarWrapper(object):
+    """Wraps compressed tar archive to allow random access to its members.
+
+    The compressed stream is decompressed at most once into a spooled
+    temporary file, so reading a member costs O(member size) no matter
+    where in the archive it is. Offsets of the members are persisted
+    into index_file, later runs can answer queries about member names
+    without decompressing the archive at all.
+    """
+    index_format = 1
+
+    def __init__(self, path, index_file=None):
+        self.path = path
+        self.index_file = index_file
+        self._spool = None
+        self._tarfile = None
+        self._members = None
+
+    @property
+    def tarfile(self):
+        """TarFile reading from decompressed spooled temporary file,
+        decompresses the archive on first access.
+        """
+        if self._tarfile is None:
+            self._spool = tempfile.SpooledTemporaryFile(
+                max_size=settings.SEEKABLE_TAR_SPOOL_SIZE)
+            with self._open_decompressed() as stream:
+                shutil.copyfileobj(stream, self._spool)
+            self._spool.seek(0)
+            self._tarfile = TarFile(fileobj=self._spool)
+            logger.debug('Decompressed {0} into spooled temporary file.'.format(self.path))
+        return self._tarfile
+
+    def _open_decompressed(self):
+        with open(self.path, 'rb') as f:
+            magic = f.read(6)
+        if magic.startswith(b'\x1f\x8b'):
+            return gzip.open(self.path, 'rb')
+        elif magic.startswith(b'BZh'):
+            return bz2.BZ2File(self.path, 'rb')
+        elif magic.startswith(b'\xfd7zXZ\x00') and lzma is not None:
+            return lzma.open(self.path, 'rb')
+        return open(self.path, 'rb')
+
+    @property
+    def _source_stamp(self):
+        stat = os.stat(self.path)
+        return [stat.st_size, stat.st_mtime]
+
+    def load_index(self):
+        """Returns members stored in index_file or None if the index
+        is missing or doesn't belong to current version of the archive.
+        """
+        if not self.index_file or not os.path.exists(self.index_file):
+            return None
+        try:
+            with open(self.index_file) as f:
+                index = json.load(f)
+            if index['format'] != self.index_format or index['source'] != self._source_stamp:
+                return None
+            members = []
+            for name, type, size, offset, offset_data, mode, mtime, linkname in \
+                    index['members']:
+                member = TarInfo(name)
+                member.type = type.encode('ascii')
+                member.size = size
+                member.offset = offset
+                member.offset_data = offset_data
+                member.mode = mode
+                member.mtime = mtime
+                member.linkname = linkname
+                members.append(member)
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            logger.debug('Failed to load tar index: {0}.'.format(self.index_file),
+                         exc_info=True)
+            return None
+        logger.debug('Loaded tar index: {0}.'.format(self.index_file))
+        return members
+
+    def save_index(self, members):
+        if not self.index_file:
+            return
+        index = {'format': self.index_format,
+                 'source': self._source_stamp,
+                 'members': [[m.name, m.type.decode('ascii'), m.size, m.offset,
+                              m.offset_data, m.mode, m.mtime, m.linkname]
+                             for m in members]}
+        try:
+            with open(self.index_file, 'w') as f:
+                json.dump(index, f)
+        except (IOError, OSError):
+            logger.debug('Failed to save tar index: {0}.'.format(self.index_file),
+                         exc_info=True)
+
+    def getmembers(self):
+        if self._members is None:
+            self._members = self.load_index()
+            if self._members is None:
+                self._members = self.tarfile.getmembers()
+                self.save_index(self._members)
+        return self._members
+
+    def extractfile(self, member):
+        return self.tarfile.extractfile(member)
+
+    def extract(self, member, path=''):
+        return self.tarfile.extract(member, path=path)
+
+    def extractall(self, path='.', members=None):
+        return self.tarfile.extractall(path=path, members=members)
+
+    def close(self):
+        if self._tarfile is not None:
+            self._tarfile.close()
+            self._tarfile = None
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+
+class ChunkStream(object):
+    """File-like object reading chunks fed from another thread"""
+
+    def __init__(self, max_chunks=64):
+        self.chunks = queue.Queue(max_chunks)
+        self.buffer = b''
+        self.eof = False
+
+    def feed(self, chunk):
+        self.chunks.put(chunk)
+
+    def close(self):
+        self.chunks.put(None)
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            chunk = self.chunks.get()
+            if chunk is None:
+                self.eof = True
+            else:
+                self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def drain(self):
+        """Discards chunks until the stream is closed, so that feed never blocks"""
+        while not self.eof:
+            self.eof = self.chunks.get() is None
+        self.buffer = b''
+
+
+class TarIndexer(object):
+    """Builds index of compressed tar archive from its chunks while it is
+    being downloaded, see download.Download, so that SeekableTarWrapper
+    doesn't have to decompress the archive to list its members.
+    """
+
+    def __init__(self, path, index_file):
+        self.path = path
+        self.index_file = index_file
+        self.stream = ChunkStream()
+        self.members = None
+        self.aborted = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        try:
+            tar = TarFile.open(fileobj=self.stream, mode='r|*')
+            try:
+                self.members = tar.getmembers()
+            finally:
+                tar.close()
+        except BaseException:
+            logger.debug('Failed to index {0} while downloading.'.format(self.path),
+                         exc_info=True)
+        finally:
+            self.stream.drain()
+
+    def feed(self, chunk):
+        self.stream.feed(chunk)
+
+    def abort(self):
+        self.aborted = True
+        self.stream.close()
+
+    def close(self):
+        """Waits until the index is built"""
+        self.stream.close()
+        self.thread.join()
+
+    def save(self):
+        """Saves the index, the archive must be in path already"""
+        if self.members is not None and not self.aborted:
+            SeekableTarWrapper(self.path, self.index_file).save_index(self.members)
+            logger.debug('Index of {0} built while downloading.'.format(self.path))
+
+
+class MemberIndex(object):
+    """In-memory index of archive members, built in a single pass over
+    getmembers() so that queries don't have to rescan the archive.
+    """
+
+    def __init__(self, members=()):
+        self.members = []
+        self.files = []
+        self.by_name = {}
+        self.by_basename = {}
+        self.by_suffix = {}
+        self.directories = set()
+        for member in members:
+            self.add(member)
+
+    @staticmethod
+    def is_dir(member):
+        if isinstance(member, TarInfo):
+            return member.isdir()
+        return member.name.endswith('/')
+
+    @staticmethod
+    def size(member):
+        """Uncompressed size of the member in bytes"""
+        if isinstance(member, TarInfo):
+            return member.size
+        return member.file_size
+
+    def add(self, member):
+        name = member.name
+        self.members.append(member)
+        # keep the first member of given name, same as a linear search would
+        self.by_name.setdefault(name, member)
+        self.by_basename.setdefault(os.path.basename(name), []).append(member)
+        self.by_suffix.setdefault(os.path.splitext(name)[1], []).append(member)
+
+        if self.is_dir(member):
+            self.directories.add(name.rstrip('/'))
+        else:
+            self.files.append(member)
+        parent = os.path.dirname(name.rstrip('/'))
+        while parent and parent not in self.directories:
+            self.directories.add(parent)
+            parent = os.path.dirname(parent)
+
+    def find(self, name, full_path=False):
+        """Returns list of members matching name, either by full path
+        or by basename.
+        """
+        if full_path:
+            return [self.by_name[name]] if name in self.by_name else []
+        return self.by_basename.get(name, [])
+
+
+class ExtractOnOpen(object):
+    """Extracts archive members lazily when code running inside with
+    statement opens a path under directory which wasn't extracted yet.
+    Must be used while the archive is open.
+    """
+
+    def __init__(self, archive, directory):
+        self.archive = archive
+        self.directory = os.path.abspath(directory)
+        self.extracted_bytes = 0
+
+    def fill_in(self, path):
+        if not isinstance(path, utils.str_classes) or os.path.exists(path):
+            return
+        name = os.path.relpath(os.path.abspath(path), self.directory)
+        if name.startswith(os.pardir):
+            return
+        member = self.archive.index.by_name.get(name)
+        if member is not None:
+            logger.debug('Extracting missing file on demand: {0}.'.format(name))
+            self.archive.handle.extract(member, path=self.directory)
+            self.extracted_bytes += MemberIndex.size(member)
+
+    def _wrap(self, open_fce):
+        def opener(file, *args, **kwargs):
+            self.fill_in(file)
+            return open_fce(file, *args, **kwargs)
+        return opener
+
+    def __enter__(self):
+        self._builtin_open, self._io_open = builtins.open, io.open
+        builtins.open = self._wrap(self._builtin_open)
+        io.open = self._wrap(self._io_open)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        builtins.open, io.open = self._builtin_open, self._io_open
+
 
 class Archive(object):
 
@@ -73,10 +434,13 @@ class Archive(object):
         a.get_contents_of_file('spam.py')
     """
 
-    def __init__(self, local_file):
+    def __init__(self, local_file, seekable=None):
         self.file = local_file
         self.name, self.suffix = os.path.splitext(local_file)
+        self.seekable = settings.SEEKABLE_TAR if seekable is None else seekable
         self.handle = None
+        self.index = MemberIndex()
+        self.content_cache = utils.LRUCache(settings.ARCHIVE_CONTENT_CACHE_SIZE)
         ZipInfo.name = ZipInfo.filename
 
     @property
@@ -87,6 +451,15 @@ class Archive(object):
     def is_tar(self):
         return self.suffix in ['.tar', '.gz', '.bz2', '.tgz', '.xz']
 
+    @property
+    def is_compressed_tar(self):
+        return self.suffix in ['.gz', '.bz2', '.tgz', '.xz']
+
+    @property
+    def index_file(self):
+        """Path of the persisted member index of seekable tar archive"""
+        return '{0}.pyp2rpm-index'.format(self.file)
+
     @property
     def is_egg(self):
         return self.suffix == '.egg'
@@ -98,18 +471,36 @@ class Archive(object):
     def open(self):
         try:
             if self.extractor_cls == ZipFile:
-                self.handle = ZipWrapper(self.extractor_cls(self.file))
+                self.handle = ZipWrapper(self.extractor_cls(self.file), self._map_file())
+            elif self.seekable and self.is_compressed_tar:
+                self.handle = SeekableTarWrapper(self.file, self.index_file)
             else:
                 self.handle = self.extractor_cls.open(self.file)
+            self.index = MemberIndex(self.handle.getmembers())
         except BaseException:
             self.handle = None
+            self.index = MemberIndex()
             logger.error('Failed to open archive: {0}.'.format(self.file), exc_info=True)
 
         return self
 
+    def _map_file(self):
+        """Returns read-only memory mapping of the archive or None if it
+        can't be mapped.
+        """
+        try:
+            with open(self.file, 'rb') as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (EnvironmentError, ValueError):
+            # e.g. empty files can't be mapped
+            logger.debug('Failed to map archive: {0}.'.format(self.file), exc_info=True)
+            return None
+
     def close(self):
         if self.handle:
             self.handle.close()
+        # content read through closed handle must not outlive it
+        self.content_cache.clear()
 
     def __enter__(self):
         return self.open()
@@ -135,7 +526,6 @@ class Archive(object):
 
         return file_cls
 
-    @utils.memoize_by_args
     def get_content_of_file(self, name, full_path=False):  # TODO: log if file can't be opened
         """Returns content of file from archive.
 
@@ -148,24 +538,31 @@ class Archive(object):
         Returns:
             Content of the file with given name or None, if no such.
         """
+        key = (name, bool(full_path))
+        content = self.content_cache.get(key, _missing)
+        if content is not _missing:
+            return content
+
+        content = None
         if self.handle:
-            for member in self.handle.getmembers():
-                if (full_path and member.name == name)\
-                        or (not full_path and os.path.basename(member.name) == name):
-                    extracted = self.handle.extractfile(member)
-                    return extracted.read().decode(locale.getpreferredencoding())
+            for member in self.index.find(name, full_path):
+                if self.is_zip:
+                    raw = self.handle.read(member)
+                else:
+                    raw = self.handle.extractfile(member).read()
+                content = codecs.decode(raw, locale.getpreferredencoding())
+                break
+            self.content_cache.set(key, content)
 
-        return None
+        return content
 
     def extract_file(self, name, full_path=False, directory="."):
         """Extract a member from the archive to the specified working directory.
         Behaviour of name and pull_path is the same as in function get_content_of_file.
         """
         if self.handle:
-            for member in self.handle.getmembers():
-                if (full_path and member.name == name or
-                        not full_path and os.path.basename(member.name) == name):
-                    self.handle.extract(member, path=directory)   # TODO handle KeyError exception
+            for member in self.index.find(name, full_path):
+                self.handle.extract(member, path=directory)   # TODO handle KeyError exception
 
     def extract_all(self, directory=".", members=None):
         """Extract all member from the archive to the specified working directory."""
@@ -184,15 +581,14 @@ class Archive(object):
             suffixes = [suffixes]
 
         if self.handle:
-            for member in self.handle.getmembers():
-                if os.path.splitext(member.name)[1] in suffixes:
+            for suffix in suffixes:
+                if suffix in self.index.by_suffix:
+                    return True
+            # .zip files don't list directories themselves, therefore
+            # we have to look at implied directories to find e.g. .egg-info
+            for directory in self.index.directories:
+                if os.path.splitext(directory)[1] in suffixes:
                     return True
-                else:
-                    # hack for .zip files, where directories are not returned
-                    # themselves, therefore we can't find e.g. .egg-info
-                    for suffix in suffixes:
-                        if '{0}/'.format(suffix) in member.name:
-                            return True
 
         return False
 
@@ -219,10 +615,8 @@ class Archive(object):
         found = []
 
         if self.handle:
-            for member in self.handle.getmembers():
-                if isinstance(member, TarInfo) and member.isdir():
-                    pass  # for TarInfo files, filter out directories
-                elif (full_path and compiled_re.search(member.name))\
+            for member in self.index.files:
+                if (full_path and compiled_re.search(member.name))\
                         or (not full_path and compiled_re.search(os.path.basename(member.name))):
                     found.append(member.name)
 
@@ -238,19 +632,11 @@ class Archive(object):
         found = set()
 
         if self.handle:
-            for member in self.handle.getmembers():
-                # zipfiles only list directories => have to work around that
-                if isinstance(member, ZipInfo):
-                    to_match = os.path.dirname(member.name)
-                # tarfiles => only match directories
-                elif isinstance(member, TarInfo) and member.isdir():
-                    to_match = member.name
-                else:
-                    to_match = None
-                if to_match:
-                    if ((full_path and compiled_re.search(to_match))
-                            or (not full_path and compiled_re.search(os.path.basename(to_match)))):
-                        found.add(to_match)
+            # zipfiles don't list directories => match implied directories
+            for directory in self.index.directories:
+                if ((full_path and compiled_re.search(directory))
+                        or (not full_path and compiled_re.search(os.path.basename(directory)))):
+                    found.add(directory)
 
         return list(found)
 
@@ -0,0 +1,420 @@
+"""
+Asyncio backend of PyPI package getter. Metadata lookups and downloads of
+many packages run concurrently in one event loop over a shared pool of
+keep-alive connections, limited globally and per host.
+
+The event loop runs in its own thread, AsyncPypiGetter is a synchronous
+facade with the interface of PypiDownloader. Requires Python 3.
+"""
+
+import asyncio
+import atexit
+import inspect
+import logging
+import os
+import ssl
+import threading
+import http.client as httplib
+import xmlrpc.client as xmlrpclib
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlsplit
+
+from pyp2rpm import download
+from pyp2rpm import exceptions
+from pyp2rpm import settings
+from pyp2rpm.package_getters import PypiDownloader
+
+logger = logging.getLogger(__name__)
+
+REDIRECTS = (301, 302, 303, 307, 308)
+
+
+class EventLoopThread(object):
+    """Event loop running forever in a daemon thread"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, coroutine):
+        """Runs coroutine in the loop and waits for its result,
+        must not be called from the loop thread.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+
+def event_loop():
+    """Returns EventLoopThread shared by all the async getters"""
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            _event_loop = EventLoopThread()
+            atexit.register(_event_loop.stop)
+        return _event_loop
+
+
+class HttpPool(object):
+    """Minimal asynchronous HTTP/1.1 client keeping idle connections open.
+    At most limit requests run at once, at most per_host of them to one host.
+    """
+
+    def __init__(self, limit=None, per_host=None, timeout=None):
+        self.limit = limit or settings.ASYNC_LIMIT
+        self.per_host = per_host or settings.ASYNC_PER_HOST_LIMIT
+        self.timeout = timeout or settings.PYPI_TIMEOUT
+        self.idle = {}
+        self.semaphore = None
+        self.host_semaphores = {}
+        self.connections = 0
+
+    def limits(self, key):
+        # semaphores are created in the loop that uses them
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.limit)
+        if key not in self.host_semaphores:
+            self.host_semaphores[key] = asyncio.Semaphore(self.per_host)
+        return self.semaphore, self.host_semaphores[key]
+
+    @staticmethod
+    def key(url):
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        return parts.scheme, parts.hostname, port
+
+    async def connect(self, key):
+        """Returns (reader, writer, reused) of idle or new connection"""
+        idle = self.idle.get(key, [])
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        scheme, host, port = key
+        context = ssl.create_default_context() if scheme == 'https' else None
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=context), self.timeout)
+        self.connections += 1
+        return reader, writer, False
+
+    async def readline(self, reader):
+        return await asyncio.wait_for(reader.readline(), self.timeout)
+
+    async def read_head(self, reader):
+        line = await self.readline(reader)
+        if not line:
+            raise ConnectionResetError('Connection closed by server.')
+        parts = line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+        headers = {}
+        while True:
+            line = await self.readline(reader)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return parts[0], int(parts[1]), parts[2] if len(parts) > 2 else '', headers
+
+    @staticmethod
+    async def deliver(sink, chunk):
+        """Passes chunk to sink, waits for it if sink returns awaitable"""
+        result = sink(chunk)
+        if inspect.isawaitable(result):
+            await result
+
+    async def read_exactly(self, reader, size, sink):
+        while size:
+            chunk = await asyncio.wait_for(
+                reader.read(min(size, settings.DOWNLOAD_CHUNK_SIZE)), self.timeout)
+            if not chunk:
+                raise httplib.IncompleteRead(b'', size)
+            await self.deliver(sink, chunk)
+            size -= len(chunk)
+
+    async def read_body(self, reader, headers, sink):
+        """Passes body to sink in chunks.
+        Returns:
+            True if the connection can be reused
+        """
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            while True:
+                size = int((await self.readline(reader)).split(b';')[0].strip(), 16)
+                if not size:
+                    while (await self.readline(reader)) not in (b'\r\n', b'\n', b''):
+                        pass
+                    return True
+                await self.read_exactly(reader, size, sink)
+                await self.readline(reader)
+        if 'content-length' in headers:
+            await self.read_exactly(reader, int(headers['content-length']), sink)
+            return True
+        while True:
+            chunk = await asyncio.wait_for(reader.read(settings.DOWNLOAD_CHUNK_SIZE),
+                                           self.timeout)
+            if not chunk:
+                return False
+            await self.deliver(sink, chunk)
+
+    async def send(self, method, url, body, headers):
+        """Sends request, retries once with a new connection if an idle
+        connection turns out to be closed.
+        Returns:
+            (reader, writer, (version, status, reason, headers))
+        """
+        key = self.key(url)
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        lines = ['{0} {1} HTTP/1.1'.format(method, path),
+                 'Host: {0}'.format(parts.netloc),
+                 'User-Agent: pyp2rpm',
+                 'Accept-Encoding: identity']
+        lines.extend('{0}: {1}'.format(name, value) for name, value in headers.items())
+        if body is not None:
+            lines.append('Content-Length: {0}'.format(len(body)))
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b'')
+        while True:
+            reader, writer, reused = await self.connect(key)
+            try:
+                writer.write(request)
+                await writer.drain()
+                return reader, writer, await self.read_head(reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if not reused:
+                    raise
+
+    async def fetch(self, method, url, body=None, headers=None, sink=None, on_status=None):
+        """Makes HTTP request, follows redirects.
+        Args:
+            method: HTTP method
+            url: URL
+            body: bytes sent to server
+            headers: dict of additional headers
+            sink: function called with chunks of response body, by default
+                the body is returned. If it returns awaitable, the next
+                chunk is read after it's done
+            on_status: function called with status and headers before
+                the body is read, the body is discarded if it returns False
+        Returns:
+            (status, headers, body or None if sink is used)
+        """
+        for redirect in range(settings.ASYNC_MAX_REDIRECTS + 1):
+            key = self.key(url)
+            chunks = []
+            semaphore, host_semaphore = self.limits(key)
+            async with semaphore:
+                async with host_semaphore:
+                    reader, writer, (version, status, reason, response_headers) = \
+                        await self.send(method, url, body, headers or {})
+                    redirected = status in REDIRECTS and 'location' in response_headers
+                    try:
+                        wanted = not redirected and (
+                            on_status is None or
+                            on_status(status, response_headers) is not False)
+                        reusable = await self.read_body(
+                            reader, response_headers,
+                            (sink or chunks.append) if wanted else lambda chunk: None)
+                    except BaseException:
+                        writer.close()
+                        raise
+                    if reusable and version == 'HTTP/1.1' and \
+                            response_headers.get('connection', '').lower() != 'close':
+                        self.idle.setdefault(key, []).append((reader, writer))
+                    else:
+                        writer.close()
+            if not redirected:
+                return status, response_headers, None if sink else b''.join(chunks)
+            url = urljoin(url, response_headers['location'])
+            if status == 303:
+                method, body = 'GET', None
+        raise HTTPError(url, status, 'Too many redirects', response_headers, None)
+
+    def close(self):
+        for connections in self.idle.values():
+            for reader, writer in connections:
+                writer.close()
+        self.idle = {}
+
+
+class AsyncPypiClient(object):
+    """Asynchronous client for PyPI XMLRPC API, concurrent calls with
+    the same arguments share one request and results are memoized.
+    """
+
+    def __init__(self, url=None, http=None):
+        self.url = url or settings.PYPI_URL
+        self.http = http or HttpPool()
+        self.memo = {}
+
+    def __repr__(self):
+        return '<AsyncPypiClient {0}>'.format(self.url)
+
+    async def call(self, method, *args):
+        key = (method, args)
+        if key not in self.memo:
+            self.memo[key] = asyncio.ensure_future(self.request(method, args))
+        try:
+            return await asyncio.shield(self.memo[key])
+        except xmlrpclib.Fault:
+            raise
+        except Exception:
+            # don't remember failures of the connection
+            self.memo.pop(key, None)
+            raise
+
+    async def request(self, method, args):
+        status, headers, body = await self.http.fetch(
+            'POST', self.url, xmlrpclib.dumps(args, method, allow_none=True).encode('utf-8'),
+            {'Content-Type': 'text/xml'})
+        if status != 200:
+            raise xmlrpclib.ProtocolError(self.url, status, '', headers)
+        return xmlrpclib.loads(body)[0][0]
+
+    async def resolve(self, name, version=None):
+        """Looks up everything pyp2rpm needs to know about the package concurrently,
+        results are memoized for AsyncPypiGetter.
+        Returns:
+            version of the package, the latest if version is None
+        Raises:
+            NoSuchPackageException if there is no such package or version
+        """
+        calls = [self.call('package_releases', name)]
+        if version is not None:
+            calls += [self.call('release_urls', name, version),
+                      self.call('release_data', name, version)]
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        for result in results[:2]:
+            if isinstance(result, BaseException):
+                raise result
+        if not results[0]:
+            raise exceptions.NoSuchPackageException(
+                'Package "{0}" could not be found on PyPI.'.format(name))
+        if version is None:
+            version = results[0][0]
+            await asyncio.gather(self.call('release_urls', name, version),
+                                 self.call('release_data', name, version),
+                                 return_exceptions=True)
+        elif results[1] == []:
+            raise exceptions.NoSuchPackageException(
+                'Package with name "{0}" and version "{1}" could not be found on PyPI.'.format(
+                    name, version))
+        return version
+
+    def sync(self):
+        """Returns synchronous facade of the client"""
+        return SyncClient(self)
+
+
+class SyncClient(object):
+    """Synchronous facade of AsyncPypiClient usable by get_url etc."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def __repr__(self):
+        return repr(self.client)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *args: event_loop().run(self.client.call(name, *args))
+
+
+class AsyncDownload(download.Download):
+    """Download transferring the file through HttpPool"""
+
+    def __init__(self, http, *args, **kwargs):
+        super(AsyncDownload, self).__init__(*args, **kwargs)
+        self.http = http
+
+    def transfer(self):
+        offset = os.path.getsize(self.part)
+        headers = {'Range': 'bytes={0}-'.format(offset)} if offset else {}
+        with open(self.part, 'ab') as f:
+            def on_status(status, response_headers):
+                if status == 416 and offset:
+                    return False
+                if status >= 400:
+                    raise HTTPError(self.url, status, 'Download failed', response_headers, None)
+                if offset and status != 206:
+                    logger.debug('{0} does not support ranges, downloading it again.'.format(
+                        self.url))
+                    self.restart()
+                    f.seek(0)
+                    f.truncate()
+
+            def write(chunk):
+                f.write(chunk)
+                self.feed(chunk)
+
+            def sink(chunk):
+                # file and consumers (TarIndexer) may block, keep them off the loop
+                return asyncio.get_event_loop().run_in_executor(None, write, chunk)
+
+            status = event_loop().run(
+                self.http.fetch('GET', self.url, headers=headers, sink=sink,
+                                on_status=on_status))[0]
+        if status == 416:
+            # part file is complete or doesn't belong to the url, start over
+            self.restart()
+            open(self.part, 'wb').close()
+            self.transfer()
+
+
+class AsyncPypiGetter(PypiDownloader):
+    """PypiDownloader whose requests go through the shared event loop,
+    so that more getters used from more threads share its connections
+    and limits.
+    """
+
+    def __init__(self, client, name, version=None, save_dir=None):
+        """
+        Args:
+            client: AsyncPypiClient
+        """
+        self.async_client = client
+        try:
+            version = event_loop().run(client.resolve(name, version))
+        except xmlrpclib.ProtocolError as e:
+            raise SystemExit('Failed to connect to server: {0}'.format(e))
+        super(AsyncPypiGetter, self).__init__(client.sync(), name, version, save_dir)
+
+    def download_file(self, url, path, digests=None, consumers=()):
+        return AsyncDownload(self.async_client.http, url, path, digests, consumers).run()
+
+
+_client = None
+
+
+def shared_client():
+    """Returns AsyncPypiClient shared by all the async getters"""
+    global _client
+    with _event_loop_lock:
+        if _client is None:
+            _client = AsyncPypiClient()
+        return _client
+
+
+def resolve_many(client, packages):
+    """Resolves versions of many packages concurrently.
+    Args:
+        client: AsyncPypiClient
+        packages: list of (name, version or None) tuples
+    Returns:
+        list of versions or exceptions, one for each package
+    """
+    async def resolve():
+        return await asyncio.gather(*[client.resolve(name, version)
+                                      for name, version in packages],
+                                    return_exceptions=True)
+    return event_loop().run(resolve())
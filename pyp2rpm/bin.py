@@ -1,8 +1,9 @@
 import getpass
 import logging
 import os
+import sys
 
-from pyp2rpm.convertor import Convertor
+from pyp2rpm.convertor import Convertor, BatchConvertor
 from pyp2rpm import settings
 from pyp2rpm import utils
 from pyp2rpm.logger import register_file_log_handler, register_console_log_handler
@@ -16,7 +17,9 @@ CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 @click.command(context_settings=CONTEXT_SETTINGS)
 @click.option('-t',
               help='Template file (jinja2 format) to render (default: "{0}").'
-              'Search order is 1) filesystem, 2) default templates.'.format(
+              'Search order is 1) filesystem, 2) default templates. Comma separated list '
+              'of templates renders the package into each of them, downloading it once and '
+              'extracting it once per distro (specfiles are named NAME-TEMPLATE.spec).'.format(
                   settings.DEFAULT_TEMPLATE),
               metavar='TEMPLATE')
 @click.option('-o',
@@ -63,48 +66,149 @@ CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 @click.option('--venv / --no-venv',
               default=True,
               help='Enable / disable metadata extraction from virtualenv (default: enabled).')
-@click.argument('package', nargs=1)
-def main(package, v, d, s, r, proxy, srpm, p, b, o, t, venv):
+@click.option('--seekable-tar',
+              help='Decompress tar archives only once and keep index of their members '
+              'next to them in SAVE_PATH.',
+              is_flag=True)
+@click.option('--batch',
+              help='Convert all the packages listed in FILE, one PACKAGE[==VERSION] per line '
+              '("-" reads standard input). PACKAGE argument, -r and -v are not used.',
+              type=click.File('r'),
+              default=None,
+              metavar='FILE')
+@click.option('--download-jobs',
+              help='Number of packages downloaded at the same time in --batch mode (default: 1).',
+              type=click.IntRange(1),
+              default=1,
+              metavar='N')
+@click.option('--extract-jobs',
+              help='Number of packages whose metadata are extracted at the same time in --batch '
+              'mode, each in its own process (default: 1).',
+              type=click.IntRange(1),
+              default=1,
+              metavar='N')
+@click.option('--as-completed',
+              help='Output specfiles in --batch mode as soon as they are done, not in the order '
+              'of FILE.',
+              is_flag=True)
+@click.option('--mirror',
+              help='Get packages from local PyPI mirror in DIR (PEP 503 simple index or '
+              'bandersnatch mirror) instead of PyPI.',
+              type=click.Path(exists=True, file_okay=False),
+              default=None,
+              metavar='DIR')
+@click.option('--no-cache',
+              help='Extract metadata even if they are cached from previous conversion of the '
+              'same package file.',
+              is_flag=True)
+@click.option('--static-metadata',
+              help='Get metadata from setup.cfg, pyproject.toml, PKG-INFO and static '
+              'analysis of setup.py without running it when possible.',
+              is_flag=True)
+@click.argument('package', nargs=1, required=False)
+def main(package, v, d, s, r, proxy, srpm, p, b, o, t, venv, seekable_tar, batch,
+         download_jobs, extract_jobs, as_completed, mirror, no_cache,
+         static_metadata):
     """Convert PyPI package to RPM specfile or SRPM.
 
     \b
     \b\bArguments:
     PACKAGE             Provide PyPI name of the package or path to compressed source file."""
+    if package is None and batch is None:
+        raise click.UsageError('Missing argument "package".')
     register_file_log_handler('/tmp/pyp2rpm-{0}.log'.format(getpass.getuser()))
 
     if srpm or s:
         settings.CONSOLE_LOGGING = True
         register_console_log_handler()
 
+    if seekable_tar:
+        settings.SEEKABLE_TAR = True
+
+    if no_cache:
+        settings.METADATA_CACHE = False
+
+    if static_metadata:
+        settings.STATIC_METADATA = True
+
+    templates = t.split(',') if t else [settings.DEFAULT_TEMPLATE]
+    if len(templates) > 1 and batch is not None:
+        raise click.UsageError('Only one template can be used with --batch.')
+
     distro = o
-    if t in settings.KNOWN_DISTROS:
+    if len(templates) == 1 and t in settings.KNOWN_DISTROS:
         distro = t
 
     logger = logging.getLogger(__name__)
 
     logger.info('Pyp2rpm initialized.')
 
+    convertor_kwargs = dict(save_dir=d,
+                            template=templates[0],
+                            distro=distro,
+                            base_python_version=b,
+                            python_versions=p,
+                            proxy=proxy,
+                            venv=venv,
+                            mirror=mirror)
+
+    if batch is not None:
+        failed = 0
+        settings.SETUP_PY_WORKERS = extract_jobs
+        batch_convertor = BatchConvertor(batch,
+                                         download_jobs=download_jobs,
+                                         extract_jobs=extract_jobs,
+                                         ordered=not as_completed,
+                                         **convertor_kwargs)
+        for result in batch_convertor.convert():
+            if not result.succeeded:
+                failed += 1
+                logger.info('Conversion of {0} failed. See log for more info.'.format(
+                    result.package))
+                continue
+            try:
+                output_spec(result.convertor, result.generate(), d, None, s, srpm)
+            except Exception:
+                failed += 1
+                logger.error('Failed to render specfile of {0}.'.format(result.package),
+                             exc_info=True)
+        logger.info("That's all folks!")
+        if failed:
+            sys.exit(1)
+        return
+
     convertor = Convertor(package=package,
                           version=v,
-                          save_dir=d,
-                          template=t or settings.DEFAULT_TEMPLATE,
-                          distro=distro,
-                          base_python_version=b,
-                          python_versions=p,
                           rpm_name=r,
-                          proxy=proxy,
-                          venv=venv)
+                          **convertor_kwargs)
 
     logger.debug('Convertor: {0} created. Trying to convert.'.format(convertor))
-    converted = convertor.convert()
+    if len(templates) > 1:
+        for target, converted in convertor.convert_targets(templates):
+            suffix = '-' + os.path.basename(target.template)[:-len('.spec')]
+            output_spec(target, converted, d, r, s, srpm, suffix)
+        logger.info("That's all folks!")
+        return
+    convertor.download()
+    converted = convertor.generate(convertor.extract())
     logger.debug('Convertor: {0} succesfully converted.'.format(convertor))
 
+    output_spec(convertor, converted, d, r, s, srpm)
+    logger.info("That's all folks!")
+
+
+def output_spec(convertor, converted, d, r, s, srpm, suffix=''):
+    """Saves specfile (and builds SRPM) or prints it to stdout as it's
+    rendered, converted is iterable of its chunks. Suffix is appended to
+    the name of the specfile.
+    """
+    logger = logging.getLogger(__name__)
     if srpm or s:
         if r:
-            spec_name = r + '.spec'
+            spec_name = r + suffix + '.spec'
         else:
             prefix = 'python-' if not convertor.name.startswith('python-') else ''
-            spec_name = prefix + convertor.name + '.spec'
+            spec_name = prefix + convertor.name + suffix + '.spec'
         logger.info('Using name: {0} for specfile.'.format(spec_name))
         if d == settings.DEFAULT_PKG_SAVE_PATH:
             # default save_path is rpmbuild tree so we want to save spec
@@ -118,11 +222,8 @@ def main(package, v, d, s, r, proxy, srpm, p, b, o, t, venv):
             os.makedirs(spec_dir)
         logger.debug('Opening specfile: {0}.'.format(spec_path))
 
-        if not utils.PY3:
-            converted = converted.encode('utf-8')
-        with open(spec_path, 'w') as f:
-            f.write(converted)
-            logger.info('Specfile saved at: {0}.'.format(spec_path))
+        utils.write_spec(spec_path, converted)
+        logger.info('Specfile saved at: {0}.'.format(spec_path))
 
         if srpm:
             msg = utils.build_srpm(spec_path, d)
@@ -130,9 +231,5 @@ def main(package, v, d, s, r, proxy, srpm, p, b, o, t, venv):
 
     else:
         logger.debug('Printing specfile to stdout.')
-        if utils.PY3:
-            print(converted)
-        else:
-            print(converted.encode('utf-8'))
+        utils.print_spec(converted)
         logger.debug('Specfile printed.')
-    logger.info("That's all folks!")
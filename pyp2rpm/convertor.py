@@ -1,6 +1,8 @@
+import copy
 import logging
 import os
 import sys
+import threading
 try:
     import urllib2 as urllib
 except ImportError:
@@ -19,20 +21,106 @@ try:
     import dnf
 except ImportError:
     dnf = None
+try:
+    from pyp2rpm import async_getter
+except (ImportError, SyntaxError):
+    # Python 2
+    async_getter = None
 
 import jinja2
 import pprint
 
+from pyp2rpm import download_cache
 from pyp2rpm import exceptions
+from pyp2rpm import extract_distribution
 from pyp2rpm import filters
+from pyp2rpm import metadata_cache
 from pyp2rpm import metadata_extractors
 from pyp2rpm import name_convertor
+from pyp2rpm import package_data
 from pyp2rpm import package_getters
+from pyp2rpm import pypi_client
+from pyp2rpm import scheduler
 from pyp2rpm import settings
 
 logger = logging.getLogger(__name__)
 
 
+def async_getter_enabled(proxy=None):
+    """True if packages are got from PyPI by async_getter, see
+    settings.ASYNC_GETTER. Its HttpPool can't connect through proxy, so
+    the synchronous getter is used if proxy is set.
+    """
+    if not settings.ASYNC_GETTER or async_getter is None:
+        return False
+    if proxy:
+        logger.warning('Asynchronous PyPI getter does not support proxy, '
+                       'using synchronous one.')
+        return False
+    return True
+
+
+class TemplateBytecodeCache(jinja2.FileSystemBytecodeCache):
+    """Compiled templates stored in a directory, jinja2 rejects them when
+    the checksum of the template source changes. The cache is only an
+    optimization, so failures to read or write it are not fatal.
+    """
+
+    def load_bytecode(self, bucket):
+        try:
+            jinja2.FileSystemBytecodeCache.load_bytecode(self, bucket)
+        except Exception:
+            logger.debug('Failed to load compiled template {0}.'.format(bucket.key),
+                         exc_info=True)
+            bucket.reset()
+
+    def dump_bytecode(self, bucket):
+        try:
+            jinja2.FileSystemBytecodeCache.dump_bytecode(self, bucket)
+        except (IOError, OSError):
+            logger.debug('Failed to save compiled template {0}.'.format(bucket.key),
+                         exc_info=True)
+
+
+def new_jinja_environment():
+    """Creates jinja2 environment which loads templates from filesystem
+    and default templates and has pyp2rpm filters registered. Compiled
+    templates are kept in settings.CACHE_DIR if settings.TEMPLATE_CACHE is set.
+    """
+    bytecode_cache = None
+    if settings.TEMPLATE_CACHE:
+        bytecode_cache = TemplateBytecodeCache(os.path.join(settings.CACHE_DIR, 'templates'))
+        try:
+            download_cache.makedirs(bytecode_cache.directory)
+        except OSError:
+            logger.debug('Failed to create template cache.', exc_info=True)
+            bytecode_cache = None
+
+    jinja_env = jinja2.Environment(loader=jinja2.ChoiceLoader([
+        jinja2.FileSystemLoader(['/']),
+        jinja2.PackageLoader('pyp2rpm', 'templates'), ]),
+        bytecode_cache=bytecode_cache)
+
+    for filter in filters.__all__:
+        jinja_env.filters[filter.__name__] = filter
+    return jinja_env
+
+
+_jinja_env = None
+_jinja_env_lock = threading.Lock()
+
+
+def jinja_environment():
+    """Returns jinja2 environment shared by all convertors of the process,
+    so each template is loaded and compiled at most once.
+    """
+    global _jinja_env
+    with _jinja_env_lock:
+        if _jinja_env is None:
+            _jinja_env = new_jinja_environment()
+        return _jinja_env
+
+
 class Convertor(object):
     """Object that takes care of the actual process of converting the package."""
 
@@ -42,25 +130,47 @@ class Convertor(object):
                  distro=settings.DEFAULT_DISTRO,
                  base_python_version=settings.DEFAULT_PYTHON_VERSION,
                  python_versions=[],
-                 rpm_name=None, proxy=None, venv=True):
+                 rpm_name=None, proxy=None, venv=True, mirror=None):
         self.package = package
         self.version = version
         self.save_dir = save_dir
         self.base_python_version = base_python_version
         self.python_versions = list(python_versions)
-        self.template = template
+        self.template = self.template_file(template)
         self.distro = distro
-        if not self.template.endswith('.spec'):
-            self.template = '{0}.spec'.format(self.template)
         self.rpm_name = rpm_name
         self.proxy = proxy
         self.venv = venv
+        self.mirror = mirror
         self.pypi = True
         suffix = os.path.splitext(self.package)[1]
         if os.path.exists(self.package) and suffix in settings.ARCHIVE_SUFFIXES\
                 and not os.path.isdir(self.package):
             self.pypi = False
 
+    @staticmethod
+    def template_file(template):
+        """Returns file name of the template given by name or path"""
+        if not template.endswith('.spec'):
+            return '{0}.spec'.format(template)
+        return template
+
+    def target(self, template):
+        """Returns Convertor rendering the same package into another template.
+        It shares the downloaded file and, if the template uses the same
+        distro, the metadata extractor with this Convertor. Templates named
+        after a known distro use its conversion rules, others use self.distro.
+        """
+        convertor = copy.copy(self)
+        convertor.template = self.template_file(template)
+        if template in settings.KNOWN_DISTROS:
+            convertor.distro = template
+        if convertor.distro != self.distro:
+            # names in extracted metadata are converted according to the distro
+            for attribute in ('_name_convertor', '_metadata_extractor'):
+                convertor.__dict__.pop(attribute, None)
+        return convertor
+
     def merge_versions(self, data):
         """Merges python versions specified in command lines options with
         extracted versions, checks if some of the versions is not > 2 if EPEL6 template
@@ -91,10 +201,16 @@ class Convertor(object):
         Returns:
             endered RPM SPECFILE.
         """
+        self.download()
+        return self.render(self.extract())
+
+    def download(self):
+        """Gets the package file into save_dir."""
         # move file into position
         try:
             local_file = self.getter.get()
-        except (exceptions.NoSuchPackageException, OSError) as e:
+        except (exceptions.NoSuchPackageException, exceptions.DigestMismatchException,
+                OSError) as e:
             logger.error(
                 'Failed and exiting:', exc_info=True)
             logger.info('Pyp2rpm failed. See log for more info.')
@@ -105,30 +221,104 @@ class Convertor(object):
         self.name, self.version = self.getter.get_name_version()
 
         self.local_file = local_file
+
+    def convert_targets(self, templates):
+        """Renders the package into every template. The package is
+        downloaded once and its metadata are extracted once for every
+        distro of the templates, see target.
+        Returns:
+            list of (Convertor, generator of specfile chunks) pairs in the
+            order of templates, see generate
+        """
+        self.download()
+        extracted = {}
+        converted = []
+        for template in templates:
+            convertor = self.target(template)
+            if convertor.distro not in extracted:
+                extracted[convertor.distro] = convertor.extract_metadata()
+            data = extracted[convertor.distro].copy()
+            convertor.merge_versions(data)
+            converted.append((convertor, convertor.generate(data)))
+        return converted
+
+    def extract_metadata(self):
+        """Extracts metadata of the downloaded package.
+        Returns:
+            PackageData object, python versions are not merged yet.
+        """
+        cache = metadata_cache.metadata_cache()
+        if cache is not None:
+            # the extractor isn't created before lookup, it would read the archive
+            key = metadata_cache.cache_key(
+                self.local_file, self.venv, self.distro, dnf is not None, self.rpm_name,
+                self.base_python_version, self.client is not None,
+                settings.STATIC_METADATA)
+            cached = cache.get(key)
+            if cached is not None:
+                logger.info('Using cached metadata of {0}.'.format(self.local_file))
+                data = package_data.PackageData(self.local_file, self.name, self.rpm_name,
+                                                self.version)
+                data.data.update(cached)
+                data.data['local_file'] = self.local_file
+                return data
+
         data = self.metadata_extractor.extract_data(self.client)
+        if data.incomplete:
+            logger.info('Not caching metadata of {0}, failed: {1}.'.format(
+                self.local_file, ', '.join(sorted(data.incomplete))))
+        elif cache is not None:
+            cache.put(key, data.data)
         logger.debug('Extracted metadata:')
         logger.debug(pprint.pformat(data.data))
-        self.merge_versions(data)
-
-        jinja_env = jinja2.Environment(loader=jinja2.ChoiceLoader([
-            jinja2.FileSystemLoader(['/']),
-            jinja2.PackageLoader('pyp2rpm', 'templates'), ]))
+        return data
 
-        for filter in filters.__all__:
-            jinja_env.filters[filter.__name__] = filter
+    def extract(self):
+        """Extracts metadata of the downloaded package.
+        Returns:
+            PackageData object with python versions merged.
+        """
+        data = self.extract_metadata()
+        self.merge_versions(data)
+        return data
 
+    @property
+    def jinja_template(self):
+        """Returns the template, searching the filesystem first and then the
+        default template dir.
+        """
         try:
-            jinja_template = jinja_env.get_template(
+            jinja_template = self.jinja_env.get_template(
                 os.path.abspath(self.template))
         except jinja2.exceptions.TemplateNotFound:
             # absolute path not found => search in default template dir
             logger.warn('Template: {0} was not found in {1} using default template dir.'.format(
                 self.template, os.path.abspath(self.template)))
 
-            jinja_template = jinja_env.get_template(self.template)
+            jinja_template = self.jinja_env.get_template(self.template)
             logger.info('Using default template: {0}.'.format(self.template))
+        return jinja_template
+
+    def render(self, data):
+        """Renders RPM SPECFILE from extracted metadata using the template."""
+        return self.jinja_template.render(data=data, name_convertor=name_convertor)
 
-        return jinja_template.render(data=data, name_convertor=name_convertor)
+    def generate(self, data):
+        """Renders RPM SPECFILE from extracted metadata using the template
+        piece by piece, so it can be written out without being kept in memory.
+        Returns:
+            generator of unicode chunks of RPM SPECFILE
+        """
+        return self.jinja_template.generate(data=data, name_convertor=name_convertor)
+
+    @property
+    def jinja_env(self):
+        """Returns jinja2 environment with pyp2rpm filters. Always returns
+        the same instance.
+        """
+        if not hasattr(self, '_jinja_env'):
+            self._jinja_env = jinja_environment()
+        return self._jinja_env
 
     @property
     def getter(self):
@@ -145,6 +335,21 @@ class Convertor(object):
                 self._getter = package_getters.LocalFileGetter(
                     self.package,
                     self.save_dir)
+            elif self.mirror:
+                logger.debug('{0} doesnt exists as local file trying mirror {1}.'.format(
+                    self.package, self.mirror))
+                self._getter = package_getters.MirrorGetter(
+                    self.mirror,
+                    self.package,
+                    self.version,
+                    self.save_dir)
+            elif async_getter_enabled(self.proxy):
+                logger.debug('{0} doesnt exists as local file trying PyPI.'.format(self.package))
+                self._getter = async_getter.AsyncPypiGetter(
+                    async_getter.shared_client(),
+                    self.package,
+                    self.version,
+                    self.save_dir)
             else:
                 logger.debug('{0} doesnt exists as local file trying PyPI.'.format(self.package))
                 self._getter = package_getters.PypiDownloader(
@@ -182,26 +387,41 @@ class Convertor(object):
         return self._name_convertor
 
     @property
-    def metadata_extractor(self):
-        """Returns an instance of proper MetadataExtractor subclass. 
-        Always returns the same instance.
-
-        Returns:
-            The proper MetadataExtractor subclass according to local file suffix.
+    def metadata_extractor_cls(self):
+        """Returns the proper MetadataExtractor subclass according to local
+        file suffix and content. If settings.STATIC_METADATA is on, static
+        extractors are created to find out whether they can be used and kept
+        for metadata_extractor.
         """
         if not hasattr(self, '_local_file'):
             raise AttributeError(
-                'local_file attribute must be set before calling metadata_extractor')
-        if not hasattr(self, '_metadata_extractor'):
+                'local_file attribute must be set before calling metadata_extractor_cls')
+        if not hasattr(self, '_metadata_extractor_cls'):
             if self.local_file.endswith('.whl'):
                 logger.info('Getting metadata from wheel using WheelMetadataExtractor.')
-                extractor_cls = metadata_extractors.WheelMetadataExtractor
-            else:
-                logger.info('Getting metadata from setup.py using DistMetadataExtractor.')
-                extractor_cls = metadata_extractors.DistMetadataExtractor
+                self._metadata_extractor_cls = metadata_extractors.WheelMetadataExtractor
+                return self._metadata_extractor_cls
+
+            if settings.STATIC_METADATA and not self.local_file.endswith('.egg'):
+                for extractor_cls, source in (
+                        (metadata_extractors.DeclarativeMetadataExtractor, 'declarative metadata'),
+                        (metadata_extractors.AstMetadataExtractor, 'setup.py')):
+                    static_extractor = extractor_cls(*self.extractor_args)
+                    if static_extractor.is_static:
+                        logger.info('Getting metadata from {0} using {1}.'.format(
+                            source, extractor_cls.__name__))
+                        self._metadata_extractor = static_extractor
+                        self._metadata_extractor_cls = extractor_cls
+                        return self._metadata_extractor_cls
+
+            logger.info('Getting metadata from setup.py using DistMetadataExtractor.')
+            self._metadata_extractor_cls = metadata_extractors.DistMetadataExtractor
+
+        return self._metadata_extractor_cls
 
-            self._metadata_extractor = extractor_cls(
-                self.local_file,
+    @property
+    def extractor_args(self):
+        return (self.local_file,
                 self.name,
                 self.name_convertor,
                 self.version,
@@ -209,6 +429,18 @@ class Convertor(object):
                 self.venv,
                 self.base_python_version)
 
+    @property
+    def metadata_extractor(self):
+        """Returns an instance of proper MetadataExtractor subclass, see
+        metadata_extractor_cls. Always returns the same instance.
+
+        Returns:
+            The proper MetadataExtractor subclass according to local file suffix.
+        """
+        extractor_cls = self.metadata_extractor_cls
+        if not hasattr(self, '_metadata_extractor'):
+            self._metadata_extractor = extractor_cls(*self.extractor_args)
+
         return self._metadata_extractor
 
     @property
@@ -226,10 +458,10 @@ class Convertor(object):
             transport = ProxyTransport()
         if not hasattr(self, '_client'):
             transport = None
-            if self.pypi:
+            if self.pypi and not self.mirror:
                 if self.proxy:
                     logger.info('Using provided proxy: {0}.'.format(self.proxy))
-                self._client = xmlrpclib.ServerProxy(settings.PYPI_URL, transport=transport)
+                self._client = pypi_client.PypiClient(settings.PYPI_URL, transport)
                 self._client_set = True
             else:
                 self._client = None
@@ -237,6 +469,197 @@ class Convertor(object):
         return self._client
 
 
+class ConversionResult(object):
+    """Result of conversion of one package of the batch, either extracted
+    data or error is set. The specfile is rendered only when it's used.
+    """
+
+    def __init__(self, package, convertor, data=None, error=None):
+        self.package = package
+        self.convertor = convertor
+        self.data = data
+        self.error = error
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+    @property
+    def specfile(self):
+        return self.convertor.render(self.data)
+
+    def generate(self):
+        """Returns generator of chunks of the specfile, see Convertor.generate"""
+        return self.convertor.generate(self.data)
+
+
+class BatchConvertor(object):
+    """Converts many packages. All the Convertors share one PyPI client,
+    one jinja2 environment with compiled templates and one name convertor.
+    Data of all the PyPI packages are fetched from PyPI in advance in
+    one or two requests.
+
+    Packages are converted one by one unless more download_jobs or
+    extract_jobs are requested. Then downloads run in a pool of
+    download_jobs threads and metadata extraction in a pool of extract_jobs
+    threads, each of them running setup.py in its own process. Specfiles
+    are rendered in the thread consuming the results.
+    """
+
+    def __init__(self, packages, download_jobs=1, extract_jobs=1, max_pending=None,
+                 ordered=True, **kwargs):
+        """
+        Args:
+            packages: iterable of package specs, see parse_package_spec
+            download_jobs: number of packages downloaded at the same time
+            extract_jobs: number of packages whose metadata are extracted
+                at the same time
+            max_pending: maximum number of packages being converted or
+                waiting for the consumer, see scheduler.Scheduler
+            ordered: True to return results in the order of packages,
+                False to return them as soon as they are done
+            kwargs: arguments passed to every Convertor
+        """
+        self.packages = packages
+        self.download_jobs = download_jobs
+        self.extract_jobs = extract_jobs
+        self.max_pending = max_pending
+        self.ordered = ordered
+        self.kwargs = kwargs
+        self.jinja_env = jinja_environment()
+        self.lock = threading.Lock()
+        self._client = None
+        self._name_convertor = None
+
+    @staticmethod
+    def parse_package_spec(spec):
+        """Parses package spec, which is PyPI name of the package optionally
+        followed by ==VERSION or path to local file.
+        Returns:
+            tuple (package, version or None)
+        """
+        spec = spec.strip()
+        if '==' in spec and not os.path.exists(spec):
+            package, version = spec.split('==', 1)
+            return package.strip(), version.strip()
+        return spec, None
+
+    @staticmethod
+    def read_package_specs(lines):
+        """Yields package specs from lines of batch file, empty lines and
+        comments starting with # are skipped.
+        """
+        for line in lines:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                yield line
+
+    @staticmethod
+    def error_of(exception):
+        """Returns the exception Convertor exited with"""
+        if isinstance(exception, SystemExit) and isinstance(exception.code, BaseException):
+            return exception.code
+        return exception
+
+    @property
+    def client(self):
+        """Returns the PyPI client shared by all the Convertors"""
+        with self.lock:
+            if self._client is None:
+                self._client = pypi_client.PypiClient(settings.PYPI_URL)
+            return self._client
+
+    def prefetch(self, specs):
+        """Fetches data of all the PyPI packages in specs"""
+        if self.kwargs.get('mirror'):
+            return
+        packages = [self.parse_package_spec(spec) for spec in specs]
+        packages = [(package, version or self.kwargs.get('version'))
+                    for package, version in packages if not os.path.exists(package)]
+        if not packages:
+            return
+        if async_getter_enabled(self.kwargs.get('proxy')):
+            # getters resolve all the packages concurrently
+            async_getter.resolve_many(async_getter.shared_client(), packages)
+        elif isinstance(self.client, pypi_client.PypiClient):
+            self.client.prefetch_packages(packages)
+
+    @property
+    def parallel(self):
+        if self.download_jobs == 1 and self.extract_jobs == 1:
+            return False
+        if not settings.SETUP_PY_ISOLATION:
+            logger.warning('setup.py can be run in parallel only in isolated processes, '
+                           'converting packages one by one.')
+            return False
+        return True
+
+    def convertor(self, spec):
+        """Returns Convertor of the package spec sharing the resources of the batch"""
+        package, version = self.parse_package_spec(spec)
+        kwargs = dict(self.kwargs)
+        kwargs['version'] = version or kwargs.get('version')
+        convertor = Convertor(package=package, **kwargs)
+        convertor._jinja_env = self.jinja_env
+        with self.lock:
+            if self._name_convertor is None:
+                self._name_convertor = convertor.name_convertor
+        convertor._name_convertor = self._name_convertor
+        if convertor.pypi and not convertor.mirror:
+            convertor._client = self.client
+        return convertor
+
+    def convert(self):
+        """Converts the packages.
+        Returns:
+            generator of ConversionResult, one for each package spec, in the
+            same order unless ordered is False
+        """
+        specs = list(self.read_package_specs(self.packages))
+        self.prefetch(specs)
+        if self.parallel:
+            return self.convert_parallel(specs)
+        return self.convert_sequential(specs)
+
+    def convert_sequential(self, specs):
+        for spec in specs:
+            convertor = None
+            try:
+                convertor = self.convertor(spec)
+                convertor.download()
+                yield ConversionResult(spec, convertor, data=convertor.extract())
+            except KeyboardInterrupt:
+                raise
+            except BaseException as e:
+                # SystemExit and pyp2rpm exceptions don't stop the batch
+                logger.error('Failed to convert {0}.'.format(spec), exc_info=True)
+                yield ConversionResult(spec, convertor, error=self.error_of(e))
+
+    def download(self, spec):
+        convertor = self.convertor(spec)
+        convertor.download()
+        return convertor
+
+    @staticmethod
+    def extract(convertor):
+        return convertor, convertor.extract()
+
+    def convert_parallel(self, specs):
+        # fork processes running setup.py before any thread is started
+        extract_distribution.setup_py_pool().start()
+        stages = [scheduler.Stage('download', self.download, self.download_jobs),
+                  scheduler.Stage('extract', self.extract, self.extract_jobs)]
+        batch_scheduler = scheduler.Scheduler(stages, self.max_pending, self.ordered)
+        for result in batch_scheduler.run(specs):
+            if not result.succeeded:
+                logger.error('Failed to convert {0}.'.format(result.item),
+                             exc_info=(type(result.error), result.error, None))
+                yield ConversionResult(result.item, None, error=self.error_of(result.error))
+                continue
+            convertor, data = result.value
+            yield ConversionResult(result.item, convertor, data=data)
+
+
 class ProxyTransport(xmlrpclib.Transport):
     """This class serves as Proxy Transport for XMLRPC server."""
 
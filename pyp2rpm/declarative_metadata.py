@@ -0,0 +1,258 @@
+"""
+Parsers of declarative package metadata shipped in sdists: PKG-INFO,
+bundled .egg-info files, setup.cfg and pyproject.toml. All of them return
+metadata as a dict of setup() arguments.
+"""
+
+import email
+import logging
+import re
+try:
+    import configparser
+except ImportError:
+    import ConfigParser as configparser
+try:
+    import tomllib as toml
+except ImportError:
+    try:
+        import tomli as toml
+    except ImportError:
+        toml = None
+
+logger = logging.getLogger(__name__)
+
+# setup.cfg options that hold lists and whether they are ';' separated
+# when given on single line
+SETUP_CFG_LISTS = {'install_requires': True,
+                   'setup_requires': True,
+                   'tests_require': True,
+                   'packages': False,
+                   'py_modules': False,
+                   'scripts': False,
+                   'classifiers': False}
+
+SETUP_CFG_OPTIONS = {'metadata': ['license', 'description', 'long_description', 'url',
+                                  'home_page', 'classifiers'],
+                     'options': ['install_requires', 'setup_requires', 'tests_require',
+                                 'packages', 'py_modules', 'scripts', 'test_suite']}
+
+BUILD_BACKEND_REQUIRES = ['setuptools', 'wheel']
+
+
+class Directive(object):
+    """Value of setup.cfg option which can't be resolved from setup.cfg
+    itself, e.g. attr: or find:
+    """
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+
+def parse_list(value, semicolon=False):
+    """Parses list value of setup.cfg option."""
+    if '\n' in value.strip():
+        items = value.splitlines()
+    else:
+        items = value.split(';' if semicolon else ',')
+    return [item.strip() for item in items
+            if item.strip() and not item.strip().startswith('#')]
+
+
+def read_setup_cfg(content):
+    """Returns RawConfigParser of setup.cfg content or None if it is invalid"""
+    parser = configparser.RawConfigParser()
+    try:
+        if hasattr(parser, 'read_string'):
+            parser.read_string(content)
+        else:
+            import StringIO
+            parser.readfp(StringIO.StringIO(content))
+    except configparser.Error:
+        logger.debug('Failed to parse setup.cfg.', exc_info=True)
+        return None
+    return parser
+
+
+def parse_setup_cfg(content, read_file=None):
+    """Parses [metadata] and [options] of setup.cfg.
+    Args:
+        content: content of setup.cfg
+        read_file: function returning content of file in the archive for
+            file: directive, relative to setup.cfg
+    Returns:
+        tuple (dict of setup() arguments, set of arguments present but not
+        resolvable)
+    """
+    parser = read_setup_cfg(content)
+    if parser is None:
+        return {}, set()
+
+    arguments = {}
+    unresolved = set()
+    for section, options in SETUP_CFG_OPTIONS.items():
+        if not parser.has_section(section):
+            continue
+        for option in options:
+            if not parser.has_option(section, option):
+                continue
+            value = parser.get(section, option)
+            key = 'url' if option == 'home_page' else option
+            directive = re.match(r'^\s*(file|attr|find|find_namespace):\s*(.*)$', value, re.S)
+            if directive and directive.group(1) == 'file' and read_file is not None:
+                files = [read_file(name.strip()) for name in directive.group(2).split(',')]
+                if None in files:
+                    unresolved.add(key)
+                    continue
+                value = '\n'.join(files)
+            elif directive and directive.group(1).startswith('find'):
+                arguments[key] = Directive(directive.group(1), dict(
+                    parser.items('options.packages.find')
+                    if parser.has_section('options.packages.find') else []))
+                continue
+            elif directive:
+                unresolved.add(key)
+                continue
+
+            if key in SETUP_CFG_LISTS:
+                value = parse_list(value, SETUP_CFG_LISTS[key])
+            arguments[key] = value
+
+    if parser.has_section('options.entry_points'):
+        arguments['entry_points'] = dict(
+            (group, parse_list(value)) for group, value in parser.items('options.entry_points'))
+    return arguments, unresolved
+
+
+def parse_command_options(content, command):
+    """Parses options of distutils command, e.g. [bdist_rpm], from setup.cfg.
+    Option names are normalized the way distutils does it.
+    Returns:
+        dict of options
+    """
+    parser = read_setup_cfg(content)
+    if parser is None or not parser.has_section(command):
+        return {}
+    return dict((option.replace('-', '_'), value)
+                for option, value in parser.items(command))
+
+
+def parse_pkg_info(content):
+    """Parses PKG-INFO (or METADATA) file.
+    Returns:
+        tuple (dict of setup() arguments, set of dynamic arguments)
+    """
+    message = email.message_from_string(content)
+    arguments = {}
+    fields = {'Summary': 'description',
+              'License': 'license',
+              'Home-page': 'url'}
+    for field, key in fields.items():
+        value = message.get(field)
+        if value and value != 'UNKNOWN':
+            arguments[key] = value
+    arguments['classifiers'] = message.get_all('Classifier') or []
+
+    description = message.get('Description')
+    if not description or description == 'UNKNOWN':
+        description = message.get_payload()
+    if description and description.strip():
+        arguments['long_description'] = description
+
+    requires = [req for req in message.get_all('Requires-Dist') or []
+                if 'extra ==' not in req.replace('extra==', 'extra ==')]
+    metadata_version = message.get('Metadata-Version', '1.0')
+    dynamic = set(field.lower() for field in message.get_all('Dynamic') or [])
+    try:
+        # since Metadata-Version 2.2 missing fields are really missing
+        declarative = tuple(map(int, metadata_version.split('.')[:2])) >= (2, 2)
+    except ValueError:
+        declarative = False
+    if requires or (declarative and 'requires-dist' not in dynamic):
+        arguments['install_requires'] = requires
+    return arguments, dynamic
+
+
+def parse_requires_txt(content):
+    """Parses requires.txt of .egg-info, requirements of extras are skipped
+    and conditional requirements get their environment marker.
+    """
+    requires = []
+    marker = None
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('['):
+            section = line.strip('[]')
+            extra, _, marker = section.partition(':')
+            if extra:
+                marker = False  # requirements of an extra
+            continue
+        if marker is False:
+            continue
+        requires.append('{0}; {1}'.format(line, marker) if marker else line)
+    return requires
+
+
+def parse_pyproject(content):
+    """Parses [project] and [build-system] tables of pyproject.toml.
+    Returns:
+        tuple (dict of setup() arguments, set of dynamic arguments)
+    """
+    if toml is None:
+        logger.debug('No TOML parser available, skipping pyproject.toml.')
+        return {}, set()
+    try:
+        pyproject = toml.loads(content)
+    except Exception:
+        logger.debug('Failed to parse pyproject.toml.', exc_info=True)
+        return {}, set()
+
+    arguments = {}
+    build_system = pyproject.get('build-system', {})
+    if 'requires' in build_system:
+        arguments['setup_requires'] = [
+            req for req in build_system['requires']
+            if re.split(r'[^\w.-]', req, 1)[0].lower() not in BUILD_BACKEND_REQUIRES]
+
+    project = pyproject.get('project')
+    if not project:
+        return arguments, set()
+
+    dynamic = set(project.get('dynamic', []))
+    fields = {'dependencies': 'install_requires',
+              'classifiers': 'classifiers',
+              'description': 'description'}
+    for field, key in fields.items():
+        if field in project:
+            arguments[key] = project[field]
+        elif field not in dynamic:
+            arguments[key] = [] if field != 'description' else None
+
+    license = project.get('license')
+    if isinstance(license, dict):
+        license = license.get('text')
+    if license:
+        arguments['license'] = license
+
+    urls = project.get('urls', {})
+    for name, url in urls.items():
+        if name.lower() in ('homepage', 'home-page', 'home'):
+            arguments['url'] = url
+
+    entry_points = dict(project.get('entry-points', {}))
+    for field, group in (('scripts', 'console_scripts'), ('gui-scripts', 'gui_scripts')):
+        if field in project:
+            entry_points[group] = project[field]
+    if entry_points or not dynamic & set(['scripts', 'gui-scripts', 'entry-points']):
+        arguments['entry_points'] = dict(
+            (group, ['{0} = {1}'.format(name, target) for name, target in items.items()])
+            for group, items in entry_points.items())
+
+    setuptools = pyproject.get('tool', {}).get('setuptools', {})
+    if isinstance(setuptools.get('packages'), list):
+        arguments['packages'] = setuptools['packages']
+    if 'py-modules' in setuptools:
+        arguments['py_modules'] = setuptools['py-modules']
+    return arguments, dynamic
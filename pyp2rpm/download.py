@@ -0,0 +1,177 @@
+"""
+Streaming download of package files. Digests are computed from the chunks
+as they arrive, interrupted downloads are resumed using HTTP Range requests.
+"""
+
+import hashlib
+import logging
+import os
+import socket
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+try:
+    import urllib.request as request
+    from urllib.error import HTTPError, URLError
+except ImportError:
+    import urllib2 as request
+    from urllib2 import HTTPError, URLError
+
+from pyp2rpm import settings
+from pyp2rpm.exceptions import DigestMismatchException
+
+logger = logging.getLogger(__name__)
+
+RETRIABLE_ERRORS = (URLError, httplib.HTTPException, socket.error, socket.timeout)
+
+
+class Digests(object):
+    """Computes digests of the stream fed in chunks and compares them with
+    the expected ones.
+    """
+
+    def __init__(self, expected):
+        self.expected = dict((algorithm, digest.lower()) for algorithm, digest
+                             in expected.items() if algorithm in hashlib_algorithms())
+        self.hashes = dict((algorithm, hashlib.new(algorithm)) for algorithm in self.expected)
+
+    def feed(self, chunk):
+        for hash_object in self.hashes.values():
+            hash_object.update(chunk)
+
+    def verify(self, name):
+        """Raises DigestMismatchException if any of the digests differs"""
+        for algorithm, hash_object in self.hashes.items():
+            if hash_object.hexdigest() != self.expected[algorithm]:
+                raise DigestMismatchException(
+                    '{0} digest of {1} is {2}, expected {3}.'.format(
+                        algorithm, name, hash_object.hexdigest(), self.expected[algorithm]))
+
+
+def hashlib_algorithms():
+    return getattr(hashlib, 'algorithms_available', ('md5', 'sha1', 'sha256', 'sha512'))
+
+
+def read_chunks(f, chunk_size=None):
+    return iter(lambda: f.read(chunk_size or settings.DOWNLOAD_CHUNK_SIZE), b'')
+
+
+class Download(object):
+    """Downloads url to path through path.part file, which is kept if the
+    download fails, so that the next attempt requests only the missing
+    bytes. Every chunk is passed to consumers as soon as it arrives.
+    """
+
+    def __init__(self, url, path, digests=None, consumers=()):
+        """
+        Args:
+            url: URL to download
+            path: where to save the file
+            digests: dict of expected digests, e.g. {'sha256': '...'}
+            consumers: objects with feed(chunk), close() and abort() methods,
+                fed with the whole file from the first byte, closed when the
+                file is verified and aborted if they would miss a part of it
+        """
+        self.url = url
+        self.path = path
+        self.part = path + '.part'
+        self.digests = Digests(digests or {})
+        self.consumers = list(consumers)
+
+    def feed(self, chunk):
+        self.digests.feed(chunk)
+        for consumer in self.consumers:
+            consumer.feed(chunk)
+
+    def abort(self):
+        """Stops feeding consumers, they would not get the whole file"""
+        for consumer in self.consumers:
+            consumer.abort()
+        self.consumers = []
+
+    def restart(self):
+        """Throws away the partial download"""
+        if os.path.exists(self.part):
+            os.remove(self.part)
+        self.digests = Digests(self.digests.expected)
+        self.abort()
+
+    def open(self, offset):
+        """Returns response to request of url from offset"""
+        headers = {'User-Agent': 'pyp2rpm'}
+        if offset:
+            headers['Range'] = 'bytes={0}-'.format(offset)
+        return request.urlopen(request.Request(self.url, headers=headers),
+                               timeout=settings.PYPI_TIMEOUT)
+
+    def transfer(self):
+        """Downloads missing bytes into the part file"""
+        offset = os.path.getsize(self.part)
+        try:
+            response = self.open(offset)
+        except HTTPError as e:
+            if e.code != 416 or not offset:
+                raise
+            # part file is complete or doesn't belong to the url, start over
+            self.restart()
+            offset = 0
+            response = self.open(offset)
+        try:
+            if offset and response.getcode() != 206:
+                logger.debug('{0} does not support ranges, downloading it again.'.format(self.url))
+                self.restart()
+            length = response.info().get('Content-Length')
+            received = 0
+            with open(self.part, 'ab') as f:
+                for chunk in read_chunks(response):
+                    f.write(chunk)
+                    self.feed(chunk)
+                    received += len(chunk)
+            if length is not None and received < int(length):
+                # connection closed before the whole response arrived
+                raise httplib.IncompleteRead(b'', int(length) - received)
+        finally:
+            response.close()
+
+    def run(self):
+        """Downloads the file, verifies its digests and moves it to path.
+        Raises:
+            DigestMismatchException if the file doesn't have the expected digests
+            URLError, HTTPException or socket.error if the download failed
+                settings.DOWNLOAD_RETRIES times
+        """
+        if os.path.exists(self.part):
+            logger.info('Resuming download of {0}.'.format(self.url))
+            with open(self.part, 'rb') as f:
+                for chunk in read_chunks(f):
+                    self.feed(chunk)
+        else:
+            open(self.part, 'wb').close()
+
+        for attempt in range(settings.DOWNLOAD_RETRIES + 1):
+            try:
+                self.transfer()
+                break
+            except RETRIABLE_ERRORS as e:
+                if attempt == settings.DOWNLOAD_RETRIES or \
+                        isinstance(e, HTTPError) and e.code < 500:
+                    self.abort()
+                    raise
+                logger.warning('Download of {0} interrupted, resuming.'.format(self.url),
+                               exc_info=True)
+
+        try:
+            self.digests.verify(self.url)
+        except DigestMismatchException:
+            self.restart()
+            raise
+        os.rename(self.part, self.path)
+        for consumer in self.consumers:
+            consumer.close()
+        return self.path
+
+
+def download(url, path, digests=None, consumers=()):
+    """Downloads url to path, see Download"""
+    return Download(url, path, digests, consumers).run()
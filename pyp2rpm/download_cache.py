@@ -0,0 +1,298 @@
+"""
+Cache of downloaded packages addressed by their digests published on PyPI,
+so that converting the same release again doesn't download anything.
+"""
+
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from pyp2rpm import settings
+
+logger = logging.getLogger(__name__)
+
+
+def file_digests(path, algorithms):
+    """Returns dict of hex digests of the file computed by algorithms"""
+    hashes = dict((algorithm, hashlib.new(algorithm)) for algorithm in algorithms)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            for hash_object in hashes.values():
+                hash_object.update(chunk)
+    return dict((algorithm, hash_object.hexdigest()) for algorithm, hash_object in hashes.items())
+
+
+def makedirs(path):
+    """Creates directory path unless it exists, threads safe"""
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+# ioctl cloning a file, _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+# errors meaning the method isn't supported for these files, not a failure of the copy
+UNSUPPORTED_ERRNOS = set(getattr(errno, name) for name in (
+    'EXDEV', 'EINVAL', 'ENOSYS', 'ENOTSUP', 'EOPNOTSUPP', 'ENOTTY', 'EBADF', 'EPERM')
+    if hasattr(errno, name))
+
+
+def reflink(source, destination):
+    """Shares extents of source with destination (btrfs, xfs), no data is copied"""
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, 'FICLONE not available')
+    fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+
+
+def copy_file_range(source, destination):
+    """Copies in kernel, server side on NFS 4.2 and SMB"""
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, 'copy_file_range not available')
+    while os.copy_file_range(source.fileno(), destination.fileno(), COPY_CHUNK_SIZE):
+        pass
+
+
+def sendfile(source, destination):
+    """Copies in kernel without passing the data through userspace"""
+    if not hasattr(os, 'sendfile') or not sys.platform.startswith('linux'):
+        raise OSError(errno.ENOSYS, 'sendfile not available')
+    offset = 0
+    while True:
+        sent = os.sendfile(destination.fileno(), source.fileno(), offset, COPY_CHUNK_SIZE)
+        if not sent:
+            break
+        offset += sent
+
+
+def buffered_copy(source, destination):
+    shutil.copyfileobj(source, destination, 1024 * 1024)
+
+
+COPY_METHODS = [reflink, copy_file_range, sendfile, buffered_copy]
+
+
+def clone_file(source, destination):
+    """Copies source to destination by the cheapest method supported by
+    the filesystems, file metadata are copied as by shutil.copy2.
+    Returns:
+        name of the method used
+    """
+    with open(source, 'rb') as src:
+        with open(destination, 'wb') as dst:
+            for method in COPY_METHODS:
+                try:
+                    method(src, dst)
+                    break
+                except (IOError, OSError) as e:
+                    if method is buffered_copy or e.errno not in UNSUPPORTED_ERRNOS:
+                        raise
+                    logger.debug('Failed to copy {0} by {1}: {2}'.format(
+                        source, method.__name__, e))
+                    # start over, the method might have failed in the middle
+                    src.seek(0)
+                    dst.seek(0)
+                    dst.truncate()
+    shutil.copystat(source, destination)
+    return method.__name__
+
+
+def link_or_copy(source, destination, link=True):
+    """Hardlinks source to destination, copies it if the link can't be made
+    (e.g. different filesystem). Destination is replaced atomically.
+    Args:
+        link: if False, source is always copied, so that changes of
+            destination don't affect it
+    Returns:
+        'link' or name of the copy method used, see clone_file
+    """
+    temp = '{0}.{1}.{2}.tmp'.format(destination, os.getpid(), threading.current_thread().ident)
+    if os.path.lexists(temp):
+        os.remove(temp)
+    method = None
+    if link:
+        try:
+            os.link(source, temp)
+            method = 'link'
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+    if method is None:
+        try:
+            method = clone_file(source, temp)
+        except Exception:
+            if os.path.lexists(temp):
+                os.remove(temp)
+            raise
+    os.rename(temp, destination)
+    return method
+
+
+class DownloadCache(object):
+    """Directory of files named by their digests, one name for every
+    algorithm in settings.DOWNLOAD_CACHE_DIGESTS, all hardlinked to the
+    same file. Least recently used files are removed when the cache
+    grows over max_size bytes.
+    """
+
+    def __init__(self, directory=None, max_size=None, algorithms=None):
+        self.directory = directory or os.path.join(settings.CACHE_DIR, 'downloads')
+        self.max_size = max_size or settings.DOWNLOAD_CACHE_SIZE
+        self.algorithms = algorithms or settings.DOWNLOAD_CACHE_DIGESTS
+
+    def path(self, algorithm, digest):
+        digest = digest.lower()
+        return os.path.join(self.directory, algorithm, digest[:2], digest)
+
+    def get(self, digests):
+        """Returns path of the cached file with digests or None.
+        Args:
+            digests: dict of hex digests, e.g. {'md5': '...', 'sha256': '...'}
+        """
+        for algorithm in self.algorithms:
+            if digests.get(algorithm):
+                path = self.path(algorithm, digests[algorithm])
+                if os.path.isfile(path):
+                    self.touch(path)
+                    return path
+        return None
+
+    @staticmethod
+    def touch(path):
+        """Marks the file as used now. Access time is used, mtime is part of
+        the stamp of indexes of seekable tar archives.
+        """
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+
+    def put(self, file_path, digests=None, link=True):
+        """Adds the file to the cache, the file itself is left in place.
+        Args:
+            file_path: path of the file
+            digests: digests the file is expected to have
+            link: if False, the file is copied into the cache instead of
+                hardlinked, so that its later changes don't affect the cache
+        Returns:
+            path of the cached file or None if it doesn't have expected digests
+        """
+        computed = file_digests(file_path, self.algorithms)
+        for algorithm, digest in (digests or {}).items():
+            if algorithm in computed and digest.lower() != computed[algorithm]:
+                logger.warning('{0} digest of {1} is {2}, expected {3}.'.format(
+                    algorithm, file_path, computed[algorithm], digest))
+                return None
+
+        cached = None
+        for algorithm in self.algorithms:
+            path = self.path(algorithm, computed[algorithm])
+            makedirs(os.path.dirname(path))
+            if not os.path.isfile(path):
+                link_or_copy(cached or file_path, path, link=link or cached is not None)
+            cached = cached or path
+        self.touch(cached)
+        logger.debug('{0} stored in download cache as {1}.'.format(file_path, cached))
+        self.evict(keep=cached)
+        return cached
+
+    def entries(self):
+        """Returns list of (atime, size, paths) of the cached files,
+        all the hardlinks of one file are one entry.
+        """
+        entries = {}
+        for root, dirs, files in os.walk(self.directory):
+            if root == self.directory and 'partial' in dirs:
+                # downloads in progress
+                dirs.remove('partial')
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entry = entries.setdefault((stat.st_dev, stat.st_ino),
+                                           [stat.st_atime, stat.st_size, []])
+                entry[0] = max(entry[0], stat.st_atime)
+                entry[2].append(path)
+        return sorted(entries.values())
+
+    def evict(self, keep=None):
+        """Removes least recently used files until the cache fits into max_size,
+        file keep is never removed.
+        """
+        entries = self.entries()
+        size = sum(entry[1] for entry in entries)
+        for atime, entry_size, paths in entries:
+            if size <= self.max_size:
+                break
+            if keep in paths:
+                continue
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            logger.debug('{0} evicted from download cache.'.format(paths[0]))
+            size -= entry_size
+
+    def retrieve(self, url, save_file, digests, retrieve):
+        """Gets the file with digests to save_file from the cache, downloads
+        it only if it's neither in the cache nor in save_file already.
+        Args:
+            url: URL to download the file from
+            save_file: where to save the file
+            digests: dict of digests published for the file
+            retrieve: function(url, path) downloading url to path, it may
+                leave path.part behind if it fails
+        Returns:
+            True if the file was downloaded, False if it was cached
+        """
+        cached = self.get(digests)
+        if cached is None and os.path.isfile(save_file):
+            cached = self.put(save_file, digests, link=False)
+            if cached is not None:
+                logger.info('Using {0} stored in cache as {1}.'.format(save_file, cached))
+                return False
+        if cached is not None:
+            # save_file is a copy, packagers edit or patch files in SOURCES
+            link_or_copy(cached, save_file, link=False)
+            logger.info('Using cached {0}.'.format(cached))
+            return False
+
+        known = [a for a in self.algorithms if digests.get(a)]
+        if not known:
+            retrieve(url, save_file)
+            return True
+        # name of the download is stable, so that it can be resumed next time
+        algorithm = known[0]
+        temp = os.path.join(self.directory, 'partial',
+                            '{0}-{1}'.format(algorithm, digests[algorithm].lower()))
+        makedirs(os.path.dirname(temp))
+        try:
+            retrieve(url, temp)
+            cached = self.put(temp, digests)
+            if cached is None:
+                # not cached with wrong digest, file is used anyway as before
+                shutil.copy2(temp, save_file)
+            else:
+                link_or_copy(cached, save_file, link=False)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+        return True
+
+
+def download_cache():
+    """Returns DownloadCache or None if caching is disabled in settings"""
+    if not settings.DOWNLOAD_CACHE:
+        return None
+    return DownloadCache()
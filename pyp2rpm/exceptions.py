@@ -20,3 +20,15 @@ class NoSuchSourceException(BaseException):
 
 class VirtualenvFailException(BaseException):
     pass
+
+
+class SetupPyFailException(BaseException):
+    pass
+
+
+class SetupPyTimeoutException(BaseException):
+    pass
+
+
+class DigestMismatchException(BaseException):
+    pass
@@ -5,12 +5,31 @@ fit better to Fedora packaging Guidlines.
 """
 
 import distutils.command.bdist_rpm
+import atexit
+import itertools
+import logging
+import multiprocessing
 import sys
 import os.path
+import pickle
+import re
 import runpy
+import select
+import signal
+import threading
+import traceback
+try:
+    import resource
+except ImportError:
+    resource = None
 
 from distutils.errors import DistutilsOptionError
 
+from pyp2rpm import settings
+from pyp2rpm.exceptions import SetupPyFailException, SetupPyTimeoutException
+
+logger = logging.getLogger(__name__)
+
 bdist_rpm_orig = distutils.command.bdist_rpm.bdist_rpm
 
 
@@ -24,11 +43,11 @@ class extract_distribution(bdist_rpm_orig):
         """
         self.distribution.force_arch = self.force_arch
 
-        self.distribution.build_requires = self.build_requires or (
+        self.distribution.build_requires = self._requires_list(self.build_requires) or (
             self._list(getattr(self.distribution, 'setup_requires', []))
             + self._list(getattr(self.distribution, 'tests_require', [])))
 
-        self.distribution.run_requires = self.requires or self._list(getattr(
+        self.distribution.run_requires = self._requires_list(self.requires) or self._list(getattr(
             self.distribution, 'install_requires', []))
 
         self.distribution.conflicts = [dep.replace('!=', '=')
@@ -72,6 +91,15 @@ class extract_distribution(bdist_rpm_orig):
                 raise DistutilsOptionError("{} cannot be converted to list".format(var))
         return var
 
+    @staticmethod
+    def _requires_list(var):
+        """Dependencies given in options of bdist_rpm, in setup.cfg they are
+        separated by commas or newlines.
+        """
+        if isinstance(var, str):
+            return [dep.strip() for dep in re.split(r'[,\n]', var) if dep.strip()]
+        return extract_distribution._list(var)
+
 # extract_distribution command is executed instead of bdist_rpm thanks to this assignment
 distutils.command.bdist_rpm.bdist_rpm = extract_distribution
 
@@ -84,3 +112,372 @@ def run_setup(setup, *args):
     sys.path.insert(0, dirname)
     sys.argv[1:] = args
     runpy.run_module(filename, run_name='__main__', alter_sys=True)
+
+
+class SnapshotMetadata(object):
+
+    def __init__(self, metadata):
+        self.classifiers = list(metadata.classifiers or [])
+        self.long_description = metadata.long_description
+
+
+class DistributionSnapshot(object):
+    """Picklable copy of the distribution attributes collected by
+    extract_distribution command, used to pass them from worker process.
+    """
+    attributes = ['force_arch', 'build_requires', 'run_requires', 'conflicts',
+                  'py_modules', 'icon', 'prep', 'build', 'install', 'clean']
+
+    def __init__(self, distribution):
+        for attr in self.attributes:
+            if hasattr(distribution, attr):
+                setattr(self, attr, getattr(distribution, attr))
+        packages = getattr(distribution, 'packages', None)
+        self.packages = list(packages) if packages is not None else None
+        self.metadata = SnapshotMetadata(distribution.metadata)
+        self.ext_modules = bool(distribution.has_ext_modules())
+        self.license = distribution.get_license()
+        self.description = distribution.get_description()
+        self.url = distribution.get_url()
+
+    def has_ext_modules(self):
+        return self.ext_modules
+
+    def get_license(self):
+        return self.license
+
+    def get_description(self):
+        return self.description
+
+    def get_url(self):
+        return self.url
+
+
+def limit_memory(memory_limit):
+    """Limits address space of the current process to memory_limit bytes"""
+    if resource is None or not memory_limit:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        memory_limit = min(memory_limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (memory_limit, hard))
+
+
+def preload_modules(modules):
+    """Imports modules needed by most of setup.py scripts, so that processes
+    forked later don't have to import them again.
+    """
+    for module in modules:
+        try:
+            __import__(module)
+        except ImportError:
+            logger.debug('Failed to preload module {0}.'.format(module))
+    try:
+        # setuptools looks up entry points on every setup() call, fill
+        # the cache of installed distributions in advance
+        import importlib.metadata
+        importlib.metadata.entry_points()
+    except ImportError:
+        pass
+
+
+def call_in_worker(function, *args):
+    """Runs function in worker process, exceptions (including SystemExit
+    raised by setup.py) are returned instead of killing the worker.
+    """
+    try:
+        return True, function(*args)
+    except BaseException as e:
+        logger.debug('setup.py failed in worker process.', exc_info=True)
+        try:
+            pickle.dumps(e)
+        except Exception:
+            e = SetupPyFailException('{0}: {1}'.format(type(e).__name__, e))
+        return False, e
+
+
+class SetupPyPool(object):
+    """Pool of worker processes running setup.py. Workers are forked from
+    the parent which already imported distutils and setuptools, each of them
+    runs just one setup.py, so no modules leak from one package to another.
+    """
+
+    def __init__(self, processes=1, timeout=None, memory_limit=None):
+        self.processes = processes
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self._pool = None
+
+    @property
+    def context(self):
+        if hasattr(multiprocessing, 'get_context'):
+            return multiprocessing.get_context('fork')
+        return multiprocessing
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            preload_modules(settings.SETUP_PY_PRELOAD)
+            self._pool = self.context.Pool(self.processes, initializer=limit_memory,
+                                           initargs=(self.memory_limit,),
+                                           maxtasksperchild=1)
+        return self._pool
+
+    def start(self):
+        """Starts the workers, should be called before the parent starts
+        any threads.
+        """
+        self.pool
+
+    def apply(self, function, *args):
+        """Runs function with args in a worker process and returns its result.
+        Raises:
+            SetupPyTimeoutException if the worker doesn't finish in timeout
+        """
+        result = self.pool.apply_async(call_in_worker, (function,) + args)
+        try:
+            succeeded, value = result.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            # the stuck worker can't be reused, start over with a new pool
+            self.terminate()
+            raise SetupPyTimeoutException(
+                'setup.py didn\'t finish in {0} seconds.'.format(self.timeout))
+        if not succeeded:
+            raise value
+        return value
+
+    def terminate(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+
+class ZygoteRequest(object):
+    """Request waiting for its child of the zygote"""
+
+    def __init__(self):
+        self.pid = None
+        self.data = None
+        self.connection = None
+        self.started = threading.Event()
+        self.done = threading.Event()
+
+
+class SetupPyZygote(object):
+    """Zygote process which imports the modules needed by setup.py once
+    and then forks a fresh child for every setup.py. The zygote is forked
+    before any setup.py runs and it is single threaded, so every child
+    starts from the same clean state and can't pollute its parent.
+
+    apply is thread safe, up to processes children run at the same time.
+    """
+
+    def __init__(self, processes=1, timeout=None, memory_limit=None, preload=()):
+        self.processes = processes
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.preload = preload
+        self.pid = None
+        self.connection = None
+        self.requests = {}
+        self.request_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(processes)
+
+    def start(self):
+        """Forks the zygote, should be called before the parent starts
+        any threads. If the zygote dies, apply forks a new one.
+        """
+        with self.lock:
+            self.fork_zygote()
+
+    def fork_zygote(self):
+        """Forks the zygote unless it is running, self.lock must be held"""
+        if self.pid is not None:
+            return
+        connection, child_connection = multiprocessing.Pipe()
+        pid = os.fork()
+        if pid == 0:
+            connection.close()
+            try:
+                self.serve(child_connection)
+            finally:
+                os._exit(0)
+        child_connection.close()
+        self.pid, self.connection = pid, connection
+        receiver = threading.Thread(target=self.receive, args=(pid, connection))
+        receiver.daemon = True
+        receiver.start()
+
+    def serve(self, connection):
+        """Main loop of the zygote process, forks a child for every
+        (request_id, function, args) request and passes its pickled result back.
+        """
+        preload_modules(self.preload)
+        children = {}
+        while True:
+            readable, _, _ = select.select([connection] + list(children), [], [])
+            for fd in readable:
+                if fd is connection:
+                    try:
+                        request = connection.recv()
+                    except EOFError:
+                        request = None
+                    if request is None:
+                        for _, pid, _ in children.values():
+                            os.kill(pid, signal.SIGKILL)
+                        return
+                    request_id, function, args = request
+                    read_fd, write_fd = os.pipe()
+                    pid = os.fork()
+                    if pid == 0:
+                        connection.close()
+                        os.close(read_fd)
+                        self.run_child(write_fd, function, args)
+                    os.close(write_fd)
+                    children[read_fd] = (request_id, pid, [])
+                    connection.send((request_id, pid, None))
+                    continue
+
+                chunk = os.read(fd, 65536)
+                if chunk:
+                    children[fd][2].append(chunk)
+                    continue
+                os.close(fd)
+                request_id, pid, chunks = children.pop(fd)
+                os.waitpid(pid, 0)
+                # empty data tell the parent that the child died
+                connection.send((request_id, None, b''.join(chunks)))
+
+    def run_child(self, write_fd, function, args):
+        try:
+            try:
+                limit_memory(self.memory_limit)
+                result = call_in_worker(function, *args)
+            except BaseException:
+                # e.g. logging failed in call_in_worker, pass the cause anyway
+                result = False, SetupPyFailException(traceback.format_exc())
+            with os.fdopen(write_fd, 'wb') as result_file:
+                try:
+                    data = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+                except Exception:
+                    data = pickle.dumps((False, SetupPyFailException(
+                        'Result of setup.py can\'t be pickled.')))
+                result_file.write(data)
+        finally:
+            os._exit(0)
+
+    def receive(self, pid, connection):
+        """Passes messages from the zygote to waiting requests, runs in thread.
+        When the zygote dies, it is reaped, so that apply forks a new one.
+        """
+        while True:
+            try:
+                request_id, pid, data = connection.recv()
+            except (EOFError, EnvironmentError):
+                break
+            request = self.requests.get(request_id)
+            if request is None:
+                continue
+            if pid is not None:
+                request.pid = pid
+                request.started.set()
+            else:
+                request.data = data
+                request.done.set()
+        with self.lock:
+            if self.connection is connection:
+                logger.warning('Zygote process running setup.py died.')
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                    os.waitpid(pid, 0)
+                except OSError:
+                    pass
+                connection.close()
+                self.pid = self.connection = None
+            # zygote is gone, nothing will come
+            for request in list(self.requests.values()):
+                if request.connection is connection:
+                    request.started.set()
+                    request.done.set()
+
+    def apply(self, function, *args):
+        """Runs function with args in a child of the zygote and returns its result.
+        Raises:
+            SetupPyTimeoutException if the child doesn't finish in timeout
+            SetupPyFailException if the child or the zygote dies, e.g. because
+                of memory limit
+        """
+        with self.slots:
+            request = ZygoteRequest()
+            with self.lock:
+                self.fork_zygote()
+                request_id = next(self.request_ids)
+                request.connection = self.connection
+                self.requests[request_id] = request
+                try:
+                    self.connection.send((request_id, function, args))
+                except (EnvironmentError, ValueError) as e:
+                    del self.requests[request_id]
+                    raise SetupPyFailException(
+                        'Failed to pass setup.py to zygote process: {0}'.format(e))
+            try:
+                if not request.done.wait(self.timeout):
+                    request.started.wait()
+                    try:
+                        os.kill(request.pid, signal.SIGKILL)
+                    except (OSError, TypeError):
+                        pass
+                    request.done.wait()
+                    raise SetupPyTimeoutException(
+                        'setup.py didn\'t finish in {0} seconds.'.format(self.timeout))
+            finally:
+                del self.requests[request_id]
+        if not request.data:
+            raise SetupPyFailException('Process running setup.py died.')
+        succeeded, value = pickle.loads(request.data)
+        if not succeeded:
+            raise value
+        return value
+
+    def terminate(self):
+        with self.lock:
+            if self.pid is None:
+                return
+            try:
+                self.connection.send(None)
+            except (EnvironmentError, ValueError):
+                os.kill(self.pid, signal.SIGKILL)
+            os.waitpid(self.pid, 0)
+            self.connection.close()
+            self.pid = self.connection = None
+
+
+_setup_py_pool = None
+
+
+def setup_py_pool():
+    """Returns pool of workers configured according to settings, always
+    returns the same instance.
+    """
+    global _setup_py_pool
+    if _setup_py_pool is None:
+        if settings.SETUP_PY_ISOLATION == 'zygote':
+            _setup_py_pool = SetupPyZygote(settings.SETUP_PY_WORKERS,
+                                           settings.SETUP_PY_TIMEOUT,
+                                           settings.SETUP_PY_MEMORY_LIMIT,
+                                           settings.SETUP_PY_PRELOAD)
+        else:
+            _setup_py_pool = SetupPyPool(settings.SETUP_PY_WORKERS, settings.SETUP_PY_TIMEOUT,
+                                         settings.SETUP_PY_MEMORY_LIMIT)
+        atexit.register(_setup_py_pool.terminate)
+    return _setup_py_pool
+
+
+def snapshot_setup(setup, *args):
+    """Runs setup.py with extract_distribution command and returns picklable
+    snapshot of the distribution.
+    """
+    run_setup(setup, *args)
+    return DistributionSnapshot(extract_distribution.class_distribution)
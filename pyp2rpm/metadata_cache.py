@@ -0,0 +1,91 @@
+"""
+Cache of extracted metadata, so that converting the same release again
+(another template, re-run after failed build) doesn't run setup.py, install
+the package into virtualenv or query PyPI. Entries are keyed by sha256 of
+the package file and everything else the metadata depend on and expire
+after settings.METADATA_CACHE_TTL seconds.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import time
+import zlib
+
+from pyp2rpm import settings
+from pyp2rpm import version
+from pyp2rpm.download_cache import file_digests, makedirs
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(local_file, venv, *args):
+    """Returns key of metadata extracted from local_file. Which metadata
+    extractor is used depends only on the file and pyp2rpm version, so
+    the key can be computed without reading the archive.
+    Args:
+        local_file: path of the package file
+        venv: True if metadata are extracted from virtualenv too
+        args: other values the metadata depend on, must be JSON serializable
+    Returns:
+        hex digest
+    """
+    key = [MetadataCache.entry_format, version.version,
+           file_digests(local_file, ['sha256'])['sha256'], bool(venv)] + list(args)
+    return hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+
+
+class MetadataCache(object):
+    """Directory of zlib compressed pickles of PackageData.data named by
+    their keys, see cache_key.
+    """
+    entry_format = 2
+
+    def __init__(self, directory=None, ttl=None):
+        self.directory = directory or os.path.join(settings.CACHE_DIR, 'metadata')
+        self.ttl = settings.METADATA_CACHE_TTL if ttl is None else ttl
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """Returns cached data dict or None if there are none or they expired"""
+        path = self.path(key)
+        try:
+            if os.stat(path).st_mtime + self.ttl < time.time():
+                logger.debug('Cached metadata {0} expired.'.format(path))
+                os.remove(path)
+                return None
+            with open(path, 'rb') as f:
+                return pickle.loads(zlib.decompress(f.read()))
+        except (IOError, OSError):
+            return None
+        except Exception:
+            logger.warning('Failed to load cached metadata {0}.'.format(path), exc_info=True)
+            return None
+
+    def put(self, key, data):
+        """Stores data dict under key, failures are only logged"""
+        path = self.path(key)
+        temp = None
+        try:
+            makedirs(os.path.dirname(path))
+            fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(zlib.compress(pickle.dumps(data, 2)))
+            os.rename(temp, path)
+            logger.debug('Metadata stored in cache as {0}.'.format(path))
+        except Exception:
+            logger.warning('Failed to cache metadata as {0}.'.format(path), exc_info=True)
+            if temp is not None and os.path.exists(temp):
+                os.remove(temp)
+
+
+def metadata_cache():
+    """Returns MetadataCache or None if caching is disabled in settings"""
+    if not settings.METADATA_CACHE:
+        return None
+    return MetadataCache()
@@ -22,6 +22,8 @@ from pyp2rpm.logger import LoggerWriter
 from pyp2rpm import settings
 from pyp2rpm import utils
 from pyp2rpm import extract_distribution
+from pyp2rpm import setup_py_analyzer
+from pyp2rpm import declarative_metadata
 try:
     from pyp2rpm import virtualenv
 except ImportError:
@@ -30,31 +32,46 @@ except ImportError:
 logger = logging.getLogger(__name__)
 
 
+def data_from_pypi(client, name, version):
+    """Returns dict of metadata of the release from PyPI or None if the
+    client fails.
+    """
+    try:
+        if client is None:
+            raise ValueError("Client is None.")
+        release_data = client.release_data(name, version)
+    except:
+        logger.warning('Some kind of error while communicating with client: {0}.'.format(
+            client), exc_info=True)
+        return None
+
+    url, md5_digest = get_url(client, name, version)
+    data_dict = {'url': url, 'md5': md5_digest}
+
+    for data_field in settings.PYPI_USABLE_DATA:
+        data_dict[data_field] = release_data.get(data_field, '')
+
+    # we usually get better license representation from trove classifiers
+    data_dict["license"] = utils.license_from_trove(release_data.get('classifiers', ''))
+    return data_dict
+
+
 def pypi_metadata_extension(extraction_fce):
     """Extracts data from PyPI and appends them to data returned from
-    given data extraction method.
+    given data extraction method. Data are fetched from PyPI while the
+    extraction method runs unless settings.CONCURRENT_EXTRACTION is off.
     """
 
     def inner(self, client=None):
+        pypi_call = utils.BackgroundCall(
+            data_from_pypi, (client, self.name, self.version),
+            background=settings.CONCURRENT_EXTRACTION and client is not None)
         data = extraction_fce(self)
-        try:
-            if client is None:
-                raise ValueError("Client is None.")
-            release_data = client.release_data(self.name, self.version)
-        except:
-            logger.warning('Some kind of error while communicating with client: {0}.'.format(
-                client), exc_info=True)
-            return data
-
-        url, md5_digest = get_url(client, self.name, self.version)
-        data_dict = {'url': url, 'md5': md5_digest}
-
-        for data_field in settings.PYPI_USABLE_DATA:
-            data_dict[data_field] = release_data.get(data_field, '')
-
-        # we usually get better license representation from trove classifiers
-        data_dict["license"] = utils.license_from_trove(release_data.get('classifiers', ''))
-        data.set_from(data_dict, update=True)
+        data_dict = pypi_call.result()
+        if data_dict is not None:
+            data.set_from(data_dict, update=True)
+        elif client is not None:
+            data.incomplete.add('pypi')
         return data
     return inner
 
@@ -79,6 +96,31 @@ def process_description(description_fce):
     return inner
 
 
+def run_setup_py(temp_dir, setup_py):
+    """Runs setup.py extracted in temp_dir.
+    Returns:
+        snapshot of the distribution
+    """
+    with utils.ChangeDir(os.path.dirname(setup_py)):
+        with utils.RedirectStdStreams(stdout=LoggerWriter(logger.debug),
+                                      stderr=LoggerWriter(logger.warning)):
+            return extract_distribution.snapshot_setup(setup_py, 'bdist_rpm')
+
+
+def run_setup_py_isolated(local_file, seekable, temp_dir, setup_py):
+    """Same as run_setup_py, but executed in a worker process. Files of the
+    archive which were not extracted are extracted when setup.py opens
+    them. ExtractOnOpen replaces open() for the whole process, so it's used
+    only here, never in pyp2rpm process itself.
+    Returns:
+        tuple (snapshot of the distribution, bytes extracted on demand)
+    """
+    with archive.Archive(local_file, seekable) as a:
+        with archive.ExtractOnOpen(a, temp_dir) as on_demand:
+            distribution = run_setup_py(temp_dir, setup_py)
+    return distribution, on_demand.extracted_bytes
+
+
 class LocalMetadataExtractor(object):
 
     """Abstract base class for metadata extractors, does not provide
@@ -124,21 +166,26 @@ class LocalMetadataExtractor(object):
     def data_from_venv(self):
         """Returns all metadata extractable from virtualenv object.
         Returns:
-            dictionary containing metadata extracted from virtualenv
+            dictionary containing metadata extracted from virtualenv or None
+            if the installation failed
         """
         if not self.venv:
             return {}
 
         temp_dir = tempfile.mkdtemp()
+        extractor = None
         try:
             extractor = virtualenv.VirtualEnv(self.name, temp_dir,
                                               self.name_convertor,
-                                              self.base_python_version)
+                                              self.base_python_version,
+                                              pool=virtualenv.venv_pool())
             return extractor.get_venv_data
         except VirtualenvFailException as e:
             logger.error("{}, skipping virtualenv metadata extraction".format(e))
-            return {}
+            return None
         finally:
+            if extractor is not None:
+                extractor.close()
             shutil.rmtree(temp_dir)
 
     @pypi_metadata_extension
@@ -153,11 +200,22 @@ class LocalMetadataExtractor(object):
                            if self.rpm_name is None else self.rpm_name,
                            self.version)
 
+        # pip installs the package in its own process while the archive is scanned
+        venv_call = None
+        if virtualenv is not None:
+            venv_call = utils.BackgroundCall(lambda: self.data_from_venv,
+                                             background=bool(settings.CONCURRENT_EXTRACTION and
+                                                             self.venv))
+
         with self.archive:
             data.set_from(self.data_from_archive)
 
-        if virtualenv is not None:
-            data.set_from(self.data_from_venv, update=True)
+        if venv_call is not None:
+            venv_data = venv_call.result()
+            if venv_data is None:
+                data.incomplete.add('virtualenv')
+            else:
+                data.set_from(venv_data, update=True)
 
         if "scripts" in data.data:
             setattr(data, "scripts", utils.remove_major_minor_suffix(data.data['scripts']))
@@ -398,7 +456,8 @@ class DistMetadataExtractor(SetupPyMetadataExtractor):
         temp_dir = tempfile.mkdtemp()
         try:
             with self.archive as a:
-                a.extract_all(directory=temp_dir)
+                members, skipped = self.setup_py_members
+                a.extract_all(directory=temp_dir, members=members)
                 try:
                     setup_py = glob.glob(temp_dir + "/{0}*/".format(self.name) + 'setup.py')[0]
                 except IndexError:
@@ -406,15 +465,87 @@ class DistMetadataExtractor(SetupPyMetadataExtractor):
                         "setup.py not found, maybe local_file is not proper source archive.\n")
                     raise SystemExit(3)
 
-                with utils.ChangeDir(os.path.dirname(setup_py)):
-                    with utils.RedirectStdStreams(stdout=LoggerWriter(logger.debug),
-                                                  stderr=LoggerWriter(logger.warning)):
-                        extract_distribution.run_setup(setup_py, 'bdist_rpm')
-
-                self.distribution = extract_distribution.extract_distribution.class_distribution
+                if settings.SETUP_PY_ISOLATION:
+                    self.distribution, on_demand = extract_distribution.setup_py_pool().apply(
+                        run_setup_py_isolated, a.file, a.seekable, temp_dir, setup_py)
+                else:
+                    self.distribution, on_demand = run_setup_py(temp_dir, setup_py), 0
+
+                self.extracted_bytes = (sum(map(archive.MemberIndex.size, members))
+                                        + on_demand)
+                self.skipped_bytes = (sum(map(archive.MemberIndex.size, skipped))
+                                      - on_demand)
+                logger.info('Extracted {0} bytes of the archive to run setup.py, '
+                            'skipped {1} bytes.'.format(self.extracted_bytes,
+                                                        self.skipped_bytes))
         finally:
             shutil.rmtree(temp_dir)
 
+    @property
+    def setup_py_members(self):
+        """Plans which archive members are needed to run setup.py: directories,
+        Python sources, files in the top level directory of the archive
+        (README, VERSION, setup.cfg, ...) and bundled metadata. Other files
+        are skipped only if setup.py runs in a worker process, where they
+        are extracted on demand, and doesn't look for files, see
+        setup_py_uses_tree.
+        Returns:
+            tuple (members to extract, members to skip)
+        """
+        if not settings.SETUP_PY_ISOLATION or self.setup_py_uses_tree:
+            return list(self.archive.index.members), []
+
+        needed, skipped = [], []
+        for member in self.archive.index.members:
+            path = member.name.rstrip('/').split('/')
+            if (archive.MemberIndex.is_dir(member) or
+                    len(path) <= 2 or
+                    os.path.splitext(member.name)[1] in settings.SETUP_PY_SOURCE_SUFFIXES or
+                    any(d.endswith('.egg-info') for d in path[:-1])):
+                needed.append(member)
+            else:
+                skipped.append(member)
+        return needed, skipped
+
+    @property
+    def setup_py_uses_tree(self):
+        """True if setup.py may list, glob or test existence of files other
+        than the ones opened: sources of extensions, package data and data
+        files. Only opened files are extracted on demand, so all the files
+        must be extracted in advance then. True if setup.py can't be analyzed.
+        """
+        setup_py = self.setup_py_path
+        if setup_py is None:
+            return True
+        analyzer = setup_py_analyzer.SetupPyAnalyzer(
+            self.archive.get_content_of_file(setup_py, full_path=True))
+        if not analyzer.found or analyzer.unknown_arguments:
+            return True
+        passed = set(analyzer.arguments) | analyzer.unresolved
+        if passed & set(settings.SETUP_PY_TREE_ARGUMENTS):
+            return True
+
+        setup_cfg = self.top_level_file('setup.cfg')
+        if setup_cfg is not None:
+            content = self.archive.get_content_of_file(setup_cfg, full_path=True) or ''
+            if re.search(r'^\s*(\[options\.(package_data|data_files)\]|'
+                         r'include_package_data\s*[=:])', content, re.M):
+                return True
+        return False
+
+    @property
+    def setup_py_path(self):
+        """Full path of setup.py in the top level directory of the archive"""
+        return self.top_level_file('setup.py')
+
+    def top_level_file(self, name):
+        """Full path of file in the top level directory of the archive"""
+        path = self.archive.get_files_re(r'^[^/]+/{0}$'.format(re.escape(name)),
+                                         full_path=True)
+        if not path:
+            path = self.archive.get_files_re(r'^{0}$'.format(re.escape(name)), full_path=True)
+        return path[0] if path else None
+
     @property
     def license_from_archive(self):
         return self.distribution.get_license()
@@ -496,6 +627,263 @@ class DistMetadataExtractor(SetupPyMetadataExtractor):
         return archive_data
 
 
+class StaticMetadataExtractor(DistMetadataExtractor):
+    """Base of metadata extractors that resolve arguments of setup() without
+    executing setup.py. Can be used only if is_static is True, otherwise
+    DistMetadataExtractor has to run setup.py.
+    """
+
+    def __init__(self, *args, **kwargs):
+        # skip DistMetadataExtractor.__init__, it runs setup.py
+        super(DistMetadataExtractor, self).__init__(*args, **kwargs)
+
+        self.analyzer = None
+        self.arguments = {}
+        self.unresolved = set(settings.STATIC_SETUP_REQUIRED_ARGUMENTS)
+        with self.archive as a:
+            setup_py = self.setup_py_path
+            if setup_py is not None:
+                self.analyzer = setup_py_analyzer.SetupPyAnalyzer(
+                    a.get_content_of_file(setup_py, full_path=True))
+            self.arguments, self.unresolved = self.static_arguments(a)
+            if self.arguments.get('packages') is None and self.arguments.get('py_modules') is None:
+                # setuptools discovers packages and modules itself, setup.py must run
+                self.unresolved |= set(['packages', 'py_modules'])
+            bdist_rpm = self.bdist_rpm_options(a)
+            if bdist_rpm is None:
+                self.unresolved.add('options')
+            if self.unresolved:
+                logger.info('Arguments of setup() not resolved statically: {0}.'.format(
+                    ', '.join(sorted(self.unresolved))))
+                return
+
+            packages = self.arguments.get('packages')
+            if isinstance(packages, setup_py_analyzer.FindPackages):
+                packages = packages.find(self.root_directory, a.index.directories,
+                                         set(a.index.by_name))
+            self.distribution = setup_py_analyzer.StaticDistribution(
+                self.arguments, packages,
+                to_list=extract_distribution.extract_distribution._list,
+                bdist_rpm=bdist_rpm)
+
+    @abstractmethod
+    def static_arguments(self, archive):
+        """Resolves arguments of setup() from the opened archive.
+        Returns:
+            tuple (dict of resolved arguments, set of required arguments
+            which were not resolved)
+        """
+        pass
+
+    @property
+    def is_static(self):
+        """True if all the needed arguments of setup() were resolved"""
+        return not self.unresolved
+
+    @property
+    def root_directory(self):
+        """Top level directory of the archive holding setup.py and friends"""
+        for name in ('setup.py', 'setup.cfg', 'pyproject.toml', 'PKG-INFO'):
+            path = self.top_level_file(name)
+            if path is not None:
+                return os.path.dirname(path)
+        return ''
+
+    def bdist_rpm_options(self, archive):
+        """Returns options of bdist_rpm command as extract_distribution gets
+        them: options argument of setup() overridden by [bdist_rpm] section
+        of setup.cfg. Dependencies are converted to lists.
+        Returns:
+            dict of options or None if setup.py may pass options not known
+            statically
+        """
+        options = {}
+        if self.analyzer is not None:
+            if (not self.analyzer.found or self.analyzer.unknown_arguments or
+                    'options' in self.analyzer.unresolved):
+                return None
+            setup_options = self.analyzer.arguments.get('options') or {}
+            if not isinstance(setup_options, dict):
+                return None
+            command_options = setup_options.get('bdist_rpm') or {}
+            if (not isinstance(command_options, dict) or
+                    setup_py_analyzer.unresolved in command_options.values()):
+                return None
+            options = dict(command_options)
+
+        setup_cfg = self.top_level_file('setup.cfg')
+        if setup_cfg is not None:
+            options.update(declarative_metadata.parse_command_options(
+                archive.get_content_of_file(setup_cfg, full_path=True), 'bdist_rpm'))
+        for option in ('requires', 'build_requires'):
+            if option in options:
+                options[option] = extract_distribution.extract_distribution._requires_list(
+                    options[option])
+        return options
+
+    def pyproject_arguments(self, archive):
+        """Returns arguments of setup() declared in pyproject.toml and set of
+        arguments declared dynamic there.
+        """
+        pyproject = self.top_level_file('pyproject.toml')
+        if pyproject is None:
+            return {}, set()
+        arguments, dynamic = declarative_metadata.parse_pyproject(
+            archive.get_content_of_file(pyproject, full_path=True))
+        fields = {'dependencies': 'install_requires',
+                  'scripts': 'entry_points',
+                  'gui-scripts': 'entry_points',
+                  'entry-points': 'entry_points'}
+        return arguments, set(fields.get(field, field) for field in dynamic)
+
+    def setup_cfg_arguments(self, archive):
+        """Returns arguments of setup() declared in setup.cfg and set of
+        arguments declared there which can't be resolved (attr: directives).
+        """
+        setup_cfg = self.top_level_file('setup.cfg')
+        if setup_cfg is None:
+            return {}, set()
+        root = os.path.dirname(setup_cfg)
+
+        def read_file(name):
+            return archive.get_content_of_file(
+                os.path.normpath(os.path.join(root, name)), full_path=True)
+
+        arguments, unresolved = declarative_metadata.parse_setup_cfg(
+            archive.get_content_of_file(setup_cfg, full_path=True), read_file)
+        for key, value in list(arguments.items()):
+            if isinstance(value, declarative_metadata.Directive):
+                find = value.value
+                arguments[key] = setup_py_analyzer.FindPackages(
+                    find.get('where', '.'),
+                    declarative_metadata.parse_list(find.get('exclude', '')),
+                    declarative_metadata.parse_list(find.get('include', '')) or ['*'])
+        return arguments, unresolved
+
+    @property
+    def has_test_suite(self):
+        return 'test_suite' in self.arguments
+
+    @property
+    def scripts(self):
+        scripts = [os.path.basename(script)
+                   for script in archive.flat_list(
+                       list(self.arguments.get('scripts') or []))]
+        entry_points = self.arguments.get('entry_points') or {}
+        if isinstance(entry_points, utils.str_classes):
+            entry_points = utils.parse_entry_points(entry_points)
+        for group in ('console_scripts', 'gui_scripts'):
+            group_entry_points = entry_points.get(group) or []
+            if isinstance(group_entry_points, utils.str_classes):
+                group_entry_points = group_entry_points.splitlines()
+            for entry_point in archive.flat_list(list(group_entry_points)):
+                if entry_point.strip():
+                    scripts.append(entry_point.split('=', 1)[0].strip())
+        return scripts
+
+
+class AstMetadataExtractor(StaticMetadataExtractor):
+    """Metadata extractor based on static analysis of setup.py, arguments
+    declared in pyproject.toml and setup.cfg are used unless setup.py
+    overrides them.
+    """
+
+    def static_arguments(self, archive):
+        required = set(settings.STATIC_SETUP_REQUIRED_ARGUMENTS)
+        if self.analyzer is None or not self.analyzer.found or self.analyzer.unknown_arguments:
+            return {}, required
+
+        arguments, unresolved = {}, set()
+        for source in (self.pyproject_arguments, self.setup_cfg_arguments):
+            source_arguments, source_unresolved = source(archive)
+            arguments.update(source_arguments)
+            unresolved |= source_unresolved
+        unresolved = (unresolved - set(self.analyzer.arguments)) | self.analyzer.unresolved
+        arguments.update(self.analyzer.arguments)
+        for key in unresolved:
+            arguments.pop(key, None)
+        return arguments, unresolved & required
+
+
+class DeclarativeMetadataExtractor(StaticMetadataExtractor):
+    """Metadata extractor reading only declarative metadata: bundled
+    PKG-INFO and .egg-info, setup.cfg and pyproject.toml. setup.py is
+    analyzed only to make sure it doesn't pass any of the required
+    arguments itself.
+    """
+
+    def static_arguments(self, archive):
+        arguments, unresolved = {}, set()
+        for source in (self.pyproject_arguments, self.setup_cfg_arguments):
+            source_arguments, source_unresolved = source(archive)
+            arguments.update(source_arguments)
+            unresolved |= source_unresolved
+        # .egg-info is the result of running setup(), it is final
+        egg_info, dynamic = self.egg_info_arguments(archive)
+        arguments.update(egg_info)
+        unresolved = (unresolved | dynamic) - set(egg_info)
+
+        missing = set()
+        for key in settings.STATIC_SETUP_REQUIRED_ARGUMENTS:
+            if key not in egg_info and (key in unresolved or self.setup_py_passes(key)):
+                missing.add(key)
+        for key in missing | unresolved:
+            arguments.pop(key, None)
+        return arguments, missing
+
+    def setup_py_passes(self, key):
+        """True unless setup.py provably doesn't pass argument key to setup()"""
+        if self.analyzer is None:
+            return False
+        return (not self.analyzer.found or self.analyzer.unknown_arguments or
+                key in self.analyzer.arguments or key in self.analyzer.unresolved)
+
+    def egg_info_arguments(self, archive):
+        """Arguments of setup() recorded in PKG-INFO and bundled .egg-info"""
+        arguments = {}
+        dynamic = set()
+        pkg_info = self.top_level_file('PKG-INFO')
+        if pkg_info is not None:
+            arguments, dynamic = declarative_metadata.parse_pkg_info(
+                archive.get_content_of_file(pkg_info, full_path=True))
+
+        egg_info = self.egg_info_path
+        if egg_info is not None:
+            def read(name):
+                return archive.get_content_of_file(
+                    '{0}/{1}'.format(egg_info, name), full_path=True)
+
+            arguments['install_requires'] = declarative_metadata.parse_requires_txt(
+                read('requires.txt') or '')
+            arguments['entry_points'] = utils.parse_entry_points(
+                read('entry_points.txt') or '')
+            top_level = (read('top_level.txt') or '').split()
+            arguments['packages'] = [name for name in top_level
+                                     if self.is_package(archive, name)]
+            arguments['py_modules'] = [name for name in top_level
+                                       if name not in arguments['packages']]
+        fields = {'requires-dist': 'install_requires',
+                  'classifier': 'classifiers'}
+        return arguments, set(fields.get(field, field) for field in dynamic)
+
+    @property
+    def egg_info_path(self):
+        """Full path of the bundled .egg-info directory closest to the top"""
+        egg_infos = [os.path.dirname(path) for path in
+                     self.archive.get_files_re(r'\.egg-info/PKG-INFO$', full_path=True)]
+        root = self.root_directory
+        egg_infos = [path for path in egg_infos
+                     if path.count('/') <= root.count('/') + 2 and path.startswith(root)]
+        return min(egg_infos, key=lambda path: path.count('/')) if egg_infos else None
+
+    @staticmethod
+    def is_package(archive, name):
+        """True if top level name from top_level.txt is a package"""
+        return any(os.path.basename(directory) == name and
+                   '{0}/__init__.py'.format(directory) in archive.index.by_name
+                   for directory in archive.index.directories)
+
+
 class WheelMetadataExtractor(LocalMetadataExtractor):
     """Class to extract metadata from wheel archive"""
 
@@ -0,0 +1,245 @@
+"""
+Index of local PyPI mirror, either a PEP 503 simple index directory
+(SIMPLE/PROJECT/index.html or SIMPLE/PROJECT/FILES) or a bandersnatch
+mirror (ROOT/web/simple/PROJECT/index.html linking ROOT/web/packages).
+
+The index is built once and persisted under settings.CACHE_DIR, later only
+projects whose directory changed are parsed again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+try:
+    from HTMLParser import HTMLParser
+    from urllib import unquote
+    from urlparse import urlsplit
+except ImportError:
+    from html.parser import HTMLParser
+    from urllib.parse import unquote, urlsplit
+try:
+    from packaging.version import parse as parse_version
+except ImportError:
+    from pkg_resources import parse_version
+
+from pyp2rpm import settings
+
+logger = logging.getLogger(__name__)
+
+SDIST_SUFFIXES = ['.tar.gz', '.tar.bz2', '.tar.xz', '.tgz', '.tar', '.zip']
+BINARY_SUFFIXES = ['.whl', '.egg']
+
+
+def canonical_name(name):
+    """Normalized project name, see PEP 503"""
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def version_key(version):
+    """Sort key of version strings, invalid versions sort first"""
+    try:
+        return (1, parse_version(version))
+    except Exception:
+        return (0, version)
+
+
+def split_filename(filename, project):
+    """Returns version of the release file of project or None if filename
+    is not a release file of the project.
+    """
+    for suffix in BINARY_SUFFIXES:
+        if filename.endswith(suffix):
+            parts = filename[:-len(suffix)].split('-')
+            if len(parts) > 1 and canonical_name(parts[0]) == project:
+                return parts[1]
+            return None
+    for suffix in SDIST_SUFFIXES:
+        if filename.endswith(suffix):
+            stem = filename[:-len(suffix)]
+            position = stem.find('-')
+            while position != -1:
+                if canonical_name(stem[:position]) == project:
+                    return stem[position + 1:] or None
+                position = stem.find('-', position + 1)
+            return None
+    return None
+
+
+class LinkParser(HTMLParser):
+    """Collects (href, text) of anchors of simple index page"""
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.links = []
+        self.href = None
+        self.text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            self.href = dict(attrs).get('href')
+            self.text = []
+
+    def handle_data(self, data):
+        if self.href is not None:
+            self.text.append(data)
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self.href is not None:
+            self.links.append((self.href, ''.join(self.text).strip()))
+            self.href = None
+
+
+class MirrorIndex(object):
+    """Maps canonical project names to their releases in the mirror:
+    {name: {version: [{'url': path, 'md5_digest': md5, 'digests': {...}}]}}
+    """
+    index_format = 1
+
+    def __init__(self, root, index_file=None):
+        self.root = os.path.abspath(root)
+        for simple in (os.path.join(self.root, 'web', 'simple'),
+                       os.path.join(self.root, 'simple'),
+                       self.root):
+            if os.path.isdir(simple):
+                self.simple = simple
+                break
+        else:
+            raise IOError('Mirror directory {0} does not exist.'.format(root))
+        self.index_file = index_file or os.path.join(
+            settings.CACHE_DIR, 'mirrors',
+            hashlib.sha1(self.root.encode('utf-8')).hexdigest() + '.json')
+        self.projects = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def stamp(directory):
+        """Changes whenever files of the project are added or its index.html rewritten"""
+        stamp = [os.stat(directory).st_mtime]
+        index_html = os.path.join(directory, 'index.html')
+        if os.path.exists(index_html):
+            stamp.append(os.stat(index_html).st_mtime)
+        return stamp
+
+    def parse_project(self, directory, project):
+        """Returns releases of project found in its directory"""
+        index_html = os.path.join(directory, 'index.html')
+        links = []
+        if os.path.isfile(index_html):
+            parser = LinkParser()
+            with open(index_html, 'rb') as f:
+                parser.feed(f.read().decode('utf-8', 'replace'))
+            for href, text in parser.links:
+                url = urlsplit(href)
+                if url.scheme or url.netloc:
+                    # no network access, files must be in the mirror
+                    continue
+                path = os.path.normpath(os.path.join(directory, unquote(url.path)))
+                digests = {}
+                if '=' in url.fragment:
+                    algorithm, digest = url.fragment.split('=', 1)
+                    digests[algorithm] = digest
+                links.append((text or os.path.basename(path), path, digests))
+        else:
+            links = [(filename, os.path.join(directory, filename), {})
+                     for filename in sorted(os.listdir(directory))]
+
+        releases = {}
+        for filename, path, digests in links:
+            version = split_filename(filename, project)
+            if version is None:
+                continue
+            releases.setdefault(version, []).append(
+                {'url': path, 'md5_digest': digests.get('md5'), 'digests': digests})
+        return releases
+
+    def build(self):
+        """Parses all the projects of the mirror"""
+        self.projects = {}
+        for entry in os.listdir(self.simple):
+            directory = os.path.join(self.simple, entry)
+            if os.path.isdir(directory):
+                project = canonical_name(entry)
+                self.projects[project] = {
+                    'directory': entry,
+                    'stamp': self.stamp(directory),
+                    'releases': self.parse_project(directory, project)}
+        logger.info('Indexed {0} projects of mirror {1}.'.format(len(self.projects), self.root))
+        self.save()
+
+    def load(self):
+        """Loads persisted index, returns False if there is none"""
+        try:
+            with open(self.index_file) as f:
+                index = json.load(f)
+            if index['format'] != self.index_format or index['root'] != self.root:
+                return False
+            self.projects = index['projects']
+        except (IOError, OSError, ValueError, KeyError):
+            logger.debug('Failed to load mirror index {0}.'.format(self.index_file),
+                         exc_info=True)
+            return False
+        return True
+
+    def save(self):
+        index = {'format': self.index_format, 'root': self.root, 'projects': self.projects}
+        temp = '{0}.{1}.tmp'.format(self.index_file, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(self.index_file)):
+                os.makedirs(os.path.dirname(self.index_file))
+            with open(temp, 'w') as f:
+                json.dump(index, f)
+            os.rename(temp, self.index_file)
+        except (IOError, OSError):
+            logger.warning('Failed to save mirror index {0}.'.format(self.index_file),
+                           exc_info=True)
+
+    def releases(self, name):
+        """Returns dict {version: release files} of the project, empty if it's
+        not in the mirror.
+        """
+        with self.lock:
+            return self._releases(name)
+
+    def _releases(self, name):
+        if self.projects is None and not self.load():
+            self.build()
+        project = canonical_name(name)
+        entry = self.projects.get(project)
+        # directories of PEP 503 indexes don't have to be normalized
+        directory = os.path.join(self.simple, entry['directory'] if entry else project)
+        if not os.path.isdir(directory):
+            return {}
+        stamp = self.stamp(directory)
+        if entry is None or entry['stamp'] != stamp:
+            logger.debug('Indexing {0} in mirror {1}.'.format(project, self.root))
+            entry = self.projects[project] = {
+                'directory': os.path.basename(directory),
+                'stamp': stamp,
+                'releases': self.parse_project(directory, project)}
+            self.save()
+        return entry['releases']
+
+    def versions(self, name):
+        """Returns versions of the project, the newest first, final
+        releases before pre-releases.
+        """
+        def key(version):
+            parsed = version_key(version)
+            return (not getattr(parsed[1], 'is_prerelease', False),) + parsed
+        return sorted(self.releases(name), key=key, reverse=True)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def mirror_index(root):
+    """Returns MirrorIndex of root, one per process"""
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        if root not in _indexes:
+            _indexes[root] = MirrorIndex(root)
+        return _indexes[root]
@@ -112,6 +112,21 @@ class NameVariants(object):
             if canonical_form(name) == canonical_form(getattr(self, variant)):
                 self.variants[variant] = name
 
+    def find_in_index(self, index, accepted=None):
+        """Same as find_match called for every name in the index, but probes
+        the index only for the variants.
+        Args:
+            index: dict of canonical forms of names to lists of the names,
+                see DandifiedNameConvertor.index
+            accepted: function filtering names, all names are accepted if None
+        """
+        for variant in ['python_ver_name', 'pyver_name', 'name_python_ver', 'raw_name']:
+            # find_match stores the last matching name
+            for name in reversed(index.get(canonical_form(getattr(self, variant)), [])):
+                if accepted is None or accepted(name):
+                    self.variants[variant] = name
+                    break
+
     def merge(self, other):
         """Merges object with other NameVariants object, not set values 
         of self.variants are replace by values from other object.
@@ -164,6 +179,8 @@ class DandifiedNameConvertor(NameConvertor):
                 base.read_all_repos()
                 base.fill_sack()
                 self.query = base.sack.query()
+        self.names = set(pkg.name for pkg in self.query)
+        self.index = canonical_index(pkg.name for pkg in self.query)
 
     def rpm_name(self, name, python_version=None):
         """Checks if name converted using superclass rpm_name_method match name
@@ -171,26 +188,28 @@ class DandifiedNameConvertor(NameConvertor):
         """
         original_name = name
         converted = super(DandifiedNameConvertor, self).rpm_name(name, python_version)
-        python_query = self.query.filter(name__substr=['python', 'py', original_name,
-                                                       canonical_form(original_name)])
-        if converted in [pkg.name for pkg in python_query]:
+        if converted in self.names:
             logger.debug("Converted name exists")
             return converted
 
         logger.debug("Converted name not found, searches for correct form")
 
+        # only names containing one of these are considered, as the names
+        # matched by name__substr filter of the sack query
+        substrings = ['py', original_name, canonical_form(original_name)]
+
+        def accepted(pkg_name):
+            return any(substring in pkg_name for substring in substrings)
+
         not_versioned_name = NameVariants(self.base_name(original_name), '')
         versioned_name = NameVariants(self.base_name(original_name), python_version)
+        versioned_name.find_in_index(self.index, accepted)
+        not_versioned_name.find_in_index(self.index, accepted)
 
         if self.base_name(original_name).startswith("py"):
             nonpy_name = NameVariants(self.base_name(
                 original_name)[2:], python_version)
-
-        for pkg in python_query:
-            versioned_name.find_match(pkg.name)
-            not_versioned_name.find_match(pkg.name)
-            if 'nonpy_name' in locals():
-                nonpy_name.find_match(pkg.name)
+            nonpy_name.find_in_index(self.index, accepted)
 
         if 'nonpy_name' in locals():
             versioned_name = versioned_name.merge(nonpy_name)
@@ -202,3 +221,16 @@ class DandifiedNameConvertor(NameConvertor):
 
 def canonical_form(name):
     return name.lower().replace('-', '').replace('_', '')
+
+
+def canonical_index(names):
+    """Returns dict of canonical forms of names to lists of the names in the
+    order of their last occurrence.
+    """
+    index = {}
+    for name in names:
+        same_form = index.setdefault(canonical_form(name), [])
+        if name in same_form:
+            same_form.remove(name)
+        same_form.append(name)
+    return index
@@ -1,3 +1,4 @@
+import copy
 import subprocess
 import time
 import locale
@@ -25,6 +26,8 @@ class PackageData(object):
 
     def __init__(self, local_file, name, pkg_name, version, md5='', url=''):
         object.__setattr__(self, 'data', {})
+        # extraction steps that failed, such data aren't cached
+        object.__setattr__(self, 'incomplete', set())
         # Exparimental fix of version
         self.data['local_file'] = local_file
         self.data['name'] = name
@@ -48,6 +51,16 @@ class PackageData(object):
         if value is not None:
             self.data[name] = value
 
+    def copy(self):
+        """Returns copy of the package data, which can be changed without
+        affecting the original. Values are copied only one level deep.
+        """
+        data = PackageData.__new__(PackageData)
+        object.__setattr__(data, 'data', dict(
+            (name, copy.copy(value)) for name, value in self.data.items()))
+        object.__setattr__(data, 'incomplete', set(self.incomplete))
+        return data
+
     def update_attr(self, name, value):
         if name in self.data and value:
             if name in ['runtime_deps', 'build_deps']:  # compare lowercase names of deps
@@ -1,3 +1,5 @@
+import errno
+import functools
 import logging
 import os
 import sys
@@ -6,18 +8,19 @@ import subprocess
 import tempfile
 import shutil
 import re
-try:
-    import urllib.request as request
-except ImportError:
-    import urllib as request
 try:
     import xmlrpclib
 except ImportError:
     import xmlrpc.client as xmlrpclib
 
 
+from pyp2rpm import archive
+from pyp2rpm import download
+from pyp2rpm import download_cache
 from pyp2rpm import settings
 from pyp2rpm import exceptions
+from pyp2rpm import mirror_index
+from pyp2rpm import pypi_client
 
 
 logger = logger = logging.getLogger(__name__)
@@ -35,7 +38,13 @@ def get_url(client, name, version, wheel=False, hashed_format=False):
             client, name, version))
         raise SystemExit('Some kind of error while communicating with client: {0}.'.format(
             client), exc_info=True)
+    return choose_url(release_urls, release_data, name, wheel, hashed_format)
+
 
+def choose_url(release_urls, release_data, name, wheel=False, hashed_format=False):
+    """Chooses URL of prefered archive and md5_digest from release_urls
+    and release_data of the package, see get_url.
+    """
     url = ''
     md5_digest = None
 
@@ -76,6 +85,30 @@ def get_url(client, name, version, wheel=False, hashed_format=False):
     return (url, md5_digest)
 
 
+def release_digests(client, name, version, url):
+    """Returns digests of release file url published on PyPI.
+    Returns:
+        dict e.g. {'md5': '...', 'sha256': '...'}, empty if not known
+    """
+    try:
+        release_urls = client.release_urls(name, version)
+    except:  # digests are optional
+        logger.debug('Failed to get digests of {0}.'.format(url), exc_info=True)
+        return {}
+    return url_digests(release_urls, url)
+
+
+def url_digests(release_urls, url):
+    """Returns digests of release file url found in release_urls"""
+    filename = url.split('/')[-1]
+    for release_url in release_urls:
+        if release_url['url'].split('/')[-1] == filename:
+            digests = dict(release_url.get('digests') or {})
+            digests.setdefault('md5', release_url.get('md5_digest'))
+            return dict((algorithm, digest) for algorithm, digest in digests.items() if digest)
+    return {}
+
+
 class PackageGetter(object):
 
     """Base class for package getters"""
@@ -122,6 +155,9 @@ class PypiDownloader(PackageGetter):
     def __init__(self, client, name, version=None, save_dir=None):
         self.client = client
         self.name = name
+        if isinstance(client, pypi_client.PypiClient):
+            # all the calls made during conversion in one request
+            client.prefetch_package(name, version)
         try:
             self.versions = self.client.package_releases(self.name)
         except xmlrpclib.ProtocolError as e:
@@ -160,10 +196,31 @@ class PypiDownloader(PackageGetter):
             save_dir = self.save_dir
 
         save_file = '{0}/{1}'.format(save_dir, url.split('/')[-1])
-        request.urlretrieve(url, save_file)
+        digests = release_digests(self.client, self.name, self.version, url)
+        indexer = None
+        save_archive = archive.Archive(save_file)
+        if save_archive.seekable and save_archive.is_compressed_tar:
+            # index the archive while it's being downloaded
+            indexer = archive.TarIndexer(save_file, save_archive.index_file)
+        retrieve = functools.partial(self.download_file, digests=digests,
+                                     consumers=[indexer] if indexer else [])
+
+        cache = download_cache.download_cache()
+        if cache is None or not digests:
+            retrieve(url, save_file)
+        elif not cache.retrieve(url, save_file, digests, retrieve):
+            if indexer:
+                indexer.abort()
+            return save_file
+        if indexer:
+            indexer.save()
         logger.info('Downloaded package from PyPI: {0}.'.format(save_file))
         return save_file
 
+    def download_file(self, url, path, digests=None, consumers=()):
+        """Downloads url to path, see download.Download"""
+        return download.download(url, path, digests, consumers)
+
     def get_name_version(self):
         """Try to normalize unusual version string,
         Returns name and version of the package.
@@ -171,6 +228,50 @@ class PypiDownloader(PackageGetter):
         return (self.name, self.version)
 
 
+class MirrorGetter(PackageGetter):
+
+    """Class for getting the package from local mirror of PyPI without
+    network access, see mirror_index.MirrorIndex.
+    """
+
+    def __init__(self, mirror, name, version=None, save_dir=None):
+        self.index = mirror_index.mirror_index(mirror)
+        self.name = name
+        self.versions = self.index.versions(name)
+        if not self.versions:
+            raise exceptions.NoSuchPackageException(
+                'Package "{0}" could not be found in mirror {1}.'.format(name, mirror))
+        self.version = version or self.versions[0]
+        if self.version not in self.versions:
+            raise exceptions.NoSuchPackageException(
+                'Package with name "{0}" and version "{1}" could not be found in '
+                'mirror {2}.'.format(name, version, mirror))
+        self.save_dir_init(save_dir)
+
+    def get(self, wheel=False):
+        """Links or copies the package from the mirror to self.save_dir,
+        wheels are only read, so they are used in place.
+        Returns:
+            Full path of the file.
+        """
+        release_urls = self.index.releases(self.name)[self.version]
+        # same preference as for PyPI
+        path = choose_url(release_urls, {}, self.name, wheel, hashed_format=True)[0]
+        if wheel:
+            logger.info('Package from mirror: {0} used in place.'.format(path))
+            return path
+
+        save_file = '{0}/{1}'.format(self.save_dir, os.path.basename(path))
+        if not os.path.exists(save_file) or not os.path.samefile(path, save_file):
+            method = download_cache.link_or_copy(path, save_file)
+            logger.info('Package from mirror: {0} copied to {1} ({2}).'.format(
+                path, save_file, method))
+        return save_file
+
+    def get_name_version(self):
+        return (self.name, self.version)
+
+
 class LocalFileGetter(PackageGetter):
 
     def __init__(self, local_file, save_dir=None):
@@ -179,22 +280,24 @@ class LocalFileGetter(PackageGetter):
         self.save_dir_init(save_dir)
 
     def get(self):
-        """Copies file from local filesystem to self.save_dir.
+        """Links or copies file from local filesystem to self.save_dir,
+        wheels are only read, so they are used in place.
         Returns:
-            Full path of the copied file.
+            Full path of the file.
         Raises:
             EnvironmentError if the file can't be found or the save_dir is not writable.
         """
         if self.local_file.endswith('.whl'):
-            self.temp_dir = tempfile.mkdtemp()
-            save_dir = self.temp_dir
-        else:
-            save_dir = self.save_dir
+            if not os.path.isfile(self.local_file):
+                raise IOError(errno.ENOENT, 'No such file', self.local_file)
+            logger.info('Local file: {0} used in place.'.format(self.local_file))
+            return os.path.abspath(self.local_file)
 
-        save_file = '{0}/{1}'.format(save_dir, os.path.basename(self.local_file))
+        save_file = '{0}/{1}'.format(self.save_dir, os.path.basename(self.local_file))
         if not os.path.exists(save_file) or not os.path.samefile(self.local_file, save_file):
-            shutil.copy2(self.local_file, save_file)
-        logger.info('Local file: {0} copyed to {1}.'.format(self.local_file, save_file))
+            method = download_cache.link_or_copy(self.local_file, save_file)
+            logger.info('Local file: {0} copied to {1} ({2}).'.format(
+                self.local_file, save_file, method))
 
         return save_file
 
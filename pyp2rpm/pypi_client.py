@@ -0,0 +1,241 @@
+"""
+XMLRPC client for PyPI which keeps connections to the server open, sends
+calls in batches using system.multicall and never asks the server for
+the same data twice.
+"""
+
+import logging
+import threading
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+try:
+    import xmlrpclib
+except ImportError:
+    import xmlrpc.client as xmlrpclib
+
+from pyp2rpm import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PooledTransport(xmlrpclib.Transport):
+    """Transport keeping up to pool_size keep-alive connections to every
+    host. Unlike xmlrpclib.Transport, it can be used by more threads at once.
+    """
+
+    def __init__(self, secure=False, pool_size=None, timeout=None):
+        xmlrpclib.Transport.__init__(self)
+        self.secure = secure
+        self.pool_size = pool_size or settings.PYPI_CONNECTIONS
+        self.timeout = timeout or settings.PYPI_TIMEOUT
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    def pool(self, host):
+        with self.lock:
+            if host not in self.pools:
+                self.pools[host] = queue.LifoQueue(self.pool_size)
+            return self.pools[host]
+
+    def connection(self, host):
+        """Returns idle connection to host and True or new connection and False"""
+        try:
+            return self.pool(host).get_nowait(), True
+        except queue.Empty:
+            connection_class = httplib.HTTPSConnection if self.secure else httplib.HTTPConnection
+            return connection_class(host, timeout=self.timeout), False
+
+    def release(self, host, connection):
+        try:
+            self.pool(host).put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def request(self, host, handler, request_body, verbose=False):
+        self.verbose = verbose
+        while True:
+            connection, reused = self.connection(host)
+            try:
+                connection.request('POST', handler, request_body,
+                                   {'Content-Type': 'text/xml',
+                                    'User-Agent': self.user_agent})
+                response = connection.getresponse()
+            except (httplib.HTTPException, EnvironmentError):
+                connection.close()
+                # server might have closed idle connection, retry with a new one
+                if reused:
+                    continue
+                raise
+            break
+        if response.status != 200:
+            headers = dict(response.getheaders())
+            response.read()
+            connection.close()
+            raise xmlrpclib.ProtocolError(host + handler, response.status,
+                                          response.reason, headers)
+        try:
+            result = self.parse_response(response)
+        except BaseException:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self.release(host, connection)
+        return result
+
+    def close(self):
+        with self.lock:
+            pools, self.pools = self.pools, {}
+        for pool in pools.values():
+            while not pool.empty():
+                pool.get_nowait().close()
+
+
+class Call(object):
+    """Memoized result of XMLRPC call or Fault returned by the server"""
+
+    def __init__(self, value=None, fault=None):
+        self.value = value
+        self.fault = fault
+
+    def result(self):
+        if self.fault is not None:
+            raise self.fault
+        return self.value
+
+
+class PypiClient(object):
+    """Client for PyPI XMLRPC API. Results of calls are memoized, so that e.g.
+    release_data of the same package is transferred only once in a session.
+    Calls known in advance can be sent in one request by prefetch.
+
+    Client can be shared by more threads.
+    """
+
+    def __init__(self, url=None, transport=None):
+        """
+        Args:
+            url: URL of the XMLRPC server, defaults to PyPI
+            transport: xmlrpclib.Transport, defaults to PooledTransport
+        """
+        self.url = url or settings.PYPI_URL
+        if transport is None:
+            transport = PooledTransport(secure=self.url.startswith('https:'))
+        self.transport = transport
+        self.proxy = xmlrpclib.ServerProxy(self.url, transport=transport, allow_none=True)
+        self.memo = {}
+        self.lock = threading.Lock()
+        self.multicall = settings.PYPI_MULTICALL
+
+    def __repr__(self):
+        return '<PypiClient {0}>'.format(self.url)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *args: self.call(name, *args)
+
+    def call(self, method, *args):
+        """Calls method of the server unless it was already called with
+        the same arguments.
+        """
+        return self.fetch(method, args).result()
+
+    def fetch(self, method, args):
+        """Returns memoized Call of method, calls the server if needed"""
+        key = (method, args)
+        with self.lock:
+            memoized = self.memo.get(key)
+        if memoized is None:
+            try:
+                memoized = Call(getattr(self.proxy, method)(*args))
+            except xmlrpclib.Fault as fault:
+                memoized = Call(fault=fault)
+            with self.lock:
+                self.memo[key] = memoized
+        return memoized
+
+    def prefetch(self, calls):
+        """Sends calls not called yet to the server in one system.multicall
+        request, falls back to separate requests if the server doesn't
+        support it.
+        Args:
+            calls: iterable of (method, args) tuples
+        """
+        with self.lock:
+            calls = [(method, tuple(args)) for method, args in calls
+                     if (method, tuple(args)) not in self.memo]
+        calls = list(dict.fromkeys(calls))
+        try:
+            if len(calls) == 1 or not self.multicall:
+                for method, args in calls:
+                    self.fetch(method, args)
+                return
+            for start in range(0, len(calls), settings.PYPI_MULTICALL_SIZE):
+                self.prefetch_multicall(calls[start:start + settings.PYPI_MULTICALL_SIZE])
+        except (xmlrpclib.ProtocolError, httplib.HTTPException, EnvironmentError):
+            # calls will be made again when needed and fail there if at all
+            logger.warning('Failed to prefetch data from {0}.'.format(self.url), exc_info=True)
+
+    def prefetch_multicall(self, calls):
+        multicall = xmlrpclib.MultiCall(self.proxy)
+        for method, args in calls:
+            getattr(multicall, method)(*args)
+        try:
+            results = multicall().results
+        except xmlrpclib.Fault:
+            logger.info('Server {0} does not support system.multicall.'.format(self.url),
+                        exc_info=True)
+            self.multicall = False
+            for method, args in calls:
+                self.fetch(method, args)
+            return
+        memoized = {}
+        for key, result in zip(calls, results):
+            if isinstance(result, dict):
+                memoized[key] = Call(fault=xmlrpclib.Fault(result['faultCode'],
+                                                           result['faultString']))
+            else:
+                memoized[key] = Call(result[0])
+        with self.lock:
+            self.memo.update(memoized)
+
+    def prefetch_packages(self, packages):
+        """Fetches everything pyp2rpm needs to know about the packages from PyPI,
+        in one request if versions of all the packages are known, in two
+        otherwise: the second one asks for data of the newest versions.
+        Args:
+            packages: iterable of (name, version or None) tuples
+        """
+        packages = list(packages)
+        calls = []
+        for name, version in packages:
+            calls.append(('package_releases', (name,)))
+            if version is not None:
+                calls.append(('release_urls', (name, version)))
+                calls.append(('release_data', (name, version)))
+        self.prefetch(calls)
+
+        calls = []
+        for name, version in packages:
+            if version is None:
+                with self.lock:
+                    memoized = self.memo.get(('package_releases', (name,)))
+                if memoized is None or memoized.fault is not None or not memoized.value:
+                    continue
+                version = memoized.value[0]
+                calls.append(('release_urls', (name, version)))
+                calls.append(('release_data', (name, version)))
+        if calls:
+            self.prefetch(calls)
+
+    def prefetch_package(self, name, version=None):
+        """Fetches everything pyp2rpm needs to know about the package"""
+        self.prefetch_packages([(name, version)])
@@ -0,0 +1,136 @@
+"""
+Scheduler running many items through a pipeline of stages, every stage
+has its own pool of threads, so that e.g. downloads don't wait for
+extraction of metadata of other packages.
+"""
+
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+logger = logging.getLogger(__name__)
+
+
+class Stage(object):
+    """Stage of the pipeline, function is called with value returned by
+    the previous stage (or the item itself) in one of jobs threads.
+    """
+
+    def __init__(self, name, function, jobs=1):
+        self.name = name
+        self.function = function
+        self.jobs = jobs
+
+
+class StageResult(object):
+    """Value returned by the last stage for item or error raised by any stage"""
+
+    def __init__(self, index, item, value=None, error=None, stage=None):
+        self.index = index
+        self.item = item
+        self.value = value
+        self.error = error
+        self.stage = stage
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+
+class Scheduler(object):
+    """Runs items through stages. At most max_pending items are processed
+    or wait for the consumer at the same time, reading of next items stops
+    until the consumer takes the results (backpressure).
+    """
+
+    def __init__(self, stages, max_pending=None, ordered=True):
+        """
+        Args:
+            stages: list of Stage objects
+            max_pending: maximum number of items in the pipeline, defaults
+                to twice the number of all threads
+            ordered: True to return results in the order of items,
+                False to return them as soon as they are done
+        """
+        self.stages = stages
+        self.max_pending = max_pending or 2 * sum(stage.jobs for stage in stages)
+        self.ordered = ordered
+
+    def run_stage(self, pools, results, number, index, item, value):
+        """Runs stage number in thread of its pool and submits the value
+        to the next stage.
+        """
+        stage = self.stages[number]
+        try:
+            value = stage.function(value)
+        except KeyboardInterrupt:
+            raise
+        except BaseException as e:
+            logger.debug('Stage {0} failed for {1}.'.format(stage.name, item), exc_info=True)
+            results.put(StageResult(index, item, error=e, stage=stage.name))
+            return
+        if number + 1 < len(self.stages):
+            pools[number + 1].apply_async(
+                self.run_stage, (pools, results, number + 1, index, item, value))
+        else:
+            results.put(StageResult(index, item, value=value))
+
+    def feed(self, items, pools, results, pending, stopped):
+        """Submits items to the first stage, runs in thread"""
+        count = 0
+        try:
+            for index, item in enumerate(items):
+                pending.acquire()
+                if stopped.is_set():
+                    return
+                pools[0].apply_async(self.run_stage, (pools, results, 0, index, item, item))
+                count += 1
+        except BaseException as e:
+            logger.error('Failed to read items.', exc_info=True)
+            results.put(StageResult(count, None, error=e, stage='feed'))
+            count += 1
+        results.put(count)
+
+    def run(self, items):
+        """Runs items through the stages.
+        Returns:
+            generator of StageResult objects
+        """
+        pools = [ThreadPool(stage.jobs) for stage in self.stages]
+        results = queue.Queue()
+        pending = threading.Semaphore(self.max_pending)
+        stopped = threading.Event()
+        feeder = threading.Thread(target=self.feed,
+                                  args=(items, pools, results, pending, stopped))
+        feeder.daemon = True
+        feeder.start()
+
+        total = None
+        done = 0
+        finished = {}
+        next_index = 0
+        try:
+            while total is None or done < total:
+                result = results.get()
+                if not isinstance(result, StageResult):
+                    total = result
+                    continue
+                done += 1
+                if not self.ordered:
+                    yield result
+                    pending.release()
+                    continue
+                finished[result.index] = result
+                while next_index in finished:
+                    yield finished.pop(next_index)
+                    next_index += 1
+                    pending.release()
+        finally:
+            stopped.set()
+            pending.release()
+            for pool in pools:
+                pool.terminate()
@@ -7,6 +7,19 @@ DEFAULT_METADATA_SOURCE = 'pypi'
 DEFAULT_TEMPLATE = 'fedora'
 DEFAULT_DISTRO = 'fedora'
 DEFAULT_PKG_SAVE_PATH = os.path.expanduser('~/rpmbuild')
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                         'pyp2rpm')
+DOWNLOAD_CACHE = True  # keep downloaded packages in CACHE_DIR keyed by their digests
+DOWNLOAD_CACHE_SIZE = 1024 * 1024 * 1024  # bytes
+DOWNLOAD_CACHE_DIGESTS = ['sha256', 'md5']  # strongest first
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # bytes
+DOWNLOAD_RETRIES = 3  # interrupted downloads are resumed from where they stopped
+TEMPLATE_CACHE = True  # keep compiled templates in CACHE_DIR
+VENV_POOL = True  # clone virtualenvs from base ones kept in CACHE_DIR and reuse them
+VENV_POOL_SIZE = 4  # idle virtualenvs kept for each python version
+METADATA_CACHE = True  # keep extracted metadata in CACHE_DIR keyed by digest of the package
+METADATA_CACHE_TTL = 7 * 24 * 60 * 60  # seconds, PyPI data of the release may change
+CONCURRENT_EXTRACTION = True  # install into virtualenv and query PyPI while scanning archive
 KNOWN_DISTROS = ['fedora', 'mageia', 'pld']
 ARCHIVE_SUFFIXES = ['.tar', '.tgz', '.tar.gz', '.tar.bz2',
                     '.gz', '.bz2', '.xz', '.zip', '.egg', '.whl']
@@ -15,12 +28,46 @@ DOC_FILES_RE = [r'readme.+', r'licens.+', r'copying.+']
 LICENSE_FILES = ['license', 'copyright', 'copying']
 SPHINX_DIR_RE = r'[^/]+/doc.?'
 PYPI_URL = 'https://pypi.python.org/pypi'
+PYPI_CONNECTIONS = 4  # keep-alive connections kept open per host
+PYPI_TIMEOUT = 60
+PYPI_MULTICALL = True  # send calls known in advance in one system.multicall request
+PYPI_MULTICALL_SIZE = 20
+ASYNC_GETTER = False  # get packages from PyPI using asyncio backend (Python 3 only)
+ASYNC_LIMIT = 16  # requests running at once
+ASYNC_PER_HOST_LIMIT = 4  # requests running at once to one host
+ASYNC_MAX_REDIRECTS = 5
 PYPI_USABLE_DATA = ['description', 'summary', 'license', 'home_page', 'requires']
 DEFAULT_PREP = '%autosetup -n %{upstream_name}-%{unmangled_version}'
 DEFAULT_BUILD = '%{py2_build}'
 DEFAULT_INSTALL = '%{py3_install \--record=.python3-installfiles.txt}'
 DEFAULT_CLEAN = 'rm -rf $RPM_BUILD_ROOT'
 CONSOLE_LOGGING = False
+ARCHIVE_CONTENT_CACHE_SIZE = 16 * 1024 * 1024  # bytes
+SEEKABLE_TAR = False
+SETUP_PY_SOURCE_SUFFIXES = ['.py', '.pyx', '.cfg', '.toml']
+# setup() arguments making setup.py look for files, all of them are extracted then
+SETUP_PY_TREE_ARGUMENTS = ['ext_modules', 'libraries', 'package_data', 'data_files',
+                           'include_package_data', 'cffi_modules', 'rust_extensions']
+# setup() arguments that must be resolved statically to avoid running setup.py
+STATIC_SETUP_REQUIRED_ARGUMENTS = ['install_requires', 'setup_requires', 'tests_require',
+                                   'packages', 'py_modules', 'scripts', 'entry_points',
+                                   'classifiers', 'ext_modules', 'test_suite']
+# get metadata from declarative files and static analysis of setup.py when
+# possible instead of running setup.py
+STATIC_METADATA = False
+SEEKABLE_TAR_SPOOL_SIZE = 64 * 1024 * 1024  # bytes kept in memory before spilling to disk
+# how setup.py is run: 'pool' of worker processes, children of 'zygote'
+# process with preloaded modules or None to run it in pyp2rpm process
+SETUP_PY_ISOLATION = 'zygote'
+SETUP_PY_PRELOAD = ['distutils.core', 'distutils.command.bdist_rpm', 'setuptools',
+                    'setuptools.command.bdist_rpm', 'setuptools.command.egg_info',
+                    'setuptools.command.sdist', 'setuptools.command.build_py',
+                    'setuptools.command.bdist_egg', 'pkg_resources']
+SETUP_PY_WORKERS = 1
+SETUP_PY_TIMEOUT = 300  # seconds
+# bytes of address space (not resident memory) of setup.py process or None,
+# large limits are needed for setup.py importing numpy or starting threads
+SETUP_PY_MEMORY_LIMIT = None
 
 TROVE_LICENSES = {'License :: OSI Approved :: Academic Free License (AFL)': 'AFL',
                   'License :: OSI Approved :: Apache Software License': 'ASL %(TODO: version)s',
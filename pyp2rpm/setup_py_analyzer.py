@@ -0,0 +1,393 @@
+"""
+Static analysis of setup.py. Arguments of setup() call are resolved from
+literals and simple module level assignments without executing setup.py.
+"""
+
+import ast
+import fnmatch
+import logging
+import posixpath
+import threading
+
+logger = logging.getLogger(__name__)
+
+if hasattr(ast, 'Constant'):
+    LITERAL_NODES = (ast.Constant,)
+else:
+    LITERAL_NODES = (ast.Str, ast.Num, ast.Bytes, ast.NameConstant)
+
+MUTATING_METHODS = ['append', 'extend', 'insert', 'remove', 'pop', 'update',
+                    'setdefault', 'clear', 'add', 'discard']
+
+SETUP_FUNCTIONS = ['setup']
+FIND_PACKAGES_FUNCTIONS = ['find_packages']
+
+# ast.parse of some CPython 3.11 releases isn't thread safe, it fails with
+# "AST constructor recursion depth mismatch" when run in several threads
+parse_lock = threading.Lock()
+
+
+class Unresolved(Exception):
+    """Raised when expression can't be resolved statically."""
+    pass
+
+
+class UnresolvedValue(object):
+    """Marks value of a name or dict item that can't be resolved."""
+
+    def __repr__(self):
+        return '<unresolved>'
+
+unresolved = UnresolvedValue()
+
+
+class FindPackages(object):
+    """Statically resolved call of setuptools.find_packages()"""
+
+    def __init__(self, where='.', exclude=(), include=('*',)):
+        self.where = where
+        self.exclude = list(exclude) + ['ez_setup', '*__pycache__']
+        self.include = list(include)
+
+    def find(self, root, directories, files):
+        """Emulates find_packages on archive content.
+        Args:
+            root: directory of setup.py inside the archive
+            directories: set of all directories in the archive
+            files: set of all file names in the archive
+        Returns:
+            sorted list of found packages
+        """
+        base = posixpath.normpath(posixpath.join(root, self.where))
+        packages = []
+        for directory in directories:
+            if not directory.startswith(base + '/'):
+                continue
+            relative = directory[len(base) + 1:].split('/')
+            # every directory on the way down must be a package
+            if not all('{0}/{1}/__init__.py'.format(base, '/'.join(relative[:i])) in files
+                       for i in range(1, len(relative) + 1)):
+                continue
+            package = '.'.join(relative)
+            if (any(fnmatch.fnmatchcase(package, pat) for pat in self.include) and
+                    not any(fnmatch.fnmatchcase(package, pat) for pat in self.exclude)):
+                packages.append(package)
+        return sorted(packages)
+
+
+def name_of(func):
+    """Returns name of called function for foo(...) and module.foo(...)"""
+    if isinstance(func, ast.Name):
+        return func.id
+    elif isinstance(func, ast.Attribute):
+        return func.attr
+    return None
+
+
+def keywords_of(call):
+    """Yields (name, value node) pairs of call keyword arguments,
+    name is None for **kwargs.
+    """
+    for keyword in call.keywords:
+        yield keyword.arg, keyword.value
+    # Python < 3.5
+    if getattr(call, 'kwargs', None) is not None:
+        yield None, call.kwargs
+
+
+class SetupPyAnalyzer(object):
+    """Resolves arguments of setup() call in setup.py source code.
+
+    Attributes:
+        found: True if exactly one setup() call was found
+        arguments: dict of resolved setup() arguments
+        unresolved: set of setup() arguments which can't be resolved
+        unknown_arguments: True if **kwargs of setup() call can't be resolved,
+            so that any argument might be passed
+    """
+
+    def __init__(self, source):
+        self.namespace = {}
+        self.arguments = {}
+        self.unresolved = set()
+        self.unknown_arguments = False
+        self.found = False
+        try:
+            with parse_lock:
+                tree = ast.parse(source)
+        except (SyntaxError, TypeError, ValueError):
+            logger.debug('Failed to parse setup.py.', exc_info=True)
+            return
+
+        mutated = self.mutated_names(tree)
+        for statement in tree.body:
+            self.execute(statement)
+        for name in mutated:
+            self.namespace[name] = unresolved
+
+        calls = self.setup_calls(tree.body)
+        if len(calls) != 1:
+            logger.debug('Found {0} setup() calls in setup.py.'.format(len(calls)))
+            return
+        self.found = True
+        self.resolve_arguments(calls[0])
+
+    @staticmethod
+    def mutated_names(tree):
+        """Names mutated in place by method calls anywhere in setup.py
+        or by item assignment inside functions and classes
+        """
+        names = set()
+        for node in ast.walk(tree):
+            if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and
+                    isinstance(node.func.value, ast.Name) and
+                    node.func.attr in MUTATING_METHODS):
+                names.add(node.func.value.id)
+            elif isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+                for child in ast.walk(node):
+                    if (isinstance(child, (ast.Subscript, ast.Attribute)) and
+                            not isinstance(child.ctx, ast.Load) and
+                            isinstance(child.value, ast.Name)):
+                        names.add(child.value.id)
+        return names
+
+    @staticmethod
+    def stored_names(node):
+        """Names bound anywhere inside node"""
+        names = set()
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Store):
+                names.add(child.id)
+            elif isinstance(child, (ast.FunctionDef, ast.ClassDef)):
+                names.add(child.name)
+            elif isinstance(child, (ast.Import, ast.ImportFrom)):
+                for alias in child.names:
+                    names.add((alias.asname or alias.name).split('.')[0])
+            elif isinstance(child, ast.Global):
+                names.update(child.names)
+        return names
+
+    def execute(self, statement):
+        """Updates namespace according to module level statement"""
+        if isinstance(statement, ast.Assign):
+            try:
+                value = self.resolve(statement.value)
+            except Unresolved:
+                value = unresolved
+            for target in statement.targets:
+                self.assign(target, value)
+        elif isinstance(statement, ast.AugAssign) and isinstance(statement.target, ast.Name):
+            name = statement.target.id
+            try:
+                if not isinstance(statement.op, ast.Add):
+                    raise Unresolved()
+                self.namespace[name] = self.resolve(statement.target) + \
+                    self.resolve(statement.value)
+            except (Unresolved, TypeError):
+                self.namespace[name] = unresolved
+        elif isinstance(statement, (ast.FunctionDef, ast.ClassDef)):
+            self.namespace[statement.name] = unresolved
+            for child in ast.walk(statement):
+                if isinstance(child, ast.Global):
+                    for name in child.names:
+                        self.namespace[name] = unresolved
+        elif isinstance(statement, ast.Expr):
+            if (isinstance(statement.value, ast.Call) and
+                    name_of(statement.value.func) in ('exec', 'execfile')):
+                # executed code can rebind any name
+                for name in self.namespace:
+                    self.namespace[name] = unresolved
+        else:
+            # imports, conditionals, loops, ... => anything bound there is unknown
+            for name in self.stored_names(statement):
+                self.namespace[name] = unresolved
+
+    def assign(self, target, value):
+        if isinstance(target, ast.Name):
+            self.namespace[target.id] = value
+        elif (isinstance(target, ast.Subscript) and isinstance(target.value, ast.Name) and
+                isinstance(self.namespace.get(target.value.id), dict)):
+            try:
+                key = self.resolve(self.subscript_index(target))
+                self.namespace[target.value.id][key] = value
+            except (Unresolved, TypeError):
+                self.namespace[target.value.id] = unresolved
+        else:
+            for name in self.stored_names(target):
+                self.namespace[name] = unresolved
+            if isinstance(target, (ast.Subscript, ast.Attribute)):
+                for child in ast.walk(target):
+                    if isinstance(child, ast.Name):
+                        self.namespace[child.id] = unresolved
+
+    @staticmethod
+    def subscript_index(subscript):
+        index = subscript.slice
+        # Python < 3.9 wraps the index into ast.Index
+        if type(index).__name__ == 'Index':
+            index = index.value
+        return index
+
+    def setup_calls(self, body):
+        """Finds setup() calls at module level, including the ones
+        in if statements like if __name__ == '__main__'
+        """
+        calls = []
+        for statement in body:
+            if (isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Call) and
+                    name_of(statement.value.func) in SETUP_FUNCTIONS):
+                calls.append(statement.value)
+            elif isinstance(statement, ast.If):
+                calls.extend(self.setup_calls(statement.body + statement.orelse))
+        return calls
+
+    def resolve_arguments(self, call):
+        for name, node in keywords_of(call):
+            try:
+                value = self.resolve(node)
+            except Unresolved:
+                value = unresolved
+            if name is not None:
+                values = {name: value}
+            elif isinstance(value, dict):
+                values = value
+            else:
+                self.unknown_arguments = True
+                continue
+            for key, value in values.items():
+                if value is unresolved:
+                    self.unresolved.add(key)
+                    self.arguments.pop(key, None)
+                else:
+                    self.arguments[key] = value
+                    self.unresolved.discard(key)
+        if call.args:
+            # positional arguments of setup() are not used in practice
+            self.unknown_arguments = True
+
+    def resolve(self, node):
+        """Returns value of expression node.
+        Raises:
+            Unresolved if the value can't be found out statically
+        """
+        if isinstance(node, LITERAL_NODES):
+            return ast.literal_eval(node)
+        elif isinstance(node, ast.Name):
+            if node.id in ('True', 'False', 'None'):  # Python 2
+                return ast.literal_eval(node)
+            value = self.namespace.get(node.id, unresolved)
+            if value is unresolved:
+                raise Unresolved(node.id)
+            return value
+        elif isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+            items = []
+            for item in node.elts:
+                if isinstance(item, getattr(ast, 'Starred', ())):
+                    items.extend(self.resolve(item.value))
+                else:
+                    items.append(self.resolve(item))
+            if isinstance(node, ast.Tuple):
+                return tuple(items)
+            elif isinstance(node, ast.Set):
+                return set(items)
+            return items
+        elif isinstance(node, ast.Dict):
+            resolved = {}
+            for key, value in zip(node.keys, node.values):
+                if key is None:  # {**other}
+                    other = self.resolve(value)
+                    if not isinstance(other, dict):
+                        raise Unresolved()
+                    resolved.update(other)
+                    continue
+                try:
+                    resolved[self.resolve(key)] = self.resolve(value)
+                except Unresolved:
+                    resolved[self.resolve(key)] = unresolved
+            return resolved
+        elif isinstance(node, ast.BinOp):
+            left, right = self.resolve(node.left), self.resolve(node.right)
+            try:
+                if isinstance(node.op, ast.Add):
+                    return left + right
+                elif isinstance(node.op, ast.Mod) and isinstance(left, str):
+                    return left % right
+            except (TypeError, ValueError):
+                pass
+            raise Unresolved()
+        elif isinstance(node, ast.Call):
+            return self.resolve_call(node)
+        raise Unresolved()
+
+    def resolve_call(self, call):
+        name = name_of(call.func)
+        args = [self.resolve(arg) for arg in call.args]
+        kwargs = {}
+        for key, value in keywords_of(call):
+            if key is None:
+                raise Unresolved()
+            kwargs[key] = self.resolve(value)
+        if name in FIND_PACKAGES_FUNCTIONS:
+            try:
+                return FindPackages(*args, **kwargs)
+            except TypeError:
+                raise Unresolved()
+        elif name == 'dict' and isinstance(call.func, ast.Name):
+            try:
+                return dict(*args, **kwargs)
+            except (TypeError, ValueError):
+                raise Unresolved()
+        raise Unresolved()
+
+    def unresolved_arguments(self, required):
+        """Returns set of required setup() arguments whose value
+        is not known statically.
+        """
+        if not self.found or self.unknown_arguments:
+            return set(required)
+        return self.unresolved & set(required)
+
+
+class StaticMetadata(object):
+
+    def __init__(self, arguments):
+        self.classifiers = list(arguments.get('classifiers') or [])
+        self.long_description = arguments.get('long_description')
+
+
+class StaticDistribution(object):
+    """Provides the same attributes of distribution as extract_distribution
+    command collects, but built from statically resolved setup() arguments.
+    """
+
+    def __init__(self, arguments, packages=None, to_list=list, bdist_rpm=None):
+        bdist_rpm = bdist_rpm or {}
+        self.arguments = arguments
+        self.metadata = StaticMetadata(arguments)
+        # options of bdist_rpm take precedence like in extract_distribution
+        self.force_arch = bdist_rpm.get('force_arch')
+        self.build_requires = bdist_rpm.get('build_requires') or (
+            to_list(arguments.get('setup_requires') or []) +
+            to_list(arguments.get('tests_require') or []))
+        self.run_requires = bdist_rpm.get('requires') or to_list(
+            arguments.get('install_requires') or [])
+        self.conflicts = [dep.replace('!=', '=') for dep in self.run_requires if '!=' in dep]
+        self.py_modules = to_list(arguments.get('py_modules') or [])
+        if arguments.get('entry_points') and 'setuptools' not in self.run_requires:
+            self.run_requires.append('setuptools')
+        self.packages = packages if packages is not None else arguments.get('packages')
+        for rpm_opt in ('prep', 'build', 'install', 'clean'):
+            if bdist_rpm.get('{0}_script'.format(rpm_opt)):
+                setattr(self, rpm_opt, bdist_rpm['{0}_script'.format(rpm_opt)])
+
+    def has_ext_modules(self):
+        return bool(self.arguments.get('ext_modules'))
+
+    def get_license(self):
+        return self.arguments.get('license')
+
+    def get_description(self):
+        return self.arguments.get('description')
+
+    def get_url(self):
+        return self.arguments.get('url')
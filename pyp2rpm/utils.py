@@ -1,11 +1,16 @@
+import codecs
 import functools
 import logging
 import os
+import stat
 import subprocess
 import sys
+import tempfile
+import threading
 import re
 import copy
 import itertools
+from collections import OrderedDict
 
 from pyp2rpm import settings
 
@@ -72,6 +77,37 @@ class RedirectStdStreams(object):
                 self.stderr_descriptor.close()
 
 
+class BackgroundCall(object):
+    """Calls function in a daemon thread, result() waits for it and returns
+    its return value or raises its exception. With background=False the
+    function is called right away in the current thread.
+    """
+
+    def __init__(self, function, args=(), background=True):
+        self.value = None
+        self.error = None
+        self.thread = None
+        if background:
+            self.thread = threading.Thread(target=self.run, args=(function, args))
+            self.thread.daemon = True
+            self.thread.start()
+        else:
+            self.run(function, args)
+
+    def run(self, function, args):
+        try:
+            self.value = function(*args)
+        except BaseException as e:
+            self.error = e
+
+    def result(self):
+        if self.thread is not None:
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
 def memoize_by_args(func):
     """Memoizes return value of a func based on args."""
     memory = {}
@@ -87,6 +123,85 @@ def memoize_by_args(func):
     return memoized
 
 
+def sizeof_value(value):
+    """Default size function of LRUCache, None values take no space."""
+    if value is None:
+        return 0
+    return len(value)
+
+
+class LRUCache(object):
+    """Least recently used cache bounded by total size of stored values.
+
+    Values bigger than max_size are never stored. Hits and misses
+    are counted to make the cache efficiency observable.
+    """
+
+    def __init__(self, max_size, sizeof=sizeof_value):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Returns value stored under key and marks it as most recently used,
+        returns default if there is no such key.
+        """
+        if key not in self._data:
+            self.misses += 1
+            return default
+        self.hits += 1
+        value = self._data.pop(key)
+        self._data[key] = value
+        return value
+
+    def set(self, key, value):
+        """Stores value under key and evicts least recently used values
+        until the cache fits into max_size.
+        """
+        size = self.sizeof(value)
+        if key in self._data:
+            self.size -= self.sizeof(self._data.pop(key))
+        if size > self.max_size:
+            return
+        self._data[key] = value
+        self.size += size
+        while self.size > self.max_size:
+            _, evicted = self._data.popitem(last=False)
+            self.size -= self.sizeof(evicted)
+
+    def clear(self):
+        """Removes all values, hit and miss counters are preserved."""
+        self._data.clear()
+        self.size = 0
+
+
+def parse_entry_points(entry_points):
+    """Parses entry points given in ini format.
+    Args:
+        entry_points: string with [group] sections and name = object lines
+    Returns:
+        dict of groups and their lists of entry points
+    """
+    groups = {}
+    group = None
+    for line in entry_points.splitlines():
+        line = line.split('#')[0].strip()
+        if line.startswith('[') and line.endswith(']'):
+            group = groups.setdefault(line[1:-1].strip(), [])
+        elif line and group is not None:
+            group.append(line)
+    return groups
+
+
 def license_from_trove(trove):
     """Finds out license from list of trove classifiers.
     Args:
@@ -123,6 +238,64 @@ def versions_from_trove(trove):
     return sorted([v for v in versions if v.replace('.', '', 1).isdigit()])
 
 
+def current_umask():
+    """Returns umask of the process, it can only be read by setting it, so
+    it's done once at import time, before other threads create files.
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+UMASK = current_umask()
+
+
+def write_spec(spec_path, chunks):
+    """Writes specfile encoded to UTF-8 chunk by chunk into a temporary
+    file, which then atomically replaces spec_path, so it's never left
+    half written.
+
+    Args:
+        spec_path: path to the specfile
+        chunks: iterable of unicode chunks of the specfile
+    """
+    encoder = codecs.getincrementalencoder('utf-8')()
+    fd, temp_path = tempfile.mkstemp(prefix='.{0}.'.format(os.path.basename(spec_path)),
+                                     suffix='.tmp', dir=os.path.dirname(spec_path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(encoder.encode(chunk))
+            f.write(encoder.encode(u'', True))
+        # mkstemp creates the file readable only by the owner
+        try:
+            mode = stat.S_IMODE(os.stat(spec_path).st_mode)
+        except OSError:
+            mode = 0o666 & ~UMASK
+        os.chmod(temp_path, mode)
+        os.rename(temp_path, spec_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def print_spec(chunks, stream=None):
+    """Prints specfile chunk by chunk to stream (default: stdout).
+
+    Args:
+        chunks: iterable of unicode chunks of the specfile
+        stream: text stream (Python 3) or byte stream (Python 2)
+    """
+    stream = stream or sys.stdout
+    if not PY3:
+        stream = codecs.getwriter('utf-8')(stream)
+    for chunk in chunks:
+        stream.write(chunk)
+    # as print() does
+    stream.write(u'\n')
+    stream.flush()
+
+
 def build_srpm(specfile, save_dir):
     """Builds a srpm from given specfile using rpmbuild.
     Generated srpm is stored in directory specified by save_dir.
@@ -1,15 +1,28 @@
+import atexit
+import csv
+import errno
 import os
 import re
 import glob
 import logging
+import posixpath
+import shutil
+import subprocess
+import tempfile
+import threading
 from virtualenvapi.manage import VirtualEnvironment
 import virtualenvapi.exceptions as ve
 
+from pyp2rpm import download_cache
+from pyp2rpm import settings
 from pyp2rpm.exceptions import VirtualenvFailException
 from pyp2rpm.settings import DEFAULT_PYTHON_VERSION
 
 logger = logging.getLogger(__name__)
 
+# logs of virtualenvapi, appended to in place, so never shared by clones
+VENV_LOGS = ('build.log', 'build.err')
+
 
 def site_packages_filter(site_packages_list):
     '''Removes wheel .dist-info files'''
@@ -23,6 +36,14 @@ def scripts_filter(scripts):
     return [x for x in scripts if not x.split('.')[-1] == 'pyc']
 
 
+def site_packages(path):
+    """Returns site-packages directory of virtualenv in path"""
+    found = glob.glob(os.path.join(path, 'lib', 'python*.*', 'site-packages'))
+    if not found:
+        raise VirtualenvFailException('No site-packages in virtualenv {0}'.format(path))
+    return found[0]
+
+
 class DirsContent(object):
     '''
     Object to store and compare directory content before and
@@ -38,7 +59,7 @@ class DirsContent(object):
         Scans content of directories
         '''
         self.bindir = set(os.listdir(path + 'bin/'))
-        self.lib_sitepackages = set(os.listdir(glob.glob(path + 'lib/python?.?/site-packages/')[0]))
+        self.lib_sitepackages = set(os.listdir(site_packages(path)))
 
     def __sub__(self, other):
         '''
@@ -53,62 +74,312 @@ class DirsContent(object):
         return result
 
 
+def relocate(path, old_path, new_path):
+    """Rewrites scripts in bin of virtualenv in path referring to old_path,
+    e.g. in their shebangs, to refer to new_path. The scripts are replaced
+    by new files, so files hardlinked elsewhere are not changed.
+    """
+    old_bytes = old_path.encode('utf-8')
+    new_bytes = new_path.encode('utf-8')
+    bin_dir = os.path.join(path, 'bin')
+    for name in os.listdir(bin_dir):
+        script = os.path.join(bin_dir, name)
+        if os.path.islink(script) or not os.path.isfile(script) or \
+                os.path.getsize(script) > 1024 * 1024:
+            continue
+        with open(script, 'rb') as f:
+            content = f.read()
+        if old_bytes not in content or b'\0' in content:
+            continue
+        temp = script + '.tmp'
+        with open(temp, 'wb') as f:
+            f.write(content.replace(old_bytes, new_bytes))
+        shutil.copymode(script, temp)
+        os.rename(temp, script)
+
+
+def clone_tree(source, destination):
+    """Clones virtualenv in source to destination. Files are hardlinked
+    (or copied, see download_cache.link_or_copy), symlinks are recreated.
+    """
+    for root, dirs, files in os.walk(source):
+        target_root = os.path.join(destination, os.path.relpath(root, source))
+        download_cache.makedirs(target_root)
+        for name in list(dirs) + files:
+            path = os.path.join(root, name)
+            target = os.path.join(target_root, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), target)
+            elif not os.path.isdir(path) and not (root == source and name in VENV_LOGS):
+                download_cache.link_or_copy(path, target)
+        # symlinked directories were recreated, don't descend into them
+        dirs[:] = [d for d in dirs if not os.path.islink(os.path.join(root, d))]
+    relocate(destination, source, destination)
+
+
+def remove_path(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+class VenvPool(object):
+    """Pool of virtualenvs for metadata extraction. A base virtualenv of
+    each Python version is created once in settings.CACHE_DIR/venvs and
+    cloned for packages, which is much faster than bootstrapping pip and
+    setuptools each time. Released virtualenvs are reset to the content of
+    the base and reused by next packages of the process, at most
+    settings.VENV_POOL_SIZE of each version are kept.
+    """
+
+    def __init__(self, directory=None, size=None):
+        self.directory = directory or os.path.join(settings.CACHE_DIR, 'venvs')
+        self.size = size or settings.VENV_POOL_SIZE
+        self.lock = threading.Lock()
+        self.base_locks = {}
+        self.base_contents = {}
+        self.failed = set()
+        self.idle = {}
+        self.clones_dir = None
+
+    def base_path(self, python_version):
+        return os.path.join(self.directory, 'base-python{0}'.format(python_version))
+
+    @staticmethod
+    def healthy(path):
+        """Checks that virtualenv in path has working python with pip"""
+        python = os.path.join(path, 'bin', 'python')
+        if not os.path.exists(python):
+            return False
+        with open(os.devnull, 'w') as devnull:
+            try:
+                return subprocess.call([python, '-c', 'import pip'],
+                                       stdout=devnull, stderr=devnull) == 0
+            except OSError:
+                return False
+
+    @staticmethod
+    def create(path, python_version):
+        """Creates virtualenv in path"""
+        env = VirtualEnvironment(path, python='python' + python_version)
+        try:
+            env.open_or_create()
+        except (ve.VirtualenvCreationException, ve.VirtualenvReadonlyException, OSError):
+            raise VirtualenvFailException('Failed to create virtualenv')
+
+    def content(self, path):
+        """Returns top level entries of the virtualenv and DirsContent of it"""
+        dirs_content = DirsContent()
+        dirs_content.fill(path + '/')
+        return set(os.listdir(path)) - set(VENV_LOGS), dirs_content
+
+    def base(self, python_version):
+        """Returns path of healthy base virtualenv of python_version,
+        creating it if needed. Its health is checked once per process.
+        """
+        with self.lock:
+            lock = self.base_locks.setdefault(python_version, threading.Lock())
+        with lock:
+            path = self.base_path(python_version)
+            if python_version in self.base_contents:
+                return path
+            if python_version in self.failed:
+                raise VirtualenvFailException('Failed to create virtualenv')
+            if not self.healthy(path):
+                logger.info('Creating base virtualenv for python{0}.'.format(python_version))
+                download_cache.makedirs(self.directory)
+                temp = tempfile.mkdtemp(prefix='.base-', dir=self.directory)
+                try:
+                    self.create(os.path.join(temp, 'venv'), python_version)
+                    if not self.healthy(os.path.join(temp, 'venv')):
+                        raise VirtualenvFailException('Created virtualenv is broken')
+                    relocate(os.path.join(temp, 'venv'), os.path.join(temp, 'venv'), path)
+                except VirtualenvFailException:
+                    self.failed.add(python_version)
+                    shutil.rmtree(temp)
+                    raise
+                try:
+                    if os.path.exists(path):
+                        shutil.rmtree(path)
+                    try:
+                        os.rename(os.path.join(temp, 'venv'), path)
+                    except OSError as e:
+                        # other process has just created it
+                        if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                            raise
+                finally:
+                    shutil.rmtree(temp)
+            self.base_contents[python_version] = self.content(path)
+            return path
+
+    def acquire(self, python_version):
+        """Returns path of virtualenv of python_version for exclusive use
+        until it's released.
+        """
+        with self.lock:
+            if self.idle.get(python_version):
+                return self.idle[python_version].pop()
+        base = self.base(python_version)
+        with self.lock:
+            if self.clones_dir is None:
+                self.clones_dir = tempfile.mkdtemp(prefix='clones-', dir=self.directory)
+                atexit.register(self.close)
+        path = tempfile.mkdtemp(prefix='venv-', dir=self.clones_dir)
+        try:
+            clone_tree(base, path)
+        except (IOError, OSError):
+            shutil.rmtree(path)
+            raise VirtualenvFailException('Failed to clone virtualenv')
+        return path
+
+    def reset(self, path, python_version):
+        """Removes everything installed into the virtualenv since it was
+        cloned. Returns True if it's back in the state of the base.
+        """
+        entries, dirs_content = self.base_contents[python_version]
+        current_entries, current = self.content(path)
+        delta = current - dirs_content
+        site_packages_dir = site_packages(path)
+        for name in delta.bindir:
+            remove_path(os.path.join(path, 'bin', name))
+        for name in delta.lib_sitepackages:
+            remove_path(os.path.join(site_packages_dir, name))
+        for name in current_entries - entries:
+            remove_path(os.path.join(path, name))
+        current_entries, current = self.content(path)
+        return (current_entries == entries and current.bindir == dirs_content.bindir and
+                current.lib_sitepackages == dirs_content.lib_sitepackages)
+
+    def release(self, path, python_version):
+        """Returns virtualenv to the pool or removes it if it can't be reused"""
+        try:
+            reusable = self.reset(path, python_version) and os.path.exists(
+                os.path.join(path, 'bin', 'python'))
+        except (IOError, OSError, VirtualenvFailException):
+            logger.debug('Failed to reset virtualenv {0}.'.format(path), exc_info=True)
+            reusable = False
+        with self.lock:
+            idle = self.idle.setdefault(python_version, [])
+            if reusable and len(idle) < self.size:
+                idle.append(path)
+                return
+        shutil.rmtree(path, ignore_errors=True)
+
+    def close(self):
+        """Removes all the clones, base virtualenvs are kept"""
+        with self.lock:
+            self.idle = {}
+            if self.clones_dir is not None:
+                shutil.rmtree(self.clones_dir, ignore_errors=True)
+                self.clones_dir = None
+
+
+_venv_pool = None
+_venv_pool_lock = threading.Lock()
+
+
+def venv_pool():
+    """Returns VenvPool of the process or None if pooling is disabled in settings"""
+    global _venv_pool
+    if not settings.VENV_POOL:
+        return None
+    with _venv_pool_lock:
+        if _venv_pool is None:
+            _venv_pool = VenvPool()
+        return _venv_pool
+
+
+def installed_files(target):
+    """Returns paths of files installed into target by pip install --target,
+    relative to target, read from RECORD files of installed distributions.
+    Target is listed if there is no RECORD (e.g. legacy egg-info install).
+    """
+    records = glob.glob(os.path.join(target, '*.dist-info', 'RECORD'))
+    if not records:
+        logger.debug('No RECORD found in {0}, listing installed files.'.format(target))
+        return [os.path.relpath(os.path.join(root, name), target).replace(os.sep, '/')
+                for root, dirs, files in os.walk(target) for name in dirs + files
+                if root in (target, os.path.join(target, 'bin'))]
+    paths = []
+    for record in records:
+        with open(record) as f:
+            paths.extend(row[0] for row in csv.reader(f) if row)
+    return paths
+
+
 class VirtualEnv(object):
 
     modul_pattern = re.compile(r'\.py.?$')
+    metadata_pattern = re.compile(r'(\.dist-info|\.egg-info|\.pth|^__pycache__)$')
 
-    def __init__(self, name, temp_dir, name_convertor, base_python_version):
+    def __init__(self, name, temp_dir, name_convertor, base_python_version, pool=None):
         self.name = name
         self.temp_dir = temp_dir
+        self.target_dir = os.path.join(temp_dir, 'target')
         self.name_convertor = name_convertor
         if not base_python_version:
             base_python_version = DEFAULT_PYTHON_VERSION
+        self.base_python_version = base_python_version
         python_version = 'python' + base_python_version
-        self.env = VirtualEnvironment(temp_dir + '/venv', python=python_version)
+        self.pool = pool
+        if pool is not None:
+            self.path = pool.acquire(base_python_version)
+        else:
+            self.path = temp_dir + '/venv'
+        self.env = VirtualEnvironment(self.path, python=python_version)
         try:
             self.env.open_or_create()
         except (ve.VirtualenvCreationException, ve.VirtualenvReadonlyException):
+            self.close()
             raise VirtualenvFailException('Failed to create virtualenv')
-        self.dirs_before_install = DirsContent()
-        self.dirs_after_install = DirsContent()
-        self.dirs_before_install.fill(temp_dir + '/venv/')
         self.data = {}
 
+    def close(self):
+        """Returns pooled virtualenv to the pool"""
+        if self.pool is not None and self.path is not None:
+            self.pool.release(self.path, self.base_python_version)
+            self.path = None
+
     def install_package_to_venv(self):
         '''
-        Installs package given as first argument to virtualenv without
-        dependencies
+        Installs package given as first argument without dependencies
+        into empty target dir using pip of the virtualenv, the virtualenv
+        itself is left untouched
         '''
         try:
-            self.env.install(self.name, options=["--no-deps"])
+            self.env.install(self.name, force=True,
+                             options=["--no-deps", "--target", self.target_dir])
         except (ve.PackageInstallationException, ve.VirtualenvReadonlyException):
             raise VirtualenvFailException('Failed to install package to virtualenv')
-        self.dirs_after_install.fill(self.temp_dir + '/venv/')
 
     @property
-    def get_dirs_differance(self):
+    def get_installed_content(self):
         '''
-        Makes final versions of site_packages and scripts using DirsContent
-        sub method and filters
+        Makes final versions of site_packages and scripts from files
+        installed into target dir
         '''
-        try:
-            diff = self.dirs_after_install - self.dirs_before_install
-        except ValueError:
-            raise VirtualenvFailException("Some of the DirsContent attributes is uninicialized")
-        site_packages = site_packages_filter(diff.lib_sitepackages)
-        packages = set([p for p in site_packages if not self.modul_pattern.search(p)])
-        py_modules = set([os.path.splitext(m)[0] for m in site_packages - packages])
-        scripts = scripts_filter(list(diff.bindir))
-        logger.debug('Packages from files differance in virtualenv: {0}.'.format(
-            packages))
-        logger.debug('py_modules from files differance in virtualenv: {0}.'.format(
-            py_modules))
-        logger.debug('Scripts from files differance in virtualenv: {0}.'.format(scripts))
+        top_level = set()
+        scripts = set()
+        for path in installed_files(self.target_dir):
+            parts = posixpath.normpath(path).split('/')
+            if '..' in parts or parts[0] == 'bin':
+                # outside of site-packages, e.g. ../../bin/script
+                if len(parts) > 1 and parts[-2] == 'bin':
+                    scripts.add(parts[-1])
+            elif not self.metadata_pattern.search(parts[0]):
+                top_level.add(parts[0])
+        packages = set([p for p in top_level if not self.modul_pattern.search(p)])
+        py_modules = set([os.path.splitext(m)[0] for m in top_level - packages])
+        scripts = scripts_filter(sorted(scripts))
+        logger.debug('Packages installed from virtualenv: {0}.'.format(packages))
+        logger.debug('py_modules installed from virtualenv: {0}.'.format(py_modules))
+        logger.debug('Scripts installed from virtualenv: {0}.'.format(scripts))
         return (packages, py_modules, scripts)
 
     @property
     def get_venv_data(self):
         self.install_package_to_venv()
         (self.data['packages'], self.data['py_modules'],
-         self.data['scripts']) = self.get_dirs_differance
+         self.data['scripts']) = self.get_installed_content
         return self.data
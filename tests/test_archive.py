@@ -1,13 +1,15 @@
 import os
+import shutil
+import tempfile
 
 from tarfile import TarFile
-from zipfile import ZipFile
+from zipfile import ZipFile, ZIP_STORED, ZIP_DEFLATED
 
 import pytest
 
 from flexmock import flexmock
 
-from pyp2rpm.archive import Archive, flat_list
+from pyp2rpm.archive import Archive, ExtractOnOpen, SeekableTarWrapper, flat_list
 
 
 @pytest.mark.parametrize(('arg', 'expected'), [
@@ -142,3 +144,143 @@ class TestArchive(object):
     def test_has_argument(self, i, arg, expected):
         with self.a[i] as a:
             assert a.has_argument(arg) == expected
+
+    @pytest.mark.parametrize(('i', 'suf', 'expected'), [
+        (0, '.egg-info', True),
+        (1, '.egg-info', True),
+        (4, '.egg-info', False),
+    ])
+    def test_has_file_with_directory_suffix(self, i, suf, expected):
+        with self.a[i] as a:
+            assert a.has_file_with_suffix(suf) == expected
+
+    @pytest.mark.parametrize(('i', 'name', 'full_path', 'expected'), [
+        (0, 'PKG-INFO', False, ['plumbum-0.9.0/PKG-INFO',
+                                'plumbum-0.9.0/plumbum.egg-info/PKG-INFO']),
+        (0, 'plumbum-0.9.0/PKG-INFO', True, ['plumbum-0.9.0/PKG-INFO']),
+        (0, 'PKG-INFO', True, []),
+        (1, 'pytest-2.2.3/_pytest', True, []),
+    ])
+    def test_index_find(self, i, name, full_path, expected):
+        with self.a[i] as a:
+            assert set(m.name for m in a.index.find(name, full_path)) == set(expected)
+
+    def test_index_implied_directories(self):
+        with self.a[1] as a:
+            assert 'pytest-2.2.3/_pytest' in a.index.directories
+            assert 'pytest-2.2.3/setup.py' not in a.index.directories
+
+    def test_get_content_of_file_cached(self):
+        with self.a[0] as a:
+            first = a.get_content_of_file('setup.cfg')
+            flexmock(a.handle).should_receive('extractfile').never()
+            assert a.get_content_of_file('setup.cfg', False) == first
+            assert (a.content_cache.hits, a.content_cache.misses) == (1, 1)
+        assert len(self.a[0].content_cache) == 0
+
+
+class TestExtractOnOpen(object):
+    td_dir = '{0}/test_data/'.format(tests_dir)
+
+    def setup_method(self, method):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.temp_dir)
+
+    def test_missing_file_extracted_on_open(self):
+        setup_py = os.path.join(self.temp_dir, 'restsh-0.1', 'setup.py')
+        with Archive('{0}restsh-0.1.tar.gz'.format(self.td_dir)) as a:
+            with ExtractOnOpen(a, self.temp_dir) as on_demand:
+                with open(setup_py) as f:
+                    assert 'setup(' in f.read()
+                with pytest.raises(IOError):
+                    open(os.path.join(self.temp_dir, 'restsh-0.1', 'spam'))
+        assert on_demand.extracted_bytes == os.path.getsize(setup_py)
+
+
+class TestSeekableTar(object):
+    td_dir = '{0}/test_data/'.format(tests_dir)
+
+    def setup_method(self, method):
+        self.temp_dir = tempfile.mkdtemp()
+        self.archive_file = os.path.join(self.temp_dir, 'plumbum-0.9.0.tar.gz')
+        shutil.copy2('{0}plumbum-0.9.0.tar.gz'.format(self.td_dir), self.archive_file)
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.temp_dir)
+
+    def test_same_content_as_tarfile(self):
+        with Archive(self.archive_file) as a:
+            expected = a.get_content_of_file('setup.py')
+        with Archive(self.archive_file, seekable=True) as a:
+            assert isinstance(a.handle, SeekableTarWrapper)
+            assert a.get_content_of_file('setup.py') == expected
+            assert a.get_content_of_file('setup.cfg') is not None
+
+    def test_index_persisted(self):
+        archive = Archive(self.archive_file, seekable=True)
+        with archive as a:
+            members = set(m.name for m in a.index.members)
+        assert os.path.exists(archive.index_file)
+
+        with archive as a:
+            assert set(m.name for m in a.index.members) == members
+            assert a.has_file_with_suffix('.egg-info')
+            # names are answered from the persisted index without decompression
+            assert a.handle._tarfile is None
+            assert a.get_content_of_file('setup.cfg').startswith('[egg_info]')
+
+    def test_stale_index_ignored(self):
+        archive = Archive(self.archive_file, seekable=True)
+        with archive as a:
+            pass
+        with open(self.archive_file, 'ab') as f:
+            f.write(b'\0')
+        assert SeekableTarWrapper(self.archive_file, archive.index_file).load_index() is None
+
+    def test_extract_file(self):
+        with Archive(self.archive_file, seekable=True) as a:
+            a.extract_file('setup.py', directory=self.temp_dir)
+        assert os.path.exists(os.path.join(self.temp_dir, 'plumbum-0.9.0', 'setup.py'))
+
+
+class TestMappedZip(object):
+    td_dir = '{0}/test_data/'.format(tests_dir)
+
+    def setup_method(self, method):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.temp_dir)
+
+    @pytest.mark.parametrize('archive_file', [
+        'pytest-2.2.3.zip',
+        'setuptools-19.6-py2.py3-none-any.whl',
+        'Sphinx-1.1.3-py2.6.egg',
+    ])
+    def test_read_same_as_zipfile(self, archive_file):
+        with Archive('{0}{1}'.format(self.td_dir, archive_file)) as a:
+            assert a.handle._mapped is not None
+            zip_file = ZipFile('{0}{1}'.format(self.td_dir, archive_file))
+            for member in a.index.files:
+                assert bytes(a.handle.read(member)) == zip_file.read(member.name)
+            zip_file.close()
+
+    def test_stored_member_is_not_copied(self):
+        archive_file = os.path.join(self.temp_dir, 'spam-1.0-py2.py3-none-any.whl')
+        zip_file = ZipFile(archive_file, 'w')
+        zip_file.writestr('spam-1.0.dist-info/RECORD', 'spam/__init__.py,,\n', ZIP_STORED)
+        zip_file.writestr('spam/__init__.py', 'spam = 1\n', ZIP_DEFLATED)
+        zip_file.close()
+        with Archive(archive_file) as a:
+            record = a.handle.read('spam-1.0.dist-info/RECORD')
+            assert isinstance(record, memoryview)
+            assert bytes(record) == b'spam/__init__.py,,\n'
+            del record
+            assert a.get_content_of_file('__init__.py') == 'spam = 1\n'
+
+    def test_extract_file(self):
+        with Archive('{0}pytest-2.2.3.zip'.format(self.td_dir)) as a:
+            a.extract_file('setup.py', directory=self.temp_dir)
+        assert os.path.exists(os.path.join(self.temp_dir, 'pytest-2.2.3', 'setup.py'))
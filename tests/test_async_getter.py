@@ -0,0 +1,166 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import pytest
+
+from flexmock import flexmock
+
+try:
+    from socketserver import ThreadingMixIn
+    from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+    from pyp2rpm.async_getter import (AsyncDownload, AsyncPypiClient, AsyncPypiGetter,
+                                      HttpPool, event_loop, resolve_many)
+except (ImportError, SyntaxError):
+    pytestmark = pytest.mark.skip(reason='asyncio getter requires Python 3')
+
+from pyp2rpm.exceptions import NoSuchPackageException
+from pyp2rpm import settings
+
+CONTENT = b'spam' * 100000
+
+
+class PypiRequestHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    rpc_paths = ('/pypi',)
+
+    def do_GET(self):
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/files/spam-2.tar.gz')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path != '/files/spam-2.tar.gz':
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(CONTENT)))
+        self.end_headers()
+        self.wfile.write(CONTENT)
+
+    def log_message(self, *args):
+        pass
+
+
+class PypiServer(ThreadingMixIn, SimpleXMLRPCServer):
+    """Stand-in for PyPI and its file server"""
+    daemon_threads = True
+
+    def __init__(self):
+        SimpleXMLRPCServer.__init__(self, ('127.0.0.1', 0), PypiRequestHandler,
+                                    logRequests=False, allow_none=True)
+        self.lock = threading.Lock()
+        self.running = self.max_running = 0
+        for function in (self.package_releases, self.release_urls, self.release_data):
+            self.register_function(function)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}'.format(self.server_address[1])
+
+    def package_releases(self, name):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.running, self.max_running)
+        time.sleep(0.1)
+        with self.lock:
+            self.running -= 1
+        return ['2', '1'] if name.startswith('spam') else []
+
+    def release_urls(self, name, version):
+        if version not in ('2', '1'):
+            return []
+        return [{'url': '{0}/files/spam-{1}.tar.gz'.format(self.url, version),
+                 'md5_digest': hashlib.md5(CONTENT).hexdigest(),
+                 'digests': {'sha256': hashlib.sha256(CONTENT).hexdigest()}}]
+
+    def release_data(self, name, version):
+        return {'name': name, 'version': version, 'download_url': ''}
+
+
+class TestAsyncGetter(object):
+
+    def setup_method(self, method):
+        self.temp_dir = tempfile.mkdtemp()
+        flexmock(settings, CACHE_DIR=os.path.join(self.temp_dir, 'cache'))
+        self.server = PypiServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.client = AsyncPypiClient(self.server.url + '/pypi', HttpPool(per_host=2))
+
+    def teardown_method(self, method):
+        event_loop().loop.call_soon_threadsafe(self.client.http.close)
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_resolve_many(self):
+        start = time.time()
+        results = resolve_many(self.client, [('spam{0}'.format(i), None) for i in range(6)] +
+                                            [('spam', '1'), ('eggs', None)])
+        assert results[:7] == ['2'] * 6 + ['1']
+        assert isinstance(results[7], NoSuchPackageException)
+        # at most 2 requests at once, 0.1 s each
+        assert self.server.max_running == 2
+        assert time.time() - start < 0.8
+        assert self.client.http.connections == 2
+
+    def test_memo(self):
+        resolve_many(self.client, [('spam', None)] * 4)
+        assert self.server.max_running == 1
+        assert len(self.client.memo) == 3
+
+    def test_getter(self):
+        getter = AsyncPypiGetter(self.client, 'spam', save_dir=self.temp_dir)
+        assert getter.get_name_version() == ('spam', '2')
+        save_file = getter.get()
+        assert save_file == os.path.join(self.temp_dir, 'spam-2.tar.gz')
+        with open(save_file, 'rb') as f:
+            assert f.read() == CONTENT
+
+    def test_getter_no_such_version(self):
+        with pytest.raises(NoSuchPackageException):
+            AsyncPypiGetter(self.client, 'spam', '3', save_dir=self.temp_dir)
+
+    def test_blocked_consumer(self):
+        class BlockedConsumer(object):
+            def __init__(self):
+                self.feeding = threading.Event()
+                self.unblock = threading.Event()
+
+            def feed(self, chunk):
+                self.feeding.set()
+                self.unblock.wait(10)
+
+            def close(self):
+                pass
+
+            def abort(self):
+                pass
+
+        consumer = BlockedConsumer()
+        path = os.path.join(self.temp_dir, 'spam-2.tar.gz')
+        thread = threading.Thread(target=AsyncDownload(
+            self.client.http, self.server.url + '/files/spam-2.tar.gz', path,
+            consumers=[consumer]).run)
+        thread.daemon = True
+        thread.start()
+        assert consumer.feeding.wait(10)
+        # the loop serves other requests while the consumer is blocked
+        assert event_loop().run(self.client.call('release_data', 'spam', '2'))['name'] == 'spam'
+        assert thread.is_alive()
+        consumer.unblock.set()
+        thread.join(10)
+        with open(path, 'rb') as f:
+            assert f.read() == CONTENT
+
+    def test_redirect(self):
+        status, headers, body = event_loop().run(
+            self.client.http.fetch('GET', self.server.url + '/redirect'))
+        assert status == 200
+        assert body == CONTENT
@@ -1,12 +1,20 @@
+import copy
+import shutil
+import tempfile
+
 import pytest
 
 from flexmock import flexmock
 
-from pyp2rpm.convertor import Convertor
+import jinja2
+
+from pyp2rpm.convertor import (Convertor, BatchConvertor, async_getter_enabled,
+                               jinja_environment, new_jinja_environment)
 from pyp2rpm.exceptions import *
 from pyp2rpm.metadata_extractors import *
 from pyp2rpm.package_getters import *
 from pyp2rpm.package_data import PackageData
+from pyp2rpm import convertor as convertor_module
 from pyp2rpm import settings
 
 tests_dir = os.path.split(os.path.abspath(__file__))[0]
@@ -35,14 +43,19 @@ class TestConvertor(object):
             c = Convertor(package=sf)
             c.getter
 
-    @pytest.mark.parametrize(('sf', 'expected'), [
-        ('{0}plumbum-0.9.0.tar.gz'.format(td_dir), DistMetadataExtractor),
-        ('{0}setuptools-19.6-py2.py3-none-any.whl'.format(td_dir), WheelMetadataExtractor)
+    @pytest.mark.parametrize(('sf', 'static', 'expected'), [
+        ('{0}plumbum-0.9.0.tar.gz'.format(td_dir), True, DeclarativeMetadataExtractor),
+        ('{0}versiontools-1.9.1.tar.gz'.format(td_dir), True, AstMetadataExtractor),
+        ('{0}bitarray-0.8.0.tar.gz'.format(td_dir), True, DistMetadataExtractor),
+        ('{0}plumbum-0.9.0.tar.gz'.format(td_dir), False, DistMetadataExtractor),
+        ('{0}setuptools-19.6-py2.py3-none-any.whl'.format(td_dir), True,
+         WheelMetadataExtractor)
     ])
-    def test_get_metadata_extractor(self, sf, expected):
+    def test_get_metadata_extractor(self, sf, static, expected, monkeypatch):
+        monkeypatch.setattr(settings, 'STATIC_METADATA', static)
         c = Convertor(package=sf)
         c.local_file = sf
-        c.name = 'plumbum'
+        c.name = os.path.basename(sf).split('-')[0]
         assert isinstance(c.metadata_extractor, expected)
 
     @pytest.mark.parametrize(('self_bv', 'self_pv', 'data_bv', 'data_pv',
@@ -93,3 +106,148 @@ class TestConvertor(object):
         data = PackageData('pkg.tar.gz', 'pkg', 'pkg', '0.1')
         with pytest.raises(SystemExit):
             c.merge_versions(data)
+
+
+class TestConvertTargets(object):
+    td_dir = '{0}/test_data/'.format(tests_dir)
+
+    def setup_method(self, method):
+        self.temp_dir = tempfile.mkdtemp()
+        self.convertor = Convertor(package='{0}plumbum-0.9.0.tar.gz'.format(self.td_dir),
+                                   save_dir=self.temp_dir, venv=False)
+        self.convertor._client = None
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.temp_dir)
+
+    @pytest.mark.parametrize(('template', 'expected_template', 'expected_distro'), [
+        ('epel7', 'epel7.spec', 'fedora'),
+        ('mageia', 'mageia.spec', 'mageia'),
+        ('/spam/ham.spec', '/spam/ham.spec', 'fedora'),
+    ])
+    def test_target(self, template, expected_template, expected_distro):
+        target = self.convertor.target(template)
+        assert (target.template, target.distro) == (expected_template, expected_distro)
+        assert self.convertor.template == 'fedora.spec'
+
+    def test_convert_targets(self):
+        expected = copy.copy(self.convertor).convert()
+        # one extraction for fedora rules and one for mageia
+        flexmock(Convertor).should_call('extract_metadata').twice()
+        converted = self.convertor.convert_targets(['fedora', 'epel7', 'epel6', 'mageia'])
+        assert [c.template for c, chunks in converted] == [
+            'fedora.spec', 'epel7.spec', 'epel6.spec', 'mageia.spec']
+        assert converted[3][0].name_convertor.distro == 'mageia'
+        specs = [u''.join(chunks) for c, chunks in converted]
+        assert len(set(specs)) == 4
+        assert specs[0] == expected
+
+    def test_generate(self):
+        self.convertor.download()
+        data = self.convertor.extract()
+        assert u''.join(self.convertor.generate(data)) == self.convertor.render(data)
+
+
+@pytest.mark.parametrize(('async_getter', 'proxy', 'expected'), [
+    (True, None, True),
+    (True, 'proxy.server:3128', False),
+    (False, None, False),
+])
+def test_async_getter_enabled(monkeypatch, async_getter, proxy, expected):
+    if convertor_module.async_getter is None:
+        pytest.skip('asyncio getter requires Python 3')
+    monkeypatch.setattr(settings, 'ASYNC_GETTER', async_getter)
+    assert async_getter_enabled(proxy) is expected
+
+
+class TestJinjaEnvironment(object):
+
+    def setup_method(self, method):
+        self.temp_dir = tempfile.mkdtemp()
+        flexmock(settings, CACHE_DIR=self.temp_dir)
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.temp_dir)
+
+    def test_shared(self):
+        assert jinja_environment() is jinja_environment()
+        assert Convertor(package='spam').jinja_env is jinja_environment()
+
+    def test_bytecode_cache(self):
+        new_jinja_environment().get_template('fedora.spec')
+        assert os.listdir(os.path.join(self.temp_dir, 'templates'))
+        jinja_env = new_jinja_environment()
+        flexmock(jinja_env).should_receive('compile').never()
+        assert isinstance(jinja_env.get_template('fedora.spec'), jinja2.Template)
+
+    def test_bytecode_cache_disabled(self):
+        flexmock(settings, TEMPLATE_CACHE=False)
+        new_jinja_environment().get_template('fedora.spec')
+        assert not os.path.exists(os.path.join(self.temp_dir, 'templates'))
+
+    def test_bytecode_cache_unwritable(self):
+        jinja_env = new_jinja_environment()
+        shutil.rmtree(os.path.join(self.temp_dir, 'templates'))
+        assert isinstance(jinja_env.get_template('fedora.spec'), jinja2.Template)
+
+
+class TestBatchConvertor(object):
+    td_dir = '{0}/test_data/'.format(tests_dir)
+
+    def setup_method(self, method):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.temp_dir)
+
+    @pytest.mark.parametrize(('spec', 'expected'), [
+        ('spam', ('spam', None)),
+        (' spam==1.0 ', ('spam', '1.0')),
+        ('{0}plumbum-0.9.0.tar.gz'.format(td_dir),
+         ('{0}plumbum-0.9.0.tar.gz'.format(td_dir), None)),
+    ])
+    def test_parse_package_spec(self, spec, expected):
+        assert BatchConvertor.parse_package_spec(spec) == expected
+
+    def test_read_package_specs(self):
+        lines = ['spam\n', '\n', '# comment\n', 'eggs==1.0  # pinned\n']
+        assert list(BatchConvertor.read_package_specs(lines)) == ['spam', 'eggs==1.0']
+
+    def test_shared_resources(self):
+        batch = BatchConvertor([], save_dir=self.temp_dir, distro='fedora')
+        first = batch.convertor('{0}plumbum-0.9.0.tar.gz'.format(self.td_dir))
+        second = batch.convertor('{0}restsh-0.1.tar.gz'.format(self.td_dir))
+        assert first.jinja_env is second.jinja_env is batch.jinja_env
+        assert first.name_convertor is second.name_convertor
+
+    def test_convert(self):
+        specs = ['{0}plumbum-0.9.0.tar.gz'.format(self.td_dir),
+                 '/spam/beans/eggs/ham-0.1.tar.gz',
+                 '{0}restsh-0.1.tar.gz'.format(self.td_dir)]
+        batch = BatchConvertor(specs, save_dir=self.temp_dir, venv=False)
+        batch._client = flexmock(package_releases=lambda n: [])
+        results = batch.convert()
+        assert not isinstance(results, list)
+        results = list(results)
+        assert [result.package for result in results] == specs
+        assert [result.succeeded for result in results] == [True, False, True]
+        assert '%global pypi_name plumbum' in results[0].specfile
+        assert isinstance(results[1].error, NoSuchPackageException)
+        assert '%global pypi_name restsh' in results[2].specfile
+
+    @pytest.mark.parametrize('ordered', [True, False])
+    def test_convert_parallel(self, ordered):
+        specs = ['{0}plumbum-0.9.0.tar.gz'.format(self.td_dir),
+                 '/spam/beans/eggs/ham-0.1.tar.gz',
+                 '{0}restsh-0.1.tar.gz'.format(self.td_dir)]
+        batch = BatchConvertor(specs, download_jobs=2, extract_jobs=2, ordered=ordered,
+                               save_dir=self.temp_dir, venv=False)
+        batch._client = flexmock(package_releases=lambda n: [])
+        results = list(batch.convert())
+        if not ordered:
+            results.sort(key=lambda result: specs.index(result.package))
+        assert [result.package for result in results] == specs
+        assert [result.succeeded for result in results] == [True, False, True]
+        assert '%global pypi_name plumbum' in results[0].specfile
+        assert isinstance(results[1].error, NoSuchPackageException)
+        assert '%global pypi_name restsh' in results[2].specfile
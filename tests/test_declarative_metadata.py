@@ -0,0 +1,149 @@
+import pytest
+
+from pyp2rpm import declarative_metadata as dm
+
+SETUP_CFG = """
+[metadata]
+license = MIT
+description = Spam and eggs
+long_description = file: README.rst
+classifiers =
+    Programming Language :: Python :: 2.7
+    Programming Language :: Python :: 3.5
+
+[options]
+install_requires =
+    spam>=1.0
+    # comment
+    eggs; python_version < "3"
+setup_requires = setuptools_scm
+packages = find:
+py_modules = ham
+
+[options.packages.find]
+exclude = tests
+
+[options.entry_points]
+console_scripts =
+    spam = spam.cli:main
+"""
+
+PKG_INFO = """Metadata-Version: 2.1
+Name: spam
+Version: 1.0
+Summary: Spam and eggs
+Home-page: https://example.com/spam
+License: UNKNOWN
+Classifier: Programming Language :: Python :: 3
+Requires-Dist: eggs (>=1.0)
+Requires-Dist: pytest; extra == 'test'
+
+Long description.
+"""
+
+PYPROJECT = """
+[build-system]
+requires = ["setuptools>=40.8", "wheel", "cython"]
+
+[project]
+name = "spam"
+dependencies = ["eggs>=1.0"]
+license = {text = "MIT"}
+dynamic = ["classifiers"]
+
+[project.scripts]
+spam = "spam.cli:main"
+
+[project.urls]
+Homepage = "https://example.com/spam"
+"""
+
+
+class TestDeclarativeMetadata(object):
+
+    @pytest.mark.parametrize(('value', 'semicolon', 'expected'), [
+        ('spam, eggs', False, ['spam', 'eggs']),
+        ('spam; eggs', True, ['spam', 'eggs']),
+        ('\nspam\n# ham\neggs', False, ['spam', 'eggs']),
+        ('', False, []),
+    ])
+    def test_parse_list(self, value, semicolon, expected):
+        assert dm.parse_list(value, semicolon) == expected
+
+    @pytest.mark.parametrize(('argument', 'expected'), [
+        ('license', 'MIT'),
+        ('long_description', 'Spam!'),
+        ('classifiers', ['Programming Language :: Python :: 2.7',
+                         'Programming Language :: Python :: 3.5']),
+        ('install_requires', ['spam>=1.0', 'eggs; python_version < "3"']),
+        ('setup_requires', ['setuptools_scm']),
+        ('py_modules', ['ham']),
+        ('entry_points', {'console_scripts': ['spam = spam.cli:main']}),
+    ])
+    def test_parse_setup_cfg(self, argument, expected):
+        arguments, unresolved = dm.parse_setup_cfg(
+            SETUP_CFG, {'README.rst': 'Spam!'}.get)
+        assert arguments[argument] == expected
+        assert not unresolved
+
+    def test_parse_setup_cfg_find(self):
+        arguments, _ = dm.parse_setup_cfg(SETUP_CFG)
+        assert isinstance(arguments['packages'], dm.Directive)
+        assert arguments['packages'].value == {'exclude': 'tests'}
+
+    @pytest.mark.parametrize(('content', 'unresolved'), [
+        ('[metadata]\nlong_description = file: MISSING.rst', set(['long_description'])),
+        ('[options]\ninstall_requires = attr: spam.REQS', set(['install_requires'])),
+        ('[metadata\nspam', set()),
+    ])
+    def test_parse_setup_cfg_unresolved(self, content, unresolved):
+        arguments, found_unresolved = dm.parse_setup_cfg(content, lambda name: None)
+        assert found_unresolved == unresolved
+        assert not set(arguments) & unresolved
+
+    @pytest.mark.parametrize(('content', 'expected'), [
+        ('[bdist_rpm]\nrequires = spam, eggs\nforce-arch = x86_64',
+         {'requires': 'spam, eggs', 'force_arch': 'x86_64'}),
+        (SETUP_CFG, {}),
+        ('[bdist_rpm\nspam', {}),
+    ])
+    def test_parse_command_options(self, content, expected):
+        assert dm.parse_command_options(content, 'bdist_rpm') == expected
+
+    @pytest.mark.parametrize(('argument', 'expected'), [
+        ('description', 'Spam and eggs'),
+        ('url', 'https://example.com/spam'),
+        ('classifiers', ['Programming Language :: Python :: 3']),
+        ('long_description', 'Long description.\n'),
+        ('install_requires', ['eggs (>=1.0)']),
+    ])
+    def test_parse_pkg_info(self, argument, expected):
+        arguments, dynamic = dm.parse_pkg_info(PKG_INFO)
+        assert arguments[argument] == expected
+        assert 'license' not in arguments
+
+    @pytest.mark.parametrize(('version', 'expected'), [
+        ('1.1', False),
+        ('2.2', True),
+    ])
+    def test_parse_pkg_info_no_requires(self, version, expected):
+        arguments, _ = dm.parse_pkg_info('Metadata-Version: {0}\nName: spam\n'.format(version))
+        assert ('install_requires' in arguments) == expected
+
+    def test_parse_requires_txt(self):
+        content = 'spam\n\n[test]\npytest\n\n[:python_version < "3"]\neggs\n'
+        assert dm.parse_requires_txt(content) == ['spam', 'eggs; python_version < "3"']
+
+    @pytest.mark.skipif(dm.toml is None, reason='No TOML parser available')
+    @pytest.mark.parametrize(('argument', 'expected'), [
+        ('setup_requires', ['cython']),
+        ('install_requires', ['eggs>=1.0']),
+        ('license', 'MIT'),
+        ('url', 'https://example.com/spam'),
+        ('entry_points', {'console_scripts': ['spam = spam.cli:main']}),
+    ])
+    def test_parse_pyproject(self, argument, expected):
+        arguments, dynamic = dm.parse_pyproject(PYPROJECT)
+        assert arguments[argument] == expected
+        assert dynamic == set(['classifiers'])
+        assert 'classifiers' not in arguments
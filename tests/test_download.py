@@ -0,0 +1,132 @@
+import hashlib
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from flexmock import flexmock
+
+from pyp2rpm.archive import Archive, TarIndexer
+from pyp2rpm.download import Download, download
+from pyp2rpm.exceptions import DigestMismatchException
+
+
+def tar_gz():
+    content = io.BytesIO()
+    tar = tarfile.open(fileobj=content, mode='w:gz')
+    for i in range(20):
+        data = os.urandom(4096)
+        member = tarfile.TarInfo('spam-0.1/file{0}.py'.format(i))
+        member.size = len(data)
+        tar.addfile(member, io.BytesIO(data))
+    tar.close()
+    return content.getvalue()
+
+
+CONTENT = tar_gz()
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """Serves CONTENT, supports Range requests unless server.ranges is False,
+    first response is cut after server.cut bytes.
+    """
+
+    def do_GET(self):
+        self.server.ranges_requested.append(self.headers.get('Range'))
+        start = 0
+        if self.headers.get('Range') and self.server.ranges:
+            start = int(self.headers['Range'].split('=')[1].rstrip('-'))
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        body = CONTENT[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.server.cut:
+            body, self.server.cut = body[:self.server.cut], None
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDownload(object):
+
+    def setup_method(self, method):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'spam-0.1.tar.gz')
+        self.server = HTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+        self.server.ranges = True
+        self.server.ranges_requested = []
+        self.server.cut = None
+        self.url = 'http://127.0.0.1:{0}/spam-0.1.tar.gz'.format(self.server.server_address[1])
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def teardown_method(self, method):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def content(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_download(self):
+        assert download(self.url, self.path,
+                        {'sha256': hashlib.sha256(CONTENT).hexdigest()}) == self.path
+        assert self.content() == CONTENT
+        assert not os.path.exists(self.path + '.part')
+
+    def test_digest_mismatch(self):
+        with pytest.raises(DigestMismatchException):
+            download(self.url, self.path, {'md5': 'spam'})
+        assert not os.path.exists(self.path)
+        assert not os.path.exists(self.path + '.part')
+
+    @pytest.mark.parametrize(('ranges', 'expected'), [
+        (True, [None, 'bytes=10000-']),
+        (False, [None, 'bytes=10000-']),
+    ])
+    def test_resume_interrupted(self, ranges, expected):
+        self.server.ranges = ranges
+        self.server.cut = 10000
+        download(self.url, self.path, {'md5': hashlib.md5(CONTENT).hexdigest()})
+        assert self.content() == CONTENT
+        assert self.server.ranges_requested == expected
+
+    def test_resume_part_file(self):
+        with open(self.path + '.part', 'wb') as f:
+            f.write(CONTENT[:5000])
+        download(self.url, self.path, {'md5': hashlib.md5(CONTENT).hexdigest()})
+        assert self.content() == CONTENT
+        assert self.server.ranges_requested == ['bytes=5000-']
+
+    def test_indexer(self):
+        archive = Archive(self.path, seekable=True)
+        indexer = TarIndexer(self.path, archive.index_file)
+        Download(self.url, self.path, consumers=[indexer]).run()
+        indexer.save()
+        assert len(indexer.members) == 20
+        flexmock(tarfile.TarFile).should_receive('getmembers').never()
+        with archive as a:
+            assert len(a.get_files_re(r'file\d+\.py')) == 20
+
+    def test_indexer_aborted(self):
+        self.server.ranges = False
+        self.server.cut = 10000
+        archive = Archive(self.path, seekable=True)
+        indexer = TarIndexer(self.path, archive.index_file)
+        Download(self.url, self.path, consumers=[indexer]).run()
+        indexer.save()
+        assert indexer.aborted
+        assert not os.path.exists(archive.index_file)
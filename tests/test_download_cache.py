@@ -0,0 +1,183 @@
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+import pytest
+
+from flexmock import flexmock
+
+from pyp2rpm.download_cache import DownloadCache, buffered_copy, clone_file, file_digests
+from pyp2rpm import download_cache
+from pyp2rpm.package_getters import PypiDownloader, release_digests
+from pyp2rpm import package_getters
+from pyp2rpm import settings
+
+CONTENT = b'spam' * 1024
+
+
+def digests_of(content):
+    return {'md5': hashlib.md5(content).hexdigest(),
+            'sha256': hashlib.sha256(content).hexdigest()}
+
+
+class TestCloneFile(object):
+
+    def setup_method(self, method):
+        self.temp_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.temp_dir, 'source')
+        self.destination = os.path.join(self.temp_dir, 'destination')
+        with open(self.source, 'wb') as f:
+            f.write(CONTENT)
+        os.chmod(self.source, 0o640)
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.temp_dir)
+
+    def test_clone_file(self):
+        assert clone_file(self.source, self.destination) in (
+            'reflink', 'copy_file_range', 'sendfile', 'buffered_copy')
+        with open(self.destination, 'rb') as f:
+            assert f.read() == CONTENT
+        assert os.stat(self.destination).st_mode == os.stat(self.source).st_mode
+
+    def test_fallback(self):
+        def unsupported(source, destination):
+            destination.write(source.read(10))
+            raise OSError(errno.EXDEV, 'cross-device')
+        flexmock(download_cache, COPY_METHODS=[unsupported, buffered_copy])
+        assert clone_file(self.source, self.destination) == 'buffered_copy'
+        with open(self.destination, 'rb') as f:
+            assert f.read() == CONTENT
+
+    def test_failure(self):
+        def failing(source, destination):
+            raise IOError(errno.EIO, 'I/O error')
+        flexmock(download_cache, COPY_METHODS=[failing, buffered_copy])
+        with pytest.raises(IOError):
+            clone_file(self.source, self.destination)
+
+
+class TestDownloadCache(object):
+
+    def setup_method(self, method):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = DownloadCache(os.path.join(self.temp_dir, 'cache'), max_size=10 * 1024)
+        self.downloads = []
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.temp_dir)
+
+    def retrieve(self, url, path):
+        self.downloads.append(url)
+        with open(path, 'wb') as f:
+            f.write(CONTENT if url.endswith('spam') else url.encode('utf-8') * 1024)
+
+    def file(self, name, content=CONTENT):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_file_digests(self):
+        assert file_digests(self.file('spam'), ['md5', 'sha256']) == digests_of(CONTENT)
+
+    def test_put_get(self):
+        cached = self.cache.put(self.file('spam'), {'md5': digests_of(CONTENT)['md5']})
+        assert cached == self.cache.path('sha256', digests_of(CONTENT)['sha256'])
+        assert os.path.samefile(cached, self.cache.path('md5', digests_of(CONTENT)['md5']))
+        assert os.path.samefile(self.cache.get({'md5': digests_of(CONTENT)['md5'].upper()}),
+                                cached)
+        assert self.cache.get({'md5': 'eggs'}) is None
+
+    def test_put_wrong_digest(self):
+        assert self.cache.put(self.file('spam'), {'md5': 'eggs'}) is None
+        assert self.cache.get(digests_of(CONTENT)) is None
+
+    def test_retrieve(self):
+        save_file = os.path.join(self.temp_dir, 'spam.tar.gz')
+        assert self.cache.retrieve('http://spam', save_file, digests_of(CONTENT), self.retrieve)
+        os.remove(save_file)
+        assert not self.cache.retrieve('http://spam', save_file, digests_of(CONTENT),
+                                       self.retrieve)
+        assert self.downloads == ['http://spam']
+        with open(save_file, 'rb') as f:
+            assert f.read() == CONTENT
+        assert not os.path.samefile(save_file, self.cache.get(digests_of(CONTENT)))
+        assert [name for name in os.listdir(self.temp_dir) if name.endswith('.tmp')] == []
+
+    @pytest.mark.parametrize('existing', [False, True])
+    def test_save_file_changed(self, existing):
+        save_file = os.path.join(self.temp_dir, 'spam.tar.gz')
+        if existing:
+            self.file('spam.tar.gz')
+        self.cache.retrieve('http://spam', save_file, digests_of(CONTENT), self.retrieve)
+        with open(save_file, 'ab') as f:
+            f.write(b'patched')
+        os.remove(save_file)
+        assert not self.cache.retrieve('http://spam', save_file, digests_of(CONTENT),
+                                       self.retrieve)
+        with open(save_file, 'rb') as f:
+            assert f.read() == CONTENT
+
+    def test_retrieve_existing_save_file(self):
+        save_file = self.file('spam.tar.gz')
+        assert not self.cache.retrieve('http://spam', save_file, digests_of(CONTENT),
+                                       self.retrieve)
+        assert self.downloads == []
+        assert self.cache.get(digests_of(CONTENT)) is not None
+
+    def test_retrieve_wrong_digest(self):
+        save_file = os.path.join(self.temp_dir, 'spam.tar.gz')
+        assert self.cache.retrieve('http://spam', save_file, {'md5': 'eggs'}, self.retrieve)
+        assert os.path.isfile(save_file)
+        assert self.cache.entries() == []
+
+    def test_evict(self):
+        self.cache.max_size = 100 * 1024
+        cached = []
+        for age, name in ((30, 'a'), (20, 'b'), (10, 'c')):
+            content = name.encode('utf-8') * 4 * 1024
+            cached.append(self.cache.put(self.file(name, content)))
+            os.utime(cached[-1], (time.time() - age, time.time() - age))
+        self.cache.get(digests_of(b'a' * 4 * 1024))
+        self.cache.max_size = 10 * 1024
+        self.cache.evict()
+        assert [os.path.exists(path) for path in cached] == [True, False, True]
+        assert sum(entry[1] for entry in self.cache.entries()) <= 10 * 1024
+
+
+class TestPypiDownloaderCache(object):
+    client = flexmock(
+        package_releases=lambda n: ['1'],
+        release_urls=lambda n, v: [{'url': 'https://files/spam-1.tar.gz',
+                                    'md5_digest': digests_of(CONTENT)['md5'],
+                                    'digests': digests_of(CONTENT)}],
+        release_data=lambda n, v: {},
+    )
+
+    def setup_method(self, method):
+        self.temp_dir = tempfile.mkdtemp()
+        flexmock(settings, CACHE_DIR=os.path.join(self.temp_dir, 'cache'))
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.temp_dir)
+
+    def test_release_digests(self):
+        assert release_digests(self.client, 'spam', '1', 'https://other/spam-1.tar.gz') == \
+            digests_of(CONTENT)
+        assert release_digests(self.client, 'spam', '1', 'https://files/spam-1.zip') == {}
+
+    def test_get(self):
+        def download(url, path, digests, consumers):
+            with open(path, 'wb') as f:
+                f.write(CONTENT)
+        flexmock(package_getters.download).should_receive('download').replace_with(
+            download).once()
+        for save_dir in ('first', 'second'):
+            getter = PypiDownloader(self.client, 'spam',
+                                    save_dir=os.path.join(self.temp_dir, save_dir))
+            save_file = getter.get()
+            assert os.path.basename(save_file) == 'spam-1.tar.gz'
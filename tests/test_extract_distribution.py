@@ -1,6 +1,52 @@
+import os
+import pickle
+import signal
+import sys
+import threading
+import time
+try:
+    import resource
+except ImportError:
+    resource = None
+
 import pytest
+from flexmock import flexmock
+
+from pyp2rpm import extract_distribution as extract_distribution_module
+from pyp2rpm.exceptions import SetupPyFailException, SetupPyTimeoutException
+from pyp2rpm.extract_distribution import (extract_distribution, DistributionSnapshot,
+                                          SetupPyPool, SetupPyZygote)
+
+
+def pid():
+    return os.getpid()
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+
+
+def exit(code):
+    raise SystemExit(code)
+
+
+def unpicklable():
+    raise SetupPyFailException(lambda: None)
+
 
-from pyp2rpm.extract_distribution import extract_distribution
+def imported(module):
+    __import__(module)
+    return module in sys.modules
+
+
+def loaded(module):
+    return module in sys.modules
+
+
+def address_space_limit():
+    if resource is None:
+        return None
+    return resource.getrlimit(resource.RLIMIT_AS)[0]
 
 
 class TestExtractDistribution(object):
@@ -15,3 +61,133 @@ class TestExtractDistribution(object):
     ])
     def test_list(self, var, expected):
         assert extract_distribution._list(var) == expected
+
+    @pytest.mark.parametrize(('var', 'expected'), [
+        ('python-six >= 1.9, custom-rpm-dep', ['python-six >= 1.9', 'custom-rpm-dep']),
+        ('\nspam\neggs', ['spam', 'eggs']),
+        (['spam, eggs'], ['spam, eggs']),
+        (None, []),
+    ])
+    def test_requires_list(self, var, expected):
+        assert extract_distribution._requires_list(var) == expected
+
+
+class TestDistributionSnapshot(object):
+
+    def test_snapshot(self):
+        distribution = flexmock(
+            force_arch=None, run_requires=['spam'], packages=(p for p in ['spam']),
+            metadata=flexmock(classifiers=None, long_description='Spam'),
+            has_ext_modules=lambda: None, get_license=lambda: 'MIT',
+            get_description=lambda: 'Spam', get_url=lambda: 'http://spam.org')
+        snapshot = pickle.loads(pickle.dumps(DistributionSnapshot(distribution)))
+        assert snapshot.run_requires == ['spam']
+        assert snapshot.packages == ['spam']
+        assert snapshot.metadata.classifiers == []
+        assert snapshot.has_ext_modules() is False
+        assert snapshot.get_license() == 'MIT'
+        assert not hasattr(snapshot, 'prep')
+
+
+@pytest.fixture(params=[SetupPyPool, SetupPyZygote])
+def pool_cls(request):
+    return request.param
+
+
+class TestSetupPyPool(object):
+
+    @pytest.fixture(autouse=True)
+    def pool(self, pool_cls):
+        self.pool = pool_cls(timeout=5)
+
+    def teardown_method(self, method):
+        self.pool.terminate()
+
+    def test_modules_dont_leak(self):
+        assert 'colorsys' not in sys.modules
+        assert self.pool.apply(imported, 'colorsys')
+        assert not self.pool.apply(loaded, 'colorsys')
+        assert 'colorsys' not in sys.modules
+
+    def test_fresh_worker(self):
+        first, second = self.pool.apply(pid), self.pool.apply(pid)
+        assert os.getpid() not in (first, second)
+        assert first != second
+
+    @pytest.mark.parametrize(('function', 'args', 'expected'), [
+        (exit, (3,), SystemExit),
+        (unpicklable, (), SetupPyFailException),
+    ])
+    def test_exception(self, function, args, expected):
+        with pytest.raises(expected):
+            self.pool.apply(function, *args)
+
+    def test_timeout(self):
+        self.pool.timeout = 0.5
+        with pytest.raises(SetupPyTimeoutException):
+            self.pool.apply(sleep, 10)
+        assert self.pool.apply(pid) != os.getpid()
+
+    @pytest.mark.skipif(resource is None or address_space_limit() != resource.RLIM_INFINITY,
+                        reason='address space already limited')
+    def test_memory_limit(self, pool_cls):
+        assert self.pool.apply(address_space_limit) == address_space_limit()
+        self.pool.terminate()
+        self.pool = pool_cls(timeout=5, memory_limit=1024 * 1024 * 1024)
+        assert self.pool.apply(address_space_limit) == 1024 * 1024 * 1024
+
+    def test_concurrent(self, pool_cls):
+        self.pool.terminate()
+        self.pool = pool_cls(processes=2, timeout=5)
+        self.pool.start()
+        threads = [threading.Thread(target=self.pool.apply, args=(sleep, 0.5))
+                   for i in range(2)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert time.time() - start < 0.9
+
+
+class TestSetupPyZygote(object):
+
+    def setup_method(self, method):
+        self.zygote = SetupPyZygote(timeout=5)
+
+    def teardown_method(self, method):
+        self.zygote.terminate()
+
+    def test_zygote_restarted(self):
+        self.zygote.start()
+        zygote_pid = self.zygote.pid
+        os.kill(zygote_pid, signal.SIGKILL)
+        for i in range(50):
+            if self.zygote.pid is None:
+                break
+            time.sleep(0.1)
+        assert self.zygote.pid is None
+        assert self.zygote.apply(pid) != os.getpid()
+        assert self.zygote.pid not in (None, zygote_pid)
+
+    def test_send_fails(self):
+        self.zygote.start()
+        connection = self.zygote.connection
+
+        def send(request):
+            raise IOError(32, 'Broken pipe')
+        self.zygote.connection = flexmock(send=send)
+        try:
+            with pytest.raises(SetupPyFailException):
+                self.zygote.apply(pid)
+        finally:
+            self.zygote.connection = connection
+        assert not self.zygote.requests
+
+    def test_child_fails(self, monkeypatch):
+        def call_in_worker(function, *args):
+            raise RuntimeError('maximum recursion depth exceeded')
+        monkeypatch.setattr(extract_distribution_module, 'call_in_worker', call_in_worker)
+        with pytest.raises(SetupPyFailException) as e:
+            self.zygote.apply(pid)
+        assert 'RuntimeError: maximum recursion depth exceeded' in str(e.value)
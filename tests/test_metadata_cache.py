@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+import time
+
+import pytest
+
+from flexmock import flexmock
+
+from pyp2rpm.convertor import Convertor
+from pyp2rpm.metadata_cache import MetadataCache, cache_key, metadata_cache
+from pyp2rpm import metadata_extractors
+from pyp2rpm import settings
+from pyp2rpm import version
+
+tests_dir = os.path.split(os.path.abspath(__file__))[0]
+
+DATA = {'name': 'spam', 'packages': set(['spam']), 'runtime_deps': [['Requires', 'eggs']],
+        'summary': u'\u017eluva', 'sphinx_dir': None, 'has_extension': False}
+
+
+class TestMetadataCache(object):
+    td_dir = '{0}/test_data/'.format(tests_dir)
+
+    def setup_method(self, method):
+        self.temp_dir = tempfile.mkdtemp()
+        flexmock(settings, CACHE_DIR=self.temp_dir)
+        self.cache = MetadataCache()
+        self.key = cache_key(self.td_dir + 'restsh-0.1.tar.gz', True, 'fedora')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.temp_dir)
+
+    def test_get_put(self):
+        assert self.cache.get(self.key) is None
+        self.cache.put(self.key, DATA)
+        assert self.cache.get(self.key) == DATA
+        assert os.listdir(os.path.join(self.temp_dir, 'metadata', self.key[:2])) == [self.key]
+
+    @pytest.mark.parametrize(('args', 'same'), [
+        (('restsh-0.1.tar.gz', True, 'fedora'), True),
+        (('plumbum-0.9.0.tar.gz', True, 'fedora'), False),
+        (('restsh-0.1.tar.gz', False, 'fedora'), False),
+        (('restsh-0.1.tar.gz', True, 'mageia'), False),
+    ])
+    def test_cache_key(self, args, same):
+        key = cache_key(self.td_dir + args[0], *args[1:])
+        assert (key == self.key) is same
+
+    def test_pyp2rpm_version(self):
+        flexmock(version, version='0.0.1')
+        assert cache_key(self.td_dir + 'restsh-0.1.tar.gz', True, 'fedora') != self.key
+
+    def test_expired(self):
+        self.cache.put(self.key, DATA)
+        path = self.cache.path(self.key)
+        os.utime(path, (time.time(), time.time() - settings.METADATA_CACHE_TTL - 1))
+        assert self.cache.get(self.key) is None
+        assert not os.path.exists(path)
+
+    def test_corrupted(self):
+        self.cache.put(self.key, DATA)
+        with open(self.cache.path(self.key), 'wb') as f:
+            f.write(b'spam')
+        assert self.cache.get(self.key) is None
+
+    def test_disabled(self):
+        flexmock(settings, METADATA_CACHE=False)
+        assert metadata_cache() is None
+
+
+class TestConvertorMetadataCache(object):
+    td_dir = '{0}/test_data/'.format(tests_dir)
+
+    def setup_method(self, method):
+        self.temp_dir = tempfile.mkdtemp()
+        flexmock(settings, CACHE_DIR=os.path.join(self.temp_dir, 'cache'))
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.temp_dir)
+
+    def convertor(self, **kwargs):
+        convertor = Convertor(package='{0}plumbum-0.9.0.tar.gz'.format(self.td_dir),
+                              save_dir=self.temp_dir, venv=False, **kwargs)
+        convertor._client = None
+        convertor.download()
+        return convertor
+
+    def test_cached(self):
+        expected = self.convertor().extract_metadata()
+        convertor = self.convertor()
+        flexmock(metadata_extractors.LocalMetadataExtractor).should_receive(
+            'extract_data').never()
+        # the archive isn't even opened
+        flexmock(metadata_extractors.StaticMetadataExtractor).should_receive(
+            '__init__').never()
+        flexmock(metadata_extractors.DistMetadataExtractor).should_receive(
+            '__init__').never()
+        data = convertor.extract_metadata()
+        assert data.data == expected.data
+        assert data.local_file == convertor.local_file
+
+    @pytest.mark.parametrize(('kwargs', 'cached'), [
+        ({}, True),
+        ({'distro': 'mageia'}, False),
+        ({'rpm_name': 'python-plumbum-spam'}, False),
+    ])
+    def test_key(self, kwargs, cached):
+        self.convertor().extract_metadata()
+        convertor = self.convertor(**kwargs)
+        flexmock(metadata_extractors.LocalMetadataExtractor).should_call(
+            'extract_data').times(0 if cached else 1)
+        convertor.extract_metadata()
+
+    @pytest.mark.parametrize('failed', ['pypi', 'virtualenv'])
+    def test_incomplete(self, failed, monkeypatch):
+        def extract_data(self, client=None):
+            data = extract(self, client)
+            data.incomplete.add(failed)
+            return data
+        extract = metadata_extractors.LocalMetadataExtractor.extract_data
+        monkeypatch.setattr(metadata_extractors.LocalMetadataExtractor, 'extract_data',
+                            extract_data)
+        self.convertor().extract_metadata()
+        assert not os.path.exists(os.path.join(self.temp_dir, 'cache', 'metadata'))
+
+    def test_disabled(self):
+        flexmock(settings, METADATA_CACHE=False)
+        self.convertor().extract_metadata()
+        assert not os.path.exists(os.path.join(self.temp_dir, 'cache', 'metadata'))
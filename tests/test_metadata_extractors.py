@@ -1,4 +1,9 @@
+import io
 import os
+import shutil
+import tarfile
+import tempfile
+import threading
 
 from tarfile import TarFile
 from zipfile import ZipFile
@@ -12,6 +17,8 @@ except ImportError:
     import xmlrpc.client as xmlrpclib
 
 import pyp2rpm.metadata_extractors as me
+from pyp2rpm import archive
+from pyp2rpm import declarative_metadata
 from pyp2rpm.archive import Archive
 from pyp2rpm.name_convertor import NameConvertor
 from pyp2rpm import settings
@@ -254,6 +261,66 @@ class TestPyPIMetadataExtension(object):
         data = self.e.extract_data(self.client)
         assert getattr(data, what) == expected
 
+    @pytest.mark.parametrize('concurrent', [True, False])
+    def test_extract_concurrent(self, concurrent):
+        flexmock(settings, CONCURRENT_EXTRACTION=concurrent)
+        threads = []
+
+        def release_data(name, version):
+            threads.append(threading.current_thread())
+            return self.client.release_data(name, version)
+        client = flexmock(release_urls=self.client.release_urls, release_data=release_data)
+        data = self.e.extract_data(client)
+        assert data.summary == 'A simple rest shell client'
+        assert (threads[0] is threading.current_thread()) is not concurrent
+
+    def test_client_fails(self):
+        def release_data(name, version):
+            raise xmlrpclib.Fault(1, 'spam')
+        data = self.e.extract_data(flexmock(release_data=release_data))
+        assert data.name == 'restsh'
+        assert not data.md5
+        assert 'pypi' in data.incomplete
+
+    def test_no_client(self):
+        assert 'pypi' not in self.e.extract_data().incomplete
+
+
+class TestConcurrentExtraction(object):
+    td_dir = '{0}/test_data/'.format(tests_dir)
+
+    def setup_method(self, method):
+        self.e = me.SetupPyMetadataExtractor('{0}restsh-0.1.tar.gz'.format(self.td_dir),
+                                             'restsh', NameConvertor('fedora'), '0.1',
+                                             venv=True)
+
+    @pytest.mark.parametrize('concurrent', [True, False])
+    def test_venv_data_precedence(self, concurrent):
+        flexmock(settings, CONCURRENT_EXTRACTION=concurrent)
+        threads = []
+
+        def data_from_venv(self):
+            threads.append(threading.current_thread())
+            return {'packages': ['restsh_venv'], 'scripts': ['restsh-3.6']}
+        flexmock(me.LocalMetadataExtractor, data_from_venv=property(data_from_venv))
+        data = self.e.extract_data()
+        assert data.packages == set(['restsh_venv'])
+        assert data.scripts == ['restsh']
+        assert (threads[0] is threading.current_thread()) is not concurrent
+
+    def test_venv_fails(self):
+        def data_from_venv(self):
+            raise ValueError('spam')
+        flexmock(me.LocalMetadataExtractor, data_from_venv=property(data_from_venv))
+        with pytest.raises(ValueError):
+            self.e.extract_data()
+
+    def test_venv_install_fails(self):
+        flexmock(me.LocalMetadataExtractor, data_from_venv=property(lambda self: None))
+        data = self.e.extract_data()
+        assert data.name == 'restsh'
+        assert data.incomplete == set(['virtualenv'])
+
 
 class TestSetupPyMetadataExtractor(object):
     td_dir = '{0}/test_data/'.format(tests_dir)
@@ -293,6 +360,232 @@ class TestSetupPyMetadataExtractor(object):
         assert data['doc_files'] == other
 
 
+class TestAstMetadataExtractor(object):
+    td_dir = '{0}/test_data/'.format(tests_dir)
+
+    def setup_method(self, method):
+        self.nc = NameConvertor('fedora')
+        self.e = []
+        for archive_file in ('plumbum-0.9.0.tar.gz', 'versiontools-1.9.1.tar.gz',
+                             'restsh-0.1.tar.gz', 'bitarray-0.8.0.tar.gz'):
+            name, version = archive_file.split('-')
+            self.e.append(me.AstMetadataExtractor('{0}{1}'.format(
+                self.td_dir, archive_file), name, self.nc, version[:5], venv=False))
+
+    @pytest.mark.parametrize(('i', 'expected'), [
+        (0, True),
+        (1, True),
+        (2, True),
+        (3, False),
+    ])
+    def test_is_static(self, i, expected):
+        assert self.e[i].is_static == expected
+
+    @pytest.mark.parametrize(('i', 'what', 'expected'), [
+        (0, 'license', 'MIT'),
+        (0, 'runtime_deps', [['Requires', 'python-six']]),
+        (0, 'packages', set(['plumbum'])),
+        (0, 'build_arch', 'noarch'),
+        (1, 'packages', set(['versiontools'])),
+        (1, 'has_test_suite', True),
+        (1, 'runtime_deps', [['Requires', 'python-setuptools']]),
+        (2, 'scripts', ['restsh']),
+        (2, 'build_deps', [['BuildRequires', 'python-setuptools'],
+                           ['BuildRequires', 'python-versiontools', '>=', '1.8'],
+                           ['BuildRequires', 'python2-devel']]),
+    ])
+    def test_extract(self, i, what, expected):
+        data = self.e[i].extract_data()
+        assert getattr(data, what) == expected
+
+    @pytest.mark.parametrize(('isolation', 'i', 'selective'), [
+        ('zygote', 1, True),
+        (None, 1, False),
+        # sources of extensions are globbed by setup.py of some packages
+        ('zygote', 3, False),
+    ])
+    def test_setup_py_members(self, isolation, i, selective):
+        flexmock(settings, SETUP_PY_ISOLATION=isolation)
+        with self.e[i].archive as a:
+            needed, skipped = self.e[i].setup_py_members
+            assert len(needed) + len(skipped) == len(a.index.members)
+        assert bool(skipped) is selective
+
+
+def make_sdist(directory, files):
+    """Creates spam-0.1.tar.gz in directory with files {name: content}"""
+    path = os.path.join(directory, 'spam-0.1.tar.gz')
+    tar = tarfile.open(path, 'w:gz')
+    for name, content in files.items():
+        content = content.encode('utf-8')
+        member = tarfile.TarInfo('spam-0.1/' + name)
+        member.size = len(content)
+        tar.addfile(member, io.BytesIO(content))
+    tar.close()
+    return path
+
+
+@pytest.mark.skipif(declarative_metadata.toml is None, reason='TOML parser required')
+class TestPyprojectSdist(object):
+    pyproject = '[project]\nname = "spam"\ndependencies = ["requests"]\n'
+
+    def setup_method(self, method):
+        self.temp_dir = tempfile.mkdtemp()
+        self.nc = NameConvertor('fedora')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.temp_dir)
+
+    def extractor(self, extractor_cls, files):
+        return extractor_cls(make_sdist(self.temp_dir, files), 'spam', self.nc, '0.1',
+                             venv=False)
+
+    @pytest.mark.parametrize('dynamic', [False, True])
+    def test_ast_uses_pyproject(self, dynamic):
+        pyproject = self.pyproject
+        if dynamic:
+            pyproject = pyproject.replace('dependencies = ["requests"]',
+                                          'dynamic = ["dependencies"]')
+        e = self.extractor(me.AstMetadataExtractor, {
+            'setup.py': 'from setuptools import setup\nsetup(packages=["spam"])\n',
+            'pyproject.toml': pyproject})
+        assert e.is_static is not dynamic
+        if not dynamic:
+            assert e.extract_data().runtime_deps == [['Requires', 'python-requests']]
+
+    @pytest.mark.parametrize(('extractor_cls', 'files'), [
+        (me.AstMetadataExtractor, {
+            'setup.py': 'from setuptools import setup\nsetup(test_suite="tests")\n',
+            'pyproject.toml': pyproject}),
+        (me.DeclarativeMetadataExtractor, {'pyproject.toml': pyproject}),
+    ])
+    def test_packages_discovered_by_setuptools(self, extractor_cls, files):
+        e = self.extractor(extractor_cls, files)
+        assert set(['packages', 'py_modules']) <= e.unresolved
+        assert not e.is_static
+
+
+class TestBdistRpmOptions(object):
+    setup_py = 'from setuptools import setup\nsetup(packages=["spam"], install_requires=["six"]{0})\n'
+    setup_cfg = '[bdist_rpm]\nrequires = python-six >= 1.9, custom-rpm-dep\n'
+
+    def setup_method(self, method):
+        self.temp_dir = tempfile.mkdtemp()
+        self.nc = NameConvertor('fedora')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.temp_dir)
+
+    def extractor(self, files):
+        return me.AstMetadataExtractor(make_sdist(self.temp_dir, files), 'spam', self.nc,
+                                       '0.1', venv=False)
+
+    @pytest.mark.parametrize(('options', 'setup_cfg', 'expected'), [
+        ('', setup_cfg, [['Requires', 'python-six', '>=', '1.9'],
+                         ['Requires', 'python-custom-rpm-dep']]),
+        (', options={"bdist_rpm": {"requires": ["eggs"]}}', None, [['Requires', 'python-eggs']]),
+        (', options={"bdist_rpm": {"requires": ["eggs"]}}', setup_cfg,
+         [['Requires', 'python-six', '>=', '1.9'], ['Requires', 'python-custom-rpm-dep']]),
+        (', options={"bdist_rpm": {"force_arch": "x86_64"}}', None, [['Requires', 'python-six']]),
+    ])
+    def test_requires(self, options, setup_cfg, expected):
+        files = {'setup.py': self.setup_py.format(options), 'spam/__init__.py': ''}
+        if setup_cfg is not None:
+            files['setup.cfg'] = setup_cfg
+        e = self.extractor(files)
+        assert e.is_static
+        assert e.runtime_deps_from_setup_py == expected
+
+    def test_force_arch(self):
+        e = self.extractor({'setup.py': self.setup_py.format(''), 'spam/__init__.py': '',
+                            'setup.cfg': '[bdist_rpm]\nforce-arch = x86_64\n'})
+        assert e.data_from_archive['build_arch'] == 'x86_64'
+
+    @pytest.mark.parametrize('options', [
+        ', options=OPTIONS',
+        ', options={"bdist_rpm": OPTIONS}',
+    ])
+    def test_unresolved(self, options):
+        e = self.extractor({'setup.py': self.setup_py.format(options), 'spam/__init__.py': ''})
+        assert 'options' in e.unresolved
+        assert not e.is_static
+
+
+class TestStaticMatchesDist(object):
+    """Static extractors must give the same metadata as running setup.py"""
+    setup_py = """from setuptools import setup
+setup(name='spam', version='0.1', description='Spam and eggs', license='MIT',
+      url='https://example.com/spam', packages=['spam', 'spam.eggs'], py_modules=['ham'],
+      install_requires=['six', 'requests!=2.0'], setup_requires=['setuptools_scm'],
+      tests_require=['pytest'], test_suite='tests',
+      entry_points=dict(console_scripts=['spam = spam:main']),
+      classifiers=['Programming Language :: Python :: 3.5']{0})
+"""
+
+    def setup_method(self, method):
+        self.temp_dir = tempfile.mkdtemp()
+        self.nc = NameConvertor('fedora')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.temp_dir)
+
+    @pytest.mark.parametrize(('options', 'setup_cfg'), [
+        ('', None),
+        ('', '[bdist_rpm]\nrequires = python-six >= 1.9, custom-rpm-dep\n'
+             'build_requires = spam\nforce-arch = x86_64\n'),
+        (', options={"bdist_rpm": {"requires": ["eggs"], "build_requires": ["ham"]}}', None),
+        (', options={"bdist_rpm": {"requires": ["eggs"], "prep_script": "prep.sh"}}',
+         '[bdist_rpm]\nrequires = python-six\n'),
+    ])
+    def test_same_data(self, options, setup_cfg):
+        files = {'setup.py': self.setup_py.format(options), 'prep.sh': '',
+                 'spam/__init__.py': '', 'spam/eggs/__init__.py': '', 'ham.py': '',
+                 'README': ''}
+        if setup_cfg is not None:
+            files['setup.cfg'] = setup_cfg
+        path = make_sdist(self.temp_dir, files)
+        static = me.AstMetadataExtractor(path, 'spam', self.nc, '0.1', venv=False)
+        assert static.is_static
+        dist = me.DistMetadataExtractor(path, 'spam', self.nc, '0.1', venv=False)
+        assert static.extract_data().data == dist.extract_data().data
+
+
+class TestDeclarativeMetadataExtractor(object):
+    td_dir = '{0}/test_data/'.format(tests_dir)
+
+    def setup_method(self, method):
+        self.nc = NameConvertor('fedora')
+        self.e = []
+        for archive_file in ('plumbum-0.9.0.tar.gz', 'coverage_pth-0.0.1.tar.gz',
+                             'versiontools-1.9.1.tar.gz', 'bitarray-0.8.0.tar.gz'):
+            name, version = archive_file.split('-')
+            self.e.append(me.DeclarativeMetadataExtractor('{0}{1}'.format(
+                self.td_dir, archive_file), name, self.nc, version[:5], venv=False))
+
+    @pytest.mark.parametrize(('i', 'expected'), [
+        (0, set()),
+        (1, set()),
+        (2, set(['test_suite'])),
+        (3, set(['classifiers', 'ext_modules', 'packages', 'py_modules'])),
+    ])
+    def test_unresolved(self, i, expected):
+        assert self.e[i].unresolved == expected
+        assert self.e[i].is_static == (not expected)
+
+    @pytest.mark.parametrize(('i', 'what', 'expected'), [
+        (0, 'license', 'MIT'),
+        (0, 'runtime_deps', [['Requires', 'python-six']]),
+        (0, 'packages', set(['plumbum'])),
+        (0, 'py_modules', []),
+        (0, 'build_arch', 'noarch'),
+        (1, 'runtime_deps', [['Requires', 'python-coverage']]),
+        (1, 'packages', set(['coverage_pth'])),
+    ])
+    def test_extract(self, i, what, expected):
+        data = self.e[i].extract_data()
+        assert getattr(data, what) == expected
+
+
 class TestWheelMetadataExtractor(object):
     td_dir = '{0}/test_data/'.format(tests_dir)
 
@@ -343,3 +636,14 @@ class TestDistMetadataExtractor(object):
     def test_extract(self, i, what, expected):
         data = self.e[i].extract_data()
         assert getattr(data, what) == expected
+
+    def test_selective_extraction(self):
+        e = me.DistMetadataExtractor('{0}versiontools-1.9.1.tar.gz'.format(self.td_dir),
+                                     'versiontools', self.nc, '1.9.1')
+        with e.archive as a:
+            needed, skipped = e.setup_py_members
+            total = sum(map(archive.MemberIndex.size, a.index.members))
+        assert 'versiontools-1.9.1/setup.py' in [m.name for m in needed]
+        assert skipped
+        assert e.extracted_bytes + e.skipped_bytes == total
+        assert e.skipped_bytes > 0
@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import time
+
+import pytest
+
+from flexmock import flexmock
+
+from pyp2rpm.convertor import Convertor
+from pyp2rpm.exceptions import NoSuchPackageException
+from pyp2rpm.mirror_index import MirrorIndex, canonical_name, split_filename
+from pyp2rpm.package_getters import MirrorGetter
+from pyp2rpm import settings
+
+PROJECT_PAGE = '''<!DOCTYPE html>
+<html><body>
+<a href="../../packages/aa/bb/spam-1.0.zip#md5=zipmd5">spam-1.0.zip</a><br/>
+<a href="../../packages/aa/bb/Spam-1.0.tar.gz#sha256=tarsha">Spam-1.0.tar.gz</a><br/>
+<a href="../../packages/aa/cc/spam-2.0b1.tar.gz#sha256=betasha">spam-2.0b1.tar.gz</a><br/>
+<a href="../../packages/aa/dd/spam-1.1-py2.py3-none-any.whl">spam-1.1-py2.py3-none-any.whl</a><br/>
+<a href="https://files.pythonhosted.org/spam-0.1.tar.gz">spam-0.1.tar.gz</a><br/>
+</body></html>
+'''
+
+
+def write(path, content=''):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+@pytest.mark.parametrize(('filename', 'project', 'expected'), [
+    ('spam-1.0.tar.gz', 'spam', '1.0'),
+    ('python-dateutil-2.8.0.tar.gz', 'python-dateutil', '2.8.0'),
+    ('zope.interface-4.1.zip', 'zope-interface', '4.1'),
+    ('spam_eggs-0.1-py3-none-any.whl', 'spam-eggs', '0.1'),
+    ('spam-1.0-py2.7.egg', 'spam', '1.0'),
+    ('spam-1.0.tar.gz', 'eggs', None),
+    ('spam-1.0.exe', 'spam', None),
+])
+def test_split_filename(filename, project, expected):
+    assert split_filename(filename, project) == expected
+
+
+def test_canonical_name():
+    assert canonical_name('Zope.Interface__x') == 'zope-interface-x'
+
+
+class MirrorFixture(object):
+    """Bandersnatch mirror with one plain PEP 503 project"""
+
+    def setup_method(self, method):
+        self.temp_dir = tempfile.mkdtemp()
+        flexmock(settings, CACHE_DIR=os.path.join(self.temp_dir, 'cache'))
+        self.root = os.path.join(self.temp_dir, 'mirror')
+        web = os.path.join(self.root, 'web')
+        write(os.path.join(web, 'simple', 'spam', 'index.html'), PROJECT_PAGE)
+        for path in ('aa/bb/spam-1.0.zip', 'aa/bb/Spam-1.0.tar.gz', 'aa/cc/spam-2.0b1.tar.gz',
+                     'aa/dd/spam-1.1-py2.py3-none-any.whl'):
+            write(os.path.join(web, 'packages', path))
+        # plain PEP 503 directory without index.html
+        write(os.path.join(web, 'simple', 'Eggs', 'eggs-0.1.tar.gz'))
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.temp_dir)
+
+
+class TestMirrorIndex(MirrorFixture):
+
+    def test_releases(self):
+        index = MirrorIndex(self.root)
+        releases = index.releases('SPAM')
+        assert sorted(releases) == ['1.0', '1.1', '2.0b1']
+        assert [r['url'] for r in releases['1.0']] == [
+            os.path.join(self.root, 'web', 'packages', 'aa', 'bb', 'spam-1.0.zip'),
+            os.path.join(self.root, 'web', 'packages', 'aa', 'bb', 'Spam-1.0.tar.gz')]
+        assert releases['1.0'][0]['md5_digest'] == 'zipmd5'
+        assert releases['1.0'][1]['digests'] == {'sha256': 'tarsha'}
+        assert list(index.releases('eggs')) == ['0.1']
+        assert index.releases('ham') == {}
+
+    def test_versions(self):
+        assert MirrorIndex(self.root).versions('spam') == ['1.1', '1.0', '2.0b1']
+
+    def test_persistent_index(self):
+        MirrorIndex(self.root).releases('spam')
+        index = MirrorIndex(self.root)
+        flexmock(index).should_receive('parse_project').never()
+        assert sorted(index.releases('spam')) == ['1.0', '1.1', '2.0b1']
+
+    def test_stale_project(self):
+        MirrorIndex(self.root).releases('spam')
+        time.sleep(0.01)
+        write(os.path.join(self.root, 'web', 'simple', 'Eggs', 'eggs-0.2.tar.gz'))
+        index = MirrorIndex(self.root)
+        assert sorted(index.releases('eggs')) == ['0.1', '0.2']
+
+
+class TestMirrorGetter(MirrorFixture):
+
+    def test_get(self):
+        getter = MirrorGetter(self.root, 'spam', '1.0', save_dir=self.temp_dir)
+        assert getter.get() == os.path.join(self.temp_dir, 'Spam-1.0.tar.gz')
+        assert getter.get_name_version() == ('spam', '1.0')
+
+    def test_get_wheel(self):
+        getter = MirrorGetter(self.root, 'spam', save_dir=self.temp_dir)
+        assert getter.version == '1.1'
+        assert os.path.basename(getter.get(wheel=True)) == 'spam-1.1-py2.py3-none-any.whl'
+
+    @pytest.mark.parametrize(('name', 'version'), [
+        ('ham', None),
+        ('spam', '3.0'),
+    ])
+    def test_no_such_package(self, name, version):
+        with pytest.raises(NoSuchPackageException):
+            MirrorGetter(self.root, name, version, save_dir=self.temp_dir)
+
+    def test_convertor(self):
+        c = Convertor(package='spam', save_dir=self.temp_dir, mirror=self.root)
+        assert isinstance(c.getter, MirrorGetter)
+        assert c.getter.get_name_version() == ('spam', '1.1')
@@ -1,6 +1,7 @@
 import pytest
 
-from pyp2rpm.name_convertor import NameConvertor, DandifiedNameConvertor, NameVariants
+from pyp2rpm.name_convertor import (NameConvertor, DandifiedNameConvertor, NameVariants,
+                                    canonical_index)
 from pyp2rpm import settings
 
 try:
@@ -82,6 +83,54 @@ class TestDandifiedNameConvertor(object):
         assert self.dnc.rpm_name(pypi_name, version) == expected
 
 
+class TestCanonicalIndex(object):
+    names = ['python3-Foo', 'foo-python', 'python-foo', 'python3-foo', 'py3foo', 'foo',
+             'python3-Foo', 'python3-babel', 'babel', 'python2-babel', 'PyYAML',
+             'python3-pyyaml']
+
+    def setup_method(self, method):
+        self.dnc = DandifiedNameConvertor.__new__(DandifiedNameConvertor)
+        NameConvertor.__init__(self.dnc, 'fedora')
+        self.dnc.names = set(self.names)
+        self.dnc.index = canonical_index(self.names)
+
+    def test_canonical_index(self):
+        index = canonical_index(self.names)
+        assert index['python3foo'] == ['python3-foo', 'python3-Foo']
+        assert index['pyyaml'] == ['PyYAML']
+
+    @pytest.mark.parametrize(('name', 'version'), [
+        ('foo', '3'),
+        ('foo', ''),
+        ('foo', '2'),
+        ('pyfoo', '3'),
+        ('PyYAML', '3'),
+        ('bar', '3'),
+    ])
+    def test_find_in_index(self, name, version):
+        expected = NameVariants(name, version)
+        for pkg_name in self.names:
+            expected.find_match(pkg_name)
+        variants = NameVariants(name, version)
+        variants.find_in_index(canonical_index(self.names))
+        assert variants.variants == expected.variants
+
+    def test_find_in_index_accepted(self):
+        variants = NameVariants('foo', '3')
+        variants.find_in_index(canonical_index(self.names), lambda name: name.islower())
+        assert variants.variants['python_ver_name'] == 'python3-foo'
+
+    @pytest.mark.parametrize(('pypi_name', 'version', 'expected'), [
+        ('Babel', '3', 'python3-babel'),
+        ('Babel', '2', 'python2-babel'),
+        ('foo', '3', 'python3-foo'),
+        ('PyYAML', '3', 'python3-pyyaml'),
+        ('bar', '3', 'python3-bar'),
+    ])
+    def test_rpm_name(self, pypi_name, version, expected):
+        assert self.dnc.rpm_name(pypi_name, version) == expected
+
+
 class TestNameVariants(object):
 
     def setup_method(self, method):
@@ -53,3 +53,13 @@ class TestPackageData(object):
         pd = PackageData('spam', init, 'python-spam', 'spam')
         pd.set_from(update_data, update=True)
         assert pd.data[key] == expected
+
+    def test_copy(self):
+        pd = PackageData('spam', 'spam', 'python-spam', 'spam')
+        pd.python_versions = ['2', '3']
+        pd_copy = pd.copy()
+        pd_copy.python_versions.remove('3')
+        pd_copy.base_python_version = '3'
+        assert pd.python_versions == ['2', '3']
+        assert pd.base_python_version == 'TODO:'
+        assert pd_copy.name == 'spam'
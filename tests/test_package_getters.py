@@ -1,3 +1,4 @@
+import errno
 import os
 import tempfile
 import shutil
@@ -144,3 +145,30 @@ class TestLocalFileGetter(object):
         assert os.path.samefile(self.l[1].get(), os.path.join(
             self.td_dir, 'Sphinx-1.1.3-py2.6.egg'))
         assert not os.path.exists(os.path.join(tmpdir, 'Sphinx-1.1.3-py2.6.egg'))
+
+    def test_get_wheel_in_place(self):
+        assert self.l[3].get() == os.path.abspath(
+            '{0}setuptools-19.6-py2.py3-none-any.whl'.format(self.td_dir))
+        assert not hasattr(self.l[3], 'temp_dir')
+
+    def test_get_links_file(self):
+        tmpdir = tempfile.mkdtemp()
+        self.l[0].save_dir = tmpdir
+        try:
+            save_file = self.l[0].get()
+            assert os.path.samefile(save_file, self.l[0].local_file)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_get_other_filesystem(self):
+        tmpdir = tempfile.mkdtemp()
+        self.l[0].save_dir = tmpdir
+        flexmock(os).should_receive('link').and_raise(OSError(errno.EXDEV, 'cross-device'))
+        try:
+            save_file = self.l[0].get()
+            assert not os.path.samefile(save_file, self.l[0].local_file)
+            with open(save_file, 'rb') as f, open(self.l[0].local_file, 'rb') as g:
+                assert f.read() == g.read()
+            assert os.listdir(tmpdir) == ['plumbum-0.9.0.tar.gz']
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,155 @@
+import threading
+
+import pytest
+
+try:
+    import xmlrpclib
+    from SocketServer import ThreadingMixIn
+    from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+except ImportError:
+    import xmlrpc.client as xmlrpclib
+    from socketserver import ThreadingMixIn
+    from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+from pyp2rpm.package_getters import PypiDownloader, get_url
+from pyp2rpm.pypi_client import PypiClient, PooledTransport
+
+RELEASES = {'spam': ['2', '1'], 'eggs': ['0.1']}
+
+
+class PypiRequestHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    rpc_paths = ('/pypi',)
+
+    def do_POST(self):
+        self.server.requests.append(self.client_address)
+        SimpleXMLRPCRequestHandler.do_POST(self)
+
+
+class PypiServer(ThreadingMixIn, SimpleXMLRPCServer):
+    """Stand-in for PyPI recording client addresses of all the requests"""
+    daemon_threads = True
+
+    def __init__(self, multicall=True):
+        SimpleXMLRPCServer.__init__(self, ('127.0.0.1', 0), PypiRequestHandler,
+                                    logRequests=False, allow_none=True)
+        self.requests = []
+        self.calls = []
+        if multicall:
+            self.register_multicall_functions()
+        for function in (self.package_releases, self.release_urls, self.release_data):
+            self.register_function(function)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/pypi'.format(self.server_address[1])
+
+    def package_releases(self, name):
+        self.calls.append(('package_releases', name))
+        return RELEASES.get(name, [])
+
+    def release_urls(self, name, version):
+        self.calls.append(('release_urls', name, version))
+        if version not in RELEASES.get(name, []):
+            return []
+        return [{'url': 'https://files/{0}-{1}.tar.gz'.format(name, version),
+                 'md5_digest': 'md5'}]
+
+    def release_data(self, name, version):
+        self.calls.append(('release_data', name, version))
+        if name == 'eggs':
+            raise ValueError('broken')
+        return {'name': name, 'version': version, 'download_url': ''}
+
+
+class TestPypiClient(object):
+
+    @pytest.fixture(autouse=True, params=[True, False], ids=['multicall', 'no_multicall'])
+    def server(self, request):
+        self.server = PypiServer(multicall=request.param)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.client = PypiClient(self.server.url)
+        yield
+        self.client.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_memo(self):
+        assert self.client.package_releases('spam') == ['2', '1']
+        assert self.client.package_releases('spam') == ['2', '1']
+        assert self.server.calls == [('package_releases', 'spam')]
+
+    def test_fault_memo(self):
+        for i in range(2):
+            with pytest.raises(xmlrpclib.Fault):
+                self.client.release_data('eggs', '0.1')
+        assert len(self.server.calls) == 1
+
+    def test_keep_alive(self):
+        for name in ('spam', 'eggs', 'ham'):
+            self.client.package_releases(name)
+        assert len(self.server.requests) == 3
+        assert len(set(self.server.requests)) == 1
+
+    def test_prefetch_package(self):
+        self.client.prefetch_package('spam', '1')
+        requests = len(self.server.requests)
+        # without multicall, the first failed multicall request is followed by 3 calls
+        assert requests == (1 if self.server.funcs.get('system.multicall') else 4)
+        PypiDownloader(self.client, 'spam', '1', save_dir='/tmp')
+        assert get_url(self.client, 'spam', '1')[1] == 'md5'
+        assert len(self.server.requests) == requests
+        assert len(self.server.calls) == 3
+
+    def test_prefetch_packages(self):
+        self.client.prefetch_packages([('spam', None), ('eggs', '0.1'), ('ham', None)])
+        if self.server.funcs.get('system.multicall'):
+            assert len(self.server.requests) == 2
+        assert sorted(self.server.calls) == [
+            ('package_releases', 'eggs'), ('package_releases', 'ham'),
+            ('package_releases', 'spam'),
+            ('release_data', 'eggs', '0.1'), ('release_data', 'spam', '2'),
+            ('release_urls', 'eggs', '0.1'), ('release_urls', 'spam', '2')]
+        with pytest.raises(xmlrpclib.Fault):
+            self.client.release_data('eggs', '0.1')
+        assert self.client.release_urls('spam', '2')[0]['md5_digest'] == 'md5'
+        assert len(self.server.calls) == 7
+
+    def test_prefetch_packages_known_versions(self):
+        self.client.prefetch_packages([('spam', '1'), ('eggs', '0.1')])
+        if self.server.funcs.get('system.multicall'):
+            assert len(self.server.requests) == 1
+        assert len(self.server.calls) == 6
+
+    def test_threads(self):
+        threads = [threading.Thread(target=self.client.package_releases, args=(str(i),))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(self.server.calls) == 8
+        assert self.client.transport.pool('127.0.0.1:{0}'.format(
+            self.server.server_address[1])).qsize() <= 4
+
+
+class TestPooledTransport(object):
+
+    def test_dead_connection(self):
+        server = PypiServer()
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        transport = PooledTransport()
+        client = xmlrpclib.ServerProxy(server.url, transport=transport)
+        try:
+            assert client.package_releases('spam') == ['2', '1']
+            for connection in list(transport.pools.values())[0].queue:
+                connection.sock.close()
+            assert client.package_releases('eggs') == ['0.1']
+        finally:
+            transport.close()
+            server.shutdown()
+            server.server_close()
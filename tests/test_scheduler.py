@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from pyp2rpm.scheduler import Scheduler, Stage
+
+
+def double(value):
+    return 2 * value
+
+
+def sleep_inversely(value):
+    time.sleep(0.05 * (5 - value))
+    return value
+
+
+def fail_on_two(value):
+    if value == 2:
+        raise ValueError(value)
+    return value
+
+
+class TestScheduler(object):
+
+    def test_ordered(self):
+        scheduler = Scheduler([Stage('sleep', sleep_inversely, 5), Stage('double', double)])
+        results = list(scheduler.run(range(5)))
+        assert [result.index for result in results] == [0, 1, 2, 3, 4]
+        assert [result.value for result in results] == [0, 2, 4, 6, 8]
+
+    def test_as_completed(self):
+        scheduler = Scheduler([Stage('sleep', sleep_inversely, 5)], ordered=False)
+        results = list(scheduler.run(range(5)))
+        assert [result.value for result in results] == [4, 3, 2, 1, 0]
+
+    @pytest.mark.parametrize('ordered', [True, False])
+    def test_error(self, ordered):
+        scheduler = Scheduler([Stage('fail', fail_on_two, 2), Stage('double', double, 2)],
+                              ordered=ordered)
+        results = sorted(scheduler.run(range(4)), key=lambda result: result.index)
+        assert [result.succeeded for result in results] == [True, True, False, True]
+        assert isinstance(results[2].error, ValueError)
+        assert results[2].stage == 'fail'
+        assert results[2].item == 2
+        assert results[3].value == 6
+
+    def test_backpressure(self):
+        read = []
+
+        def items():
+            for item in range(10):
+                read.append(item)
+                yield item
+
+        scheduler = Scheduler([Stage('double', double, 2)], max_pending=3)
+        results = scheduler.run(items())
+        assert next(results).value == 0
+        time.sleep(0.2)
+        assert len(read) <= 4
+        assert [result.value for result in results] == [2 * i for i in range(1, 10)]
+        assert len(read) == 10
@@ -0,0 +1,91 @@
+import pytest
+
+from pyp2rpm.setup_py_analyzer import SetupPyAnalyzer, FindPackages, StaticDistribution
+
+
+class TestSetupPyAnalyzer(object):
+
+    @pytest.mark.parametrize(('source', 'argument', 'expected'), [
+        ('setup(install_requires=["spam", "eggs"])', 'install_requires', ['spam', 'eggs']),
+        ('REQS = ["spam"]\nsetup(install_requires=REQS + ["eggs"])',
+         'install_requires', ['spam', 'eggs']),
+        ('REQS = ["spam"]\nREQS += ["eggs"]\nsetup(install_requires=REQS)',
+         'install_requires', ['spam', 'eggs']),
+        ('from setuptools import setup\nsetuptools.setup(py_modules=("spam",))',
+         'py_modules', ('spam',)),
+        ('kw = {}\nkw["license"] = "MIT"\nsetup(name="spam", **kw)', 'license', 'MIT'),
+        ('setup(entry_points=dict(console_scripts=["spam = spam:main"]))',
+         'entry_points', {'console_scripts': ['spam = spam:main']}),
+        ('if __name__ == "__main__":\n    setup(license="%s" % "MIT")', 'license', 'MIT'),
+    ])
+    def test_resolved(self, source, argument, expected):
+        analyzer = SetupPyAnalyzer(source)
+        assert analyzer.found
+        assert not analyzer.unresolved_arguments([argument])
+        assert analyzer.arguments[argument] == expected
+
+    @pytest.mark.parametrize(('source', 'argument'), [
+        ('setup(install_requires=open("requirements.txt").read().splitlines())',
+         'install_requires'),
+        ('REQS = ["spam"]\nREQS.append("eggs")\nsetup(install_requires=REQS)',
+         'install_requires'),
+        ('import sys\nREQS = []\nif sys.version_info < (3,):\n    REQS = ["spam"]\n'
+         'setup(install_requires=REQS)', 'install_requires'),
+        ('from spam import REQS\nsetup(install_requires=REQS)', 'install_requires'),
+        ('REQS = ["spam"]\nexec(open("spam.py").read())\nsetup(install_requires=REQS)',
+         'install_requires'),
+        ('setup(**kwargs)', 'install_requires'),
+        ('def main():\n    setup(install_requires=[])\nmain()', 'install_requires'),
+        ('setup(install_requires=[]', 'install_requires'),
+    ])
+    def test_unresolved(self, source, argument):
+        analyzer = SetupPyAnalyzer(source)
+        assert analyzer.unresolved_arguments([argument]) == set([argument])
+
+    def test_unresolved_not_required(self):
+        analyzer = SetupPyAnalyzer('setup(long_description=open("README").read(), '
+                                   'install_requires=["spam"])')
+        assert analyzer.unresolved == set(['long_description'])
+        assert not analyzer.unresolved_arguments(['install_requires'])
+
+    def test_find_packages(self):
+        analyzer = SetupPyAnalyzer('setup(packages=find_packages(exclude=["tests*"]))')
+        find_packages = analyzer.arguments['packages']
+        assert isinstance(find_packages, FindPackages)
+        files = set(['spam-1/spam/__init__.py', 'spam-1/spam/eggs/__init__.py',
+                     'spam-1/spam/data/file.txt', 'spam-1/tests/__init__.py'])
+        directories = set(['spam-1', 'spam-1/spam', 'spam-1/spam/eggs', 'spam-1/spam/data',
+                           'spam-1/tests'])
+        assert find_packages.find('spam-1', directories, files) == ['spam', 'spam.eggs']
+
+
+class TestStaticDistribution(object):
+
+    def test_attributes(self):
+        distribution = StaticDistribution({'install_requires': ['spam!=1.0'],
+                                           'setup_requires': ['eggs'],
+                                           'tests_require': ['ham'],
+                                           'entry_points': {'console_scripts': []},
+                                           'ext_modules': [object()],
+                                           'license': 'MIT'})
+        assert distribution.run_requires == ['spam!=1.0', 'setuptools']
+        assert distribution.build_requires == ['eggs', 'ham']
+        assert distribution.conflicts == ['spam=1.0']
+        assert distribution.has_ext_modules()
+        assert distribution.get_license() == 'MIT'
+        assert distribution.packages is None
+        assert distribution.metadata.classifiers == []
+
+    def test_bdist_rpm(self):
+        distribution = StaticDistribution({'install_requires': ['six'],
+                                           'setup_requires': ['eggs'],
+                                           'entry_points': {'console_scripts': []}},
+                                          bdist_rpm={'requires': ['python-six >= 1.9'],
+                                                     'build_requires': ['ham'],
+                                                     'force_arch': 'x86_64',
+                                                     'prep_script': 'prep.sh'})
+        assert distribution.run_requires == ['python-six >= 1.9', 'setuptools']
+        assert distribution.build_requires == ['ham']
+        assert distribution.force_arch == 'x86_64'
+        assert distribution.prep == 'prep.sh'
+        assert not hasattr(distribution, 'build')
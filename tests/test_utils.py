@@ -1,5 +1,13 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+
 import pytest
 
+from flexmock import flexmock
+
 from pyp2rpm import utils
 from pyp2rpm import settings
 
@@ -20,6 +28,39 @@ class TestUtils(object):
 
         return num
 
+    def test_lru_cache_evicts_least_recently_used(self):
+        cache = utils.LRUCache(6)
+        cache.set('a', 'aa')
+        cache.set('b', 'bb')
+        assert cache.get('a') == 'aa'
+        cache.set('c', 'cccc')
+        assert 'b' not in cache
+        assert cache.get('a') == 'aa'
+        assert cache.get('c') == 'cccc'
+        assert cache.size == 6
+
+    def test_lru_cache_counters(self):
+        cache = utils.LRUCache(10)
+        cache.set('none', None)
+        assert cache.get('none', 'default') is None
+        assert cache.get('spam', 'default') == 'default'
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_lru_cache_too_big_value(self):
+        cache = utils.LRUCache(2)
+        cache.set('a', 'aaa')
+        assert 'a' not in cache
+        assert cache.size == 0
+
+    @pytest.mark.parametrize(('input', 'expected'), [
+        ('', {}),
+        ('[console_scripts]\nspam = spam:main # comment\n\n[gui_scripts]\neggs = eggs:main',
+         {'console_scripts': ['spam = spam:main'], 'gui_scripts': ['eggs = eggs:main']}),
+        ('spam = spam:main', {}),
+    ])
+    def test_parse_entry_points(self, input, expected):
+        assert utils.parse_entry_points(input) == expected
+
     @pytest.mark.parametrize(("input", "expected"), [
         ([], ""),
         (['License :: OSI Approved :: Python Software Foundation License'], 'Python'),
@@ -63,3 +104,67 @@ class TestUtils(object):
     ])
     def test_unique_deps(self, input, expected):
         assert utils.unique_deps(input) == expected
+
+
+class TestBackgroundCall(object):
+
+    @pytest.mark.parametrize('background', [True, False])
+    def test_result(self, background):
+        call = utils.BackgroundCall(lambda a, b: (a + b, threading.current_thread()),
+                                    (1, 2), background=background)
+        value, thread = call.result()
+        assert value == 3
+        assert (thread is threading.current_thread()) is not background
+
+    @pytest.mark.parametrize('background', [True, False])
+    def test_error(self, background):
+        def fails():
+            raise ValueError('spam')
+        call = utils.BackgroundCall(fails, background=background)
+        with pytest.raises(ValueError):
+            call.result()
+
+
+class TestWriteSpec(object):
+
+    def setup_method(self, method):
+        self.temp_dir = tempfile.mkdtemp()
+        self.spec_path = os.path.join(self.temp_dir, 'python-spam.spec')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.temp_dir)
+
+    def test_write_spec(self):
+        utils.write_spec(self.spec_path, iter([u'Name: spam\n', u'Summary: \u017eluva\n']))
+        with io.open(self.spec_path, encoding='utf-8') as f:
+            assert f.read() == u'Name: spam\nSummary: \u017eluva\n'
+        assert os.listdir(self.temp_dir) == ['python-spam.spec']
+        assert os.stat(self.spec_path).st_mode & 0o044
+
+    def test_write_spec_mode(self):
+        with open(self.spec_path, 'w') as f:
+            f.write('old')
+        os.chmod(self.spec_path, 0o640)
+        # changing umask would affect files created by other threads meanwhile
+        flexmock(os).should_receive('umask').never()
+        utils.write_spec(self.spec_path, [u'Name: spam\n'])
+        assert os.stat(self.spec_path).st_mode & 0o777 == 0o640
+
+    def test_write_spec_fails(self):
+        with open(self.spec_path, 'w') as f:
+            f.write('old')
+
+        def chunks():
+            yield u'Name: spam\n'
+            raise ValueError('template error')
+        with pytest.raises(ValueError):
+            utils.write_spec(self.spec_path, chunks())
+        with open(self.spec_path) as f:
+            assert f.read() == 'old'
+        assert os.listdir(self.temp_dir) == ['python-spam.spec']
+
+    def test_print_spec(self):
+        stream = io.StringIO() if utils.PY3 else io.BytesIO()
+        utils.print_spec([u'Name: spam\n', u'Summary: \u017eluva'], stream)
+        expected = u'Name: spam\nSummary: \u017eluva\n'
+        assert stream.getvalue() == (expected if utils.PY3 else expected.encode('utf-8'))
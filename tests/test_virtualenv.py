@@ -1,9 +1,11 @@
 import pytest
 import os
+import sys
 import shutil
 import tempfile
 from flexmock import flexmock
 from pyp2rpm.virtualenv import *
+from virtualenvapi.manage import VirtualEnvironment
 from pyp2rpm.name_convertor import NameConvertor
 from pyp2rpm.settings import DEFAULT_DISTRO, DEFAULT_PYTHON_VERSION
 
@@ -58,6 +60,7 @@ class TestVirtualEnv(object):
 
     def setup_method(self, method):
         self.temp_dir = tempfile.mkdtemp()
+        flexmock(VirtualEnvironment).should_receive('open_or_create')
         self.venv = VirtualEnv(None, self.temp_dir,
                                NameConvertor(DEFAULT_DISTRO),
                                DEFAULT_PYTHON_VERSION)
@@ -65,14 +68,123 @@ class TestVirtualEnv(object):
     def teardown_method(self, method):
         shutil.rmtree(self.temp_dir)
 
-    @pytest.mark.parametrize(('bin_diff', 'package_diff', 'expected'), [
-        (set(['foo']), set(['foo']), (set(['foo']), set(), ['foo'])),
-        (set(['foo']), set(['foo.py', 'foo.pyc']), (set(), set(['foo']), ['foo'])),
-        (set([]), set(['foo.py']), (set(), set(['foo']), [])),
-        (set(['foo']), set([]), (set([]), set(), ['foo'])),
-        (set(), set(), (set(), set(), [])),
+    def write(self, path):
+        path = os.path.join(self.venv.target_dir, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').close()
+
+    def test_install_package_to_venv(self):
+        flexmock(self.venv.env).should_receive('install').with_args(
+            None, force=True,
+            options=['--no-deps', '--target', self.venv.target_dir]).once()
+        self.venv.install_package_to_venv()
+
+    @pytest.mark.parametrize(('record', 'expected'), [
+        (['foo/__init__.py', '../../bin/foo', 'foo-1.dist-info/RECORD'],
+         (set(['foo']), set(), ['foo'])),
+        (['foo.py', '__pycache__/foo.cpython-311.pyc', 'foo-1.dist-info/METADATA'],
+         (set(), set(['foo']), [])),
+        (['../../bin/foo', '../../bin/foo.pyc', '../../share/man/man1/foo.1'],
+         (set(), set(), ['foo'])),
+        (['foo/bin/helper.py', 'foo-nspkg.pth'], (set(['foo']), set(), [])),
+        ([], (set(), set(), [])),
     ])
-    def test_get_dirs_differance(self, bin_diff, package_diff, expected):
-        flexmock(DirsContent).should_receive('__sub__').and_return(
-            DirsContent(bin_diff, package_diff))
-        assert self.venv.get_dirs_differance == expected
+    def test_get_installed_content(self, record, expected):
+        self.write('foo-1.dist-info/RECORD')
+        with open(os.path.join(self.venv.target_dir, 'foo-1.dist-info', 'RECORD'), 'w') as f:
+            f.write(''.join('{0},,\n'.format(path) for path in record))
+        assert self.venv.get_installed_content == expected
+
+    def test_get_installed_content_without_record(self):
+        for path in ('foo/__init__.py', 'foo/bin/helper.py', 'bar.py', 'bin/baz',
+                     'foo-1-py3.10.egg-info/PKG-INFO'):
+            self.write(path)
+        assert self.venv.get_installed_content == (set(['foo']), set(['bar']), ['baz'])
+
+
+def fake_venv(path, python_version):
+    """Tree of virtualenv whose python is the running interpreter"""
+    os.makedirs(os.path.join(path, 'bin'))
+    os.makedirs(os.path.join(path, 'lib', 'python3.10', 'site-packages', 'pip'))
+    os.symlink('lib', os.path.join(path, 'lib64'))
+    os.symlink(sys.executable, os.path.join(path, 'bin', 'python'))
+    with open(os.path.join(path, 'bin', 'pip'), 'w') as f:
+        f.write('#!{0}/bin/python\n'.format(path))
+    with open(os.path.join(path, 'lib', 'python3.10', 'site-packages', 'pip', '__init__.py'),
+              'w') as f:
+        f.write('# pip\n')
+    with open(os.path.join(path, 'build.log'), 'w') as f:
+        f.write('created\n')
+
+
+class TestVenvPool(object):
+
+    def setup_method(self, method):
+        self.temp_dir = tempfile.mkdtemp()
+        self.pool = VenvPool(self.temp_dir, size=1)
+
+    def teardown_method(self, method):
+        self.pool.close()
+        shutil.rmtree(self.temp_dir)
+
+    def install(self, path):
+        site_packages_dir = site_packages(path)
+        os.makedirs(os.path.join(site_packages_dir, 'spam'))
+        for new_file in (os.path.join(site_packages_dir, 'eggs.py'),
+                         os.path.join(path, 'bin', 'spam'),
+                         os.path.join(path, 'share', 'spam.1')):
+            if not os.path.isdir(os.path.dirname(new_file)):
+                os.makedirs(os.path.dirname(new_file))
+            open(new_file, 'w').close()
+
+    def test_acquire(self):
+        flexmock(VenvPool).should_receive('create').replace_with(fake_venv).once()
+        path = self.pool.acquire('3')
+        base = self.pool.base_path('3')
+        init = os.path.join('lib', 'python3.10', 'site-packages', 'pip', '__init__.py')
+        assert os.path.samefile(os.path.join(path, init), os.path.join(base, init))
+        assert os.path.islink(os.path.join(path, 'lib64'))
+        assert not os.path.exists(os.path.join(path, 'build.log'))
+        with open(os.path.join(path, 'bin', 'pip')) as f:
+            assert f.read() == '#!{0}/bin/python\n'.format(path)
+        with open(os.path.join(base, 'bin', 'pip')) as f:
+            assert f.read() == '#!{0}/bin/python\n'.format(base)
+        assert self.pool.acquire('3') != path
+
+    def test_release(self):
+        flexmock(VenvPool).should_receive('create').replace_with(fake_venv).once()
+        path = self.pool.acquire('3')
+        other = self.pool.acquire('3')
+        self.install(path)
+        self.pool.release(path, '3')
+        self.pool.release(other, '3')
+        assert sorted(os.listdir(site_packages(path))) == ['pip']
+        assert sorted(os.listdir(os.path.join(path, 'bin'))) == ['pip', 'python']
+        assert not os.path.exists(os.path.join(path, 'share'))
+        # only one idle virtualenv is kept
+        assert not os.path.exists(other)
+        assert self.pool.acquire('3') == path
+
+    def test_base_reused(self):
+        flexmock(VenvPool).should_receive('create').replace_with(fake_venv).once()
+        self.pool.acquire('3')
+        pool = VenvPool(self.temp_dir)
+        pool.acquire('3')
+        pool.close()
+
+    def test_broken_base_recreated(self):
+        flexmock(VenvPool).should_receive('create').replace_with(fake_venv).twice()
+        self.pool.acquire('3')
+        os.remove(os.path.join(self.pool.base_path('3'), 'bin', 'python'))
+        pool = VenvPool(self.temp_dir)
+        pool.acquire('3')
+        pool.close()
+
+    def test_create_fails(self):
+        flexmock(VenvPool).should_receive('create').and_raise(
+            VirtualenvFailException('Failed to create virtualenv')).once()
+        for i in range(2):
+            with pytest.raises(VirtualenvFailException):
+                self.pool.acquire('3')
+        assert os.listdir(self.temp_dir) == []